@@ -0,0 +1,187 @@
+"""
+Morph Inspector
+Copyright (C) 2022  Cameron M Palmer [https://github.com/palmtrey/morphinspector]
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see [http://www.gnu.org/licenses/].
+
+=================================================================================
+
+aggregates.py is the single definition of the per-identity statistics of a
+morph: the count, mean, min, max and standard deviation of its distances to
+each of its two identities, and its details (see utils.morph_details).
+
+NaN distances are never counted, so every tool (details, ranks, ROC and DET
+curves, previews, bootstraps and the pipeline) averages the same way. An
+identity without any distance has a NaN mean.
+
+An AggregateTable holds these statistics for every (morph, identity) row of a
+dump set, computed with grouped NumPy reductions over all distances at once,
+plus every row's distances sorted (a flat array indexed by offsets). Tables
+are built once per dump set (see scores.load_aggregates) and cached.
+
+    Typical usage example:
+
+    table = AggregateTable.from_scores(scores.load_morph_scores('morph_csvs_dir'))
+    mated = table.mated_means(names)
+    details = table.details('00_0-01_0')
+"""
+
+
+import numpy as np
+import statistics
+from scipy.stats import wasserstein_distance
+
+
+AGGREGATE_CACHE_DIR = '../resources/cache/aggregates'
+
+# Bump whenever tables built from the same inputs change.
+AGGREGATE_CACHE_VERSION = 1
+
+STATS = ['count', 'mean', 'min', 'max', 'std']
+
+
+def finite_mean(distances: np.ndarray) -> float:
+  """Returns the mean of the non-NaN distances, NaN if there are none."""
+  distances = np.asarray(distances, dtype=float)
+  distances = distances[~np.isnan(distances)]
+  return float(np.sum(distances) / len(distances)) if len(distances) > 0 else np.nan
+
+
+def reduce_rows(rows: np.ndarray, distances: np.ndarray, n_rows: int) -> dict[str, np.ndarray]:
+  """Computes the statistics of every row from flat (row, distance) pairs in one pass.
+
+  Args:
+    rows: the row of every distance (0 to n_rows - 1).
+    distances: the distances.
+    n_rows: the number of rows.
+
+  Returns:
+    A dict of arrays with one value per row for every name in STATS,
+    plus 'samples', the non-NaN distances sorted by row and then by
+    value, and 'offsets', where row i's samples are
+    samples[offsets[i]:offsets[i + 1]].
+  """
+  finite = ~np.isnan(distances)
+  rows = rows[finite]
+  distances = distances[finite]
+
+  order = np.lexsort((distances, rows))
+  samples = distances[order]
+  sample_rows = rows[order]
+
+  count = np.bincount(sample_rows, minlength=n_rows)
+  offsets = np.zeros(n_rows + 1, dtype=np.int64)
+  np.cumsum(count, out=offsets[1:])
+
+  nonempty = count > 0
+  with np.errstate(divide='ignore', invalid='ignore'):
+    mean = np.bincount(sample_rows, weights=samples, minlength=n_rows) / count
+    std = np.sqrt(np.bincount(sample_rows, weights=(samples - mean[sample_rows]) ** 2, minlength=n_rows) / count)
+
+  minimum = np.full(n_rows, np.nan)
+  maximum = np.full(n_rows, np.nan)
+  minimum[nonempty] = samples[offsets[:-1][nonempty]]
+  maximum[nonempty] = samples[offsets[1:][nonempty] - 1]
+
+  return {'count': count, 'mean': mean, 'min': minimum, 'max': maximum, 'std': std,
+          'samples': samples, 'offsets': offsets}
+
+
+class AggregateTable():
+  """
+  Per (morph, identity) statistics of a set of morphs. Row 2 * i is
+  morph i's identity 1 (distance A), row 2 * i + 1 its identity 2
+  (distance B).
+  """
+
+  def __init__(self, names: list[str], stats: dict[str, np.ndarray]):
+    """
+    Args:
+      names: the morph names, one per pair of rows.
+      stats: the output of reduce_rows() over 2 * len(names) rows.
+    """
+    self.names = list(names)
+    self.index = {name: i for i, name in enumerate(self.names)}
+    self.stats = stats
+
+  @classmethod
+  def from_scores(cls, morph_scores: dict[str, tuple[np.ndarray, np.ndarray]]) -> 'AggregateTable':
+    """Builds a table from morph scores (see scores.load_morph_scores), sorted by morph name."""
+    names = sorted(morph_scores.keys())
+    parts = [np.asarray(distances, dtype=float) for name in names for distances in morph_scores[name]]
+    lengths = np.array([len(part) for part in parts], dtype=np.int64)
+
+    rows = np.repeat(np.arange(len(parts)), lengths)
+    distances = np.concatenate(parts) if len(parts) > 0 else np.array([], dtype=float)
+    return cls(names, reduce_rows(rows, distances, len(parts)))
+
+  def __len__(self) -> int:
+    return len(self.names)
+
+  def __contains__(self, name: str) -> bool:
+    return name in self.index
+
+  def keys(self) -> list[str]:
+    return self.names
+
+  def rows(self, names: list[str]) -> np.ndarray:
+    """Returns the identity 1 and identity 2 rows of every morph of names, interleaved."""
+    morphs = np.array([self.index[name] for name in names], dtype=np.int64)
+    return np.stack([2 * morphs, 2 * morphs + 1], axis=1).reshape(-1)
+
+  def get(self, stat: str, names: list[str] = None) -> np.ndarray:
+    """Returns a statistic (see STATS) as an (n, 2) array of the identity 1 and 2 rows of names (default all)."""
+    values = self.stats[stat] if names is None else self.stats[stat][self.rows(names)]
+    return values.reshape(-1, 2)
+
+  def mated_means(self, names: list[str]) -> np.ndarray:
+    """Returns the identity 1 and identity 2 means of every morph of names, interleaved (see scores.mated_means)."""
+    return self.stats['mean'][self.rows(names)]
+
+  def samples(self, name: str, identity: int) -> np.ndarray:
+    """Returns the sorted non-NaN distances of a morph to its identity 1 or 2."""
+    row = 2 * self.index[name] + identity - 1
+    return self.stats['samples'][self.stats['offsets'][row]:self.stats['offsets'][row + 1]]
+
+  def details(self, name: str) -> dict:
+    """Returns the details of a morph, as written by utils.writescores.
+
+    Raises:
+      statistics.StatisticsError: if the morph has no distance to one
+        of its identities.
+    """
+    row = 2 * self.index[name]
+    if self.stats['count'][row] == 0 or self.stats['count'][row + 1] == 0:
+      raise statistics.StatisticsError('no distances to an identity of ' + name)
+
+    distance_a = float(self.stats['mean'][row])
+    distance_b = float(self.stats['mean'][row + 1])
+
+    result = {}
+    result['avgdist'] = (distance_a + distance_b) / 2
+    result['distanceA'] = distance_a
+    result['distanceB'] = distance_b
+    result['1-wasserstein'] = wasserstein_distance(self.samples(name, 1), self.samples(name, 2))
+    return result
+
+  def save(self, table_file: str) -> None:
+    """Writes the table to an .npz file."""
+    with open(table_file, 'wb') as f:
+      np.savez(f, names=np.array(self.names, dtype=str), **self.stats)
+
+  @classmethod
+  def load(cls, table_file: str) -> 'AggregateTable':
+    """Reads a table written by save()."""
+    with np.load(table_file) as npz:
+      return cls(npz['names'].tolist(), {key: npz[key] for key in npz.files if key != 'names'})
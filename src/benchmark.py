@@ -0,0 +1,263 @@
+"""
+Morph Inspector
+Copyright (C) 2022  Cameron M Palmer [https://github.com/palmtrey/morphinspector]
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see [http://www.gnu.org/licenses/].
+
+=================================================================================
+
+benchmark.py times the analysis hot paths (writescores, encapsulate_morphs,
+gen_roc_curve, gen_det_curve, calc_mmpmr, rank_morphs and the heatmap binning)
+on a synthetic dataset (see synthetic.py). For every function it records the
+best wall time over a number of repeats, the peak traced memory of one extra
+run under tracemalloc and the throughput in files per second.
+
+Results can be saved as a baseline and later runs compared against it. A
+function regresses when its wall time or peak memory exceeds the baseline by
+more than the tolerance, in which case the exit status is 1. Baselines are
+only compared when they were recorded at the same dataset scale.
+
+Must be run from src/, like the other scripts.
+
+    Typical usage example:
+
+    python benchmark.py --morphs 500 --save-baseline
+    python benchmark.py --morphs 500
+"""
+
+
+import argparse
+import det_curve
+import heatmap
+import json
+import mmpmr
+import os
+import platform
+import ranking
+import roc_curve
+import scores
+import synthetic
+import tempfile
+import time
+import tracemalloc
+import utils
+
+
+BASELINE_FILE = '../resources/benchmarks/baseline.json'
+
+RESULT_COLUMNS = ['wall_time', 'peak_memory', 'throughput']
+
+
+def measure(function, repeat: int, setup=None) -> dict:
+  """Measures one benchmark function.
+
+  Args:
+    function: a callable taking no arguments.
+    repeat: the number of timed runs. The best wall time is kept.
+    setup: an optional callable run before every run, untimed.
+
+  Returns:
+    A dict with the best 'wall_time' in seconds and the 'peak_memory'
+    in bytes allocated by Python during a separate traced run.
+  """
+  times = []
+  for _ in range(repeat):
+    if setup is not None:
+      setup()
+    start = time.perf_counter()
+    function()
+    times.append(time.perf_counter() - start)
+
+  # tracemalloc slows everything down, so memory is measured in a
+  # run of its own.
+  if setup is not None:
+    setup()
+  tracemalloc.start()
+  function()
+  peak_memory = tracemalloc.get_traced_memory()[1]
+  tracemalloc.stop()
+
+  return {'wall_time': min(times), 'peak_memory': peak_memory}
+
+
+def run_benchmarks(data_dir: str, n_morphs: int, n_identities: int, stills_per_identity: int,
+                   repeat: int = 3, gamma_step: float = 0.001, only: list[str] = None) -> dict:
+  """Generates a synthetic dataset and runs every benchmark on it.
+
+  Args:
+    data_dir: the directory to generate the dataset in.
+    n_morphs: the number of morphs.
+    n_identities: the number of identities.
+    stills_per_identity: the number of stills per identity.
+    repeat: the number of timed runs per benchmark.
+    gamma_step: the gamma step of the ROC and DET curves.
+    only: optional list of benchmark names to run.
+
+  Returns:
+    A dict in the format
+
+    {'scale': {...}, 'platform': {...}, 'results': {name: {'wall_time': ..., 'peak_memory': ..., 'throughput': ...}}}
+  """
+  print('Generating synthetic dataset in ' + data_dir + '...')
+  paths = synthetic.generate_dataset(data_dir, n_morphs, n_identities, stills_per_identity)
+
+  # The details read by encapsulate_morphs and rank_morphs are written
+  # once, so any benchmark can run alone.
+  details_l2 = data_dir + '/details_l2.txt'
+  details_cosine = data_dir + '/details_cosine.txt'
+  utils.writescores(paths['morphs_csvs_l2'], details_l2, 'VGG-Face_euclidean_l2')
+  utils.writescores(paths['morphs_csvs_cosine'], details_cosine, 'VGG-Face_cosine')
+  writescores_output = data_dir + '/details_l2_benchmark.txt'
+
+  settings = utils.GUISettings(paths['morphs'], paths['stills'], '.jpg',
+                               details_cosine_path=details_cosine, details_l2_path=details_l2)
+  morph_cache_file = utils.get_morph_cache_file(settings)
+
+  def clear_morph_cache():
+    os.makedirs('../resources/cache', exist_ok=True)
+    if os.path.exists(morph_cache_file):
+      os.remove(morph_cache_file)
+
+  n_stills = n_identities * stills_per_identity
+
+  # name: (function, setup, number of files read per run). Curves are
+  # generated without any curve or aggregate cache, so every run reads
+  # and reduces the csvs.
+  benchmarks = {
+      'writescores': (lambda: utils.writescores(paths['morphs_csvs_l2'], writescores_output, 'VGG-Face_euclidean_l2'),
+                      None, n_morphs),
+      'encapsulate_morphs': (lambda: utils.encapsulate_morphs(settings), clear_morph_cache, n_morphs),
+      'gen_roc_curve': (lambda: roc_curve.gen_roc_curve(paths['morphs_csvs_l2'], paths['stills_csvs_l2'],
+                                                        gamma_step, use_cache=False),
+                        scores.clear_aggregates, n_morphs + n_stills),
+      'gen_det_curve': (lambda: det_curve.gen_det_curve(paths['morphs_csvs_l2'], paths['stills_csvs_l2'],
+                                                        gamma_step, use_cache=False),
+                        scores.clear_aggregates, n_morphs + n_stills),
+      'calc_mmpmr': (lambda: mmpmr.calc_mmpmr(paths['morphs_csvs_l2'], [0.86], 'VGG-Face_euclidean_l2'),
+                     None, n_morphs),
+      'rank_morphs': (lambda: ranking.rank_morphs(details_l2, 0.86), None, n_morphs),
+      'bin_heatmap': (lambda: heatmap.bin_heatmap(paths['morphs_csvs_cosine'], paths['morphs_csvs_l2']),
+                      None, 2 * n_morphs)
+      }
+
+  results = {}
+  try:
+    for name, (function, setup, items) in benchmarks.items():
+      if only is not None and name not in only:
+        continue
+
+      print('Benchmarking ' + name + '...')
+      result = measure(function, repeat, setup)
+      result['throughput'] = items / result['wall_time']
+      results[name] = result
+  finally:
+    if os.path.exists(morph_cache_file):
+      os.remove(morph_cache_file)
+
+  return {
+      'scale': {'morphs': n_morphs, 'identities': n_identities, 'stills_per_identity': stills_per_identity,
+                'gamma_step': gamma_step},
+      'platform': {'python': platform.python_version(), 'machine': platform.machine(), 'node': platform.node()},
+      'results': results}
+
+
+def compare_to_baseline(report: dict, baseline: dict, tolerance: float) -> list[str]:
+  """Compares a benchmark report to a baseline report.
+
+  Returns:
+    The names of the benchmarks whose wall time or peak memory exceeds
+    the baseline by more than tolerance (a fraction, ex. 0.2 for 20%).
+  """
+  regressions = []
+  for name, result in report['results'].items():
+    if name not in baseline['results']:
+      continue
+    base = baseline['results'][name]
+    if (result['wall_time'] > base['wall_time'] * (1 + tolerance)
+        or result['peak_memory'] > base['peak_memory'] * (1 + tolerance)):
+      regressions.append(name)
+
+  return regressions
+
+
+def print_report(report: dict, baseline: dict = None) -> None:
+  """Prints a table of benchmark results, with changes relative to a baseline."""
+  header = ['benchmark', 'wall time (s)', 'peak memory (MiB)', 'throughput (files/s)']
+  rows = []
+  for name, result in report['results'].items():
+    row = [name,
+           format(result['wall_time'], '.4f'),
+           format(result['peak_memory'] / 2**20, '.2f'),
+           format(result['throughput'], '.1f')]
+
+    if baseline is not None and name in baseline['results']:
+      base = baseline['results'][name]
+      row[1] += ' (' + format(result['wall_time'] / base['wall_time'] - 1, '+.0%') + ')'
+      row[2] += ' (' + format(result['peak_memory'] / max(base['peak_memory'], 1) - 1, '+.0%') + ')'
+
+    rows.append(row)
+
+  widths = [max(len(row[i]) for row in [header] + rows) for i in range(len(header))]
+  for row in [header] + rows:
+    print('  '.join(value.ljust(width) for value, width in zip(row, widths)))
+
+
+def main():
+  parser = argparse.ArgumentParser(description='Benchmarks the analysis hot paths on a synthetic dataset.')
+  parser.add_argument('--morphs', type=int, default=500, help='number of morphs')
+  parser.add_argument('--identities', type=int, default=100, help='number of identities')
+  parser.add_argument('--stills', type=int, default=4, help='number of stills per identity')
+  parser.add_argument('--repeat', type=int, default=3, help='number of timed runs per benchmark')
+  parser.add_argument('--only', nargs='+', default=None, help='only run these benchmarks')
+  parser.add_argument('--data-dir', default=None, help='directory to generate the dataset in (default: temporary)')
+  parser.add_argument('--baseline', default=BASELINE_FILE, help='baseline file to compare against')
+  parser.add_argument('--save-baseline', action='store_true', help='save the results as the new baseline')
+  parser.add_argument('--tolerance', type=float, default=0.2, help='allowed slowdown before flagging a regression')
+  parser.add_argument('--output', default=None, help='also write the results to this JSON file')
+  args = parser.parse_args()
+
+  if args.data_dir is None:
+    with tempfile.TemporaryDirectory() as data_dir:
+      report = run_benchmarks(data_dir, args.morphs, args.identities, args.stills, args.repeat, only=args.only)
+  else:
+    report = run_benchmarks(args.data_dir, args.morphs, args.identities, args.stills, args.repeat, only=args.only)
+
+  if args.output is not None:
+    with open(args.output, 'w') as f:
+      json.dump(report, f, indent=2)
+
+  baseline = None
+  if not args.save_baseline and os.path.exists(args.baseline):
+    with open(args.baseline, 'r') as f:
+      baseline = json.load(f)
+    if baseline['scale'] != report['scale']:
+      utils.report('Baseline was recorded at a different scale and is not compared.', utils.ReportType.WARNING)
+      baseline = None
+
+  print_report(report, baseline)
+
+  if args.save_baseline:
+    os.makedirs(os.path.dirname(args.baseline), exist_ok=True)
+    with open(args.baseline, 'w') as f:
+      json.dump(report, f, indent=2)
+    print('Saved baseline to ' + args.baseline)
+  elif baseline is not None:
+    regressions = compare_to_baseline(report, baseline, args.tolerance)
+    if len(regressions) > 0:
+      utils.report('Regressions: ' + ', '.join(regressions), utils.ReportType.ERROR)
+      exit(1)
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,302 @@
+"""
+Morph Inspector
+Copyright (C) 2022  Cameron M Palmer [https://github.com/palmtrey/morphinspector]
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see [http://www.gnu.org/licenses/].
+
+=================================================================================
+
+bootstrap.py computes subject-level bootstrap confidence intervals for AUC,
+EER, APCER @ BPCER and MMPMR without re-running gen_roc_curve per replicate.
+
+Subjects (identities) are resampled with replacement. A replicate is a vector
+of subject weights (how often each subject was drawn), and every score counts
+with the weight of its subject:
+  - each morph's mated average to identity A belongs to subject A, and the
+    one to identity B to subject B, as in gen_roc_curve / gen_det_curve;
+  - each still to still distance belongs to the subject of its still csv;
+  - each morph counts for MMPMR with weight(A) * weight(B), the number of
+    times the pair occurs in the resampled population.
+
+Scores are summarized once into per-subject cumulative counts below every
+gamma (searchsorted over the sorted scores), so all replicate curves follow
+from one matrix product: (replicates x subjects) @ (subjects x gammas).
+Operating points of all replicates are then interpolated in a single
+operating_points.query_operating_points call.
+
+    Typical usage example:
+
+    data = load_subject_scores('morph_csvs_dir', 'still_csvs_dir')
+    intervals = bootstrap_scores(data, curve_type='det', n_replicates=1000, workers=4)
+    print(intervals['EER'])  # {'estimate': ..., 'low': ..., 'high': ...}
+"""
+
+
+import dumps
+import identities
+import ingest
+import numpy as np
+import operating_points
+import scores
+from concurrent.futures import ProcessPoolExecutor
+
+
+def load_subject_scores(morphs_csvs_dir: str, stills_csvs_dir: str,
+                        distance_label: str = 'VGG-Face_euclidean_l2') -> dict:
+  """Reads the morph and still csvs of a dataset once for bootstrapping.
+
+  Returns:
+    A dict in the format
+
+    {'morph_scores': output of scores.load_morph_scores(),
+     'still_distances': array of nonzero still distances,
+     'still_subjects': array of the subject id of each still distance}
+  """
+  morph_scores = scores.load_morph_scores(morphs_csvs_dir, distance_label)
+
+  distances = []
+  subjects = []
+  read = lambda file: dumps.read_distances(stills_csvs_dir + '/' + file, distance_label)
+  for file, still_distances in ingest.read_files(read, sorted(dumps.listdir(stills_csvs_dir))):
+    still_distances = still_distances[still_distances != 0]
+    distances.append(still_distances)
+    subjects += [identities.still_identity(file)] * len(still_distances)
+
+  return {
+      'morph_scores': morph_scores,
+      'still_distances': np.concatenate(distances) if len(distances) > 0 else np.array([], dtype=float),
+      'still_subjects': np.array(subjects)}
+
+
+def subject_counts_below(values: np.ndarray, subjects: np.ndarray, n_subjects: int,
+                         gamma_list: np.ndarray) -> np.ndarray:
+  """Counts, for every subject and gamma, the values of that subject below gamma.
+
+  Args:
+    values: an array of scores. NaN values are never below gamma.
+    subjects: the subject index (0 to n_subjects - 1) of each score.
+    n_subjects: the number of subjects.
+    gamma_list: the thresholds.
+
+  Returns:
+    A (n_subjects, len(gamma_list)) array of counts.
+  """
+  valid = ~np.isnan(values)
+  values = values[valid]
+  subjects = subjects[valid]
+
+  if len(values) == 0:
+    return np.zeros((n_subjects, len(gamma_list)))
+
+  # Offset each subject's scores into a disjoint range so that one
+  # sorted array and one searchsorted call serve every subject.
+  low = min(values.min(), gamma_list.min())
+  span = max(values.max(), gamma_list.max()) - low + 1
+  keys = np.sort(subjects * span + (values - low))
+  starts = np.searchsorted(keys, np.arange(n_subjects) * span, side='left')
+
+  queries = np.arange(n_subjects)[:, None] * span + (gamma_list[None, :] - low)
+  return (np.searchsorted(keys, queries.ravel(), side='left').reshape(n_subjects, -1) - starts[:, None]).astype(float)
+
+
+def prepare(data: dict, names: list[str], gamma_list: np.ndarray) -> dict:
+  """Summarizes the scores of the selected morphs per subject.
+
+  Args:
+    data: output of load_subject_scores().
+    names: the morph names to use (None for all morphs).
+    gamma_list: the thresholds of the curves.
+
+  Returns:
+    A dict of per-subject arrays used by replicate_metrics().
+  """
+  morph_scores = data['morph_scores']
+  if names is None:
+    names = list(morph_scores.keys())
+  names = [name for name in names if name in morph_scores]
+
+  morph_ids = [identities.morph_identities(name) for name in names]
+  subject_names = sorted(set([id for ids in morph_ids for id in ids]) | set(data['still_subjects'].tolist()))
+  index = {subject: i for i, subject in enumerate(subject_names)}
+  n_subjects = len(subject_names)
+
+  mated = scores.mated_means(morph_scores, names)
+  mated_subjects = np.array([index[id] for ids in morph_ids for id in ids], dtype=np.int64)
+  still_subjects = np.array([index[id] for id in data['still_subjects']], dtype=np.int64)
+
+  # The first comparison to each identity, as used by mmpmr.calc_mmpmr.
+  first = np.full(len(names), np.nan)
+  for i, name in enumerate(names):
+    a, b = morph_scores[name]
+    if len(a) > 0 and len(b) > 0:
+      first[i] = max(a[0], b[0])
+
+  return {
+      'n_subjects': n_subjects,
+      'mated_below': subject_counts_below(mated, mated_subjects, n_subjects, gamma_list),
+      'mated_total': np.bincount(mated_subjects, minlength=n_subjects).astype(float),
+      'still_below': subject_counts_below(data['still_distances'], still_subjects, n_subjects, gamma_list),
+      'still_total': np.bincount(still_subjects, minlength=n_subjects).astype(float),
+      'morph_a': mated_subjects[0::2],
+      'morph_b': mated_subjects[1::2],
+      'morph_first': first}
+
+
+def replicate_curves(prepared: dict, weights: np.ndarray, curve_type: str) -> tuple[np.ndarray, np.ndarray]:
+  """Computes the curves of many replicates at once.
+
+  Args:
+    prepared: output of prepare().
+    weights: a (n_replicates, n_subjects) array of subject weights.
+    curve_type: 'roc' or 'det'.
+
+  Returns:
+    A tuple (x, y) of (n_replicates, n_gammas) arrays, as
+    gen_roc_curve or gen_det_curve would return for each replicate.
+  """
+  FN = weights @ prepared['mated_below']
+  TN = weights @ prepared['still_below']
+  mated_total = (weights @ prepared['mated_total'])[:, None]
+  still_total = (weights @ prepared['still_total'])[:, None]
+  TP = mated_total - FN
+  FP = still_total - TN
+
+  with np.errstate(divide='ignore', invalid='ignore'):
+    if curve_type == 'roc':
+      return (FP / (FP + TN), TP / (TP + FN))
+    elif curve_type == 'det':
+      return (FN / (TP + FN), FP / (FP + TN))
+
+  raise ValueError(curve_type + ' is not a valid curve type.')
+
+
+def replicate_metrics(prepared: dict, weights: np.ndarray, gamma_list: np.ndarray, curve_type: str,
+                      bpcer_targets: list[float], mmpmr_tau: list[float]) -> dict[str, np.ndarray]:
+  """Computes AUC, EER, APCER @ BPCER and MMPMR for many replicates at once.
+
+  Returns:
+    A dict mapping metric names to (n_replicates,) arrays.
+  """
+  x, y = replicate_curves(prepared, weights, curve_type)
+  apcer, bpcer = operating_points.to_apcer_bpcer(curve_type, (x, y))
+
+  result = {}
+
+  # AUC of the ROC curve (FPR = BPCER, TPR = 1 - APCER), whichever
+  # direction gamma runs in.
+  with np.errstate(invalid='ignore'):
+    tpr = 1 - apcer
+    result['AUC'] = np.abs(np.sum(np.diff(bpcer, axis=1) * (tpr[:, 1:] + tpr[:, :-1]) / 2, axis=1))
+
+  points = operating_points.query_operating_points(list(zip(apcer, bpcer)), 'det', gamma_list,
+                                                   apcer_at_bpcer=bpcer_targets, eer=True)
+  result.update(points)
+
+  pair_weights = weights[:, prepared['morph_a']] * weights[:, prepared['morph_b']]
+  first = prepared['morph_first']
+  valid = ~np.isnan(first)
+  total = pair_weights.sum(axis=1)
+  for tau in mmpmr_tau:
+    above = np.where(valid & (first > tau), first, 0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+      result['MMPMR@tau=' + str(tau)] = pair_weights @ above / total
+
+  return result
+
+
+def run_replicates(prepared: dict, gamma_list: np.ndarray, curve_type: str, bpcer_targets: list[float],
+                   mmpmr_tau: list[float], n_replicates: int, seed, chunk_size: int) -> dict[str, np.ndarray]:
+  """Draws n_replicates subject resamples and computes their metrics, chunk_size at a time."""
+  rng = np.random.default_rng(seed)
+  n_subjects = prepared['n_subjects']
+
+  results = []
+  for start in range(0, n_replicates, chunk_size):
+    n = min(chunk_size, n_replicates - start)
+    weights = rng.multinomial(n_subjects, np.full(n_subjects, 1 / n_subjects), size=n).astype(float)
+    results.append(replicate_metrics(prepared, weights, gamma_list, curve_type, bpcer_targets, mmpmr_tau))
+
+  return {name: np.concatenate([result[name] for result in results]) for name in results[0].keys()}
+
+
+def bootstrap_scores(data: dict,
+                     names: list[str] = None,
+                     curve_type: str = 'det',
+                     gamma_step: float = 0.001,
+                     n_replicates: int = 1000,
+                     confidence: float = 0.95,
+                     bpcer_targets: list[float] = (0.1, 0.05, 0.01),
+                     mmpmr_tau: list[float] = (0.86,),
+                     seed: int = 0,
+                     workers: int = 1,
+                     chunk_size: int = 100
+                     ) -> dict[str, dict[str, float]]:
+  """Computes percentile bootstrap confidence intervals.
+
+  Args:
+    data: output of load_subject_scores().
+    names: the morph names to use (ex. a rank from
+      ranking.rank_morphs()), or None for all morphs.
+    curve_type: 'roc' or 'det'.
+    gamma_step: the gamma step of the curves.
+    n_replicates: the number of bootstrap replicates.
+    confidence: the confidence level of the intervals.
+    bpcer_targets: BPCER targets to report APCER at.
+    mmpmr_tau: taus to report MMPMR at.
+    seed: the random seed. Results do not depend on workers.
+    workers: the number of worker processes to spread replicates over.
+    chunk_size: the number of replicates computed per batch.
+
+  Returns:
+    A dict mapping metric names ('AUC', 'EER', 'APCER@BPCER=0.1',
+    'MMPMR@tau=0.86', ...) to dicts with the point 'estimate' and the
+    'low' and 'high' interval bounds.
+  """
+  gamma_list = np.arange(0, 2 + gamma_step, gamma_step)
+  prepared = prepare(data, names, gamma_list)
+
+  estimate = replicate_metrics(prepared, np.ones((1, prepared['n_subjects'])), gamma_list, curve_type,
+                               bpcer_targets, mmpmr_tau)
+
+  # One seed per chunk, so that the replicates are the same however
+  # they are spread over workers.
+  n_chunks = -(-n_replicates // chunk_size)
+  seeds = np.random.SeedSequence(seed).spawn(n_chunks)
+  sizes = [min(chunk_size, n_replicates - i * chunk_size) for i in range(n_chunks)]
+  args = [(prepared, gamma_list, curve_type, bpcer_targets, mmpmr_tau, size, seed, chunk_size)
+          for size, seed in zip(sizes, seeds)]
+
+  if workers > 1:
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+      chunks = list(executor.map(run_replicates, *zip(*args)))
+  else:
+    chunks = [run_replicates(*arg) for arg in args]
+
+  alpha = (1 - confidence) / 2
+  result = {}
+  for name in estimate.keys():
+    replicates = np.concatenate([chunk[name] for chunk in chunks])
+    low, high = np.nanquantile(replicates, [alpha, 1 - alpha])
+    result[name] = {'estimate': float(estimate[name][0]), 'low': float(low), 'high': float(high)}
+
+  return result
+
+
+def format_intervals(intervals: dict[str, dict[str, float]], confidence: float = 0.95) -> str:
+  """Formats the output of bootstrap_scores() as one line per metric."""
+  lines = []
+  for name, interval in intervals.items():
+    lines.append(name + ': ' + format(interval['estimate'], '.4g') + ' (' + format(confidence, '.0%') + ' CI '
+                 + format(interval['low'], '.4g') + ' - ' + format(interval['high'], '.4g') + ')')
+  return '\n'.join(lines)
@@ -0,0 +1,184 @@
+"""
+Morph Inspector
+Copyright (C) 2022  Cameron M Palmer [https://github.com/palmtrey/morphinspector]
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see [http://www.gnu.org/licenses/].
+
+=================================================================================
+
+cache.py provides input fingerprints, a compact binary curve format and a
+curve cache keyed by those fingerprints. A fingerprint is stat-based: it
+changes whenever a file in an input directory is added, removed, resized or
+modified (by modification time), so cached curves are reused only while their
+inputs look unchanged. File contents are never read.
+
+Curves are stored as .npz files holding float64 'x' and 'y' arrays and a
+JSON 'metadata' header recording the input fingerprints, gamma grid and
+distance metric they were generated from.
+
+    Typical usage example:
+
+    # Cached transparently under CURVE_CACHE_DIR
+    xy = roc_curve.gen_roc_curve('morph_csvs_dir', 'still_csvs_dir', 0.001)
+
+    save_curve('roc_curve.npz', xy, {'dataset': 'clarkson'})
+    xy, metadata = load_curve('roc_curve.npz')
+"""
+
+
+import hashlib
+import json
+import numpy as np
+import os
+
+
+CURVE_CACHE_DIR = '../resources/cache/curves'
+
+# Bump whenever curves generated from the same inputs change.
+CURVE_CACHE_VERSION = 2
+
+
+def fingerprint_path(path: str) -> str:
+  """Returns a fingerprint of a file or directory.
+
+  Directories are fingerprinted by the name, size and modification
+  time of each of their entries, files by their own size and
+  modification time. File contents are not read.
+
+  Args:
+    path: the path to a file or directory.
+
+  Returns:
+    A hex digest string. Missing paths get a fixed fingerprint.
+  """
+  h = hashlib.sha1()
+
+  if os.path.isdir(path):
+    for entry in sorted(os.scandir(path), key=lambda e: e.name):
+      stat = entry.stat()
+      h.update((entry.name + '\t' + str(stat.st_size) + '\t' + str(stat.st_mtime_ns) + '\n').encode())
+  elif os.path.exists(path):
+    stat = os.stat(path)
+    h.update((str(stat.st_size) + '\t' + str(stat.st_mtime_ns)).encode())
+  else:
+    h.update(b'missing')
+
+  return h.hexdigest()
+
+
+def cache_key(*parts) -> str:
+  """Combines fingerprints and parameters into a single cache key."""
+  return hashlib.sha1(json.dumps(parts, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def save_curve(curve_file: str, xy: tuple[list[float], list[float]], metadata: dict, dtype=np.float64) -> None:
+  """Saves a curve and its metadata header to a .npz file.
+
+  Args:
+    curve_file: the path of the .npz file to write.
+    xy: a curve as returned by gen_roc_curve or gen_det_curve.
+    metadata: a JSON-serializable dict to store with the curve.
+    dtype: np.float64, or np.float32 for half-size files.
+  """
+  with open(curve_file + '.tmp', 'wb') as f:
+    np.savez(f,
+             x=np.asarray(xy[0], dtype=dtype),
+             y=np.asarray(xy[1], dtype=dtype),
+             metadata=np.array(json.dumps(metadata, default=str)))
+
+  # Replace atomically so that a killed run never leaves a truncated
+  # curve file behind.
+  os.replace(curve_file + '.tmp', curve_file)
+
+
+def load_curve(curve_file: str) -> tuple[tuple[list[float], list[float]], dict]:
+  """Loads a curve saved by save_curve().
+
+  Returns:
+    A tuple containing the curve, as tuple(x, y) lists like
+    gen_roc_curve and gen_det_curve return, and its metadata dict.
+  """
+  with np.load(curve_file) as npz:
+    return ((npz['x'].tolist(), npz['y'].tolist()), json.loads(str(npz['metadata'])))
+
+
+class CurveCache():
+  """
+  A cache of the curves generated from one pair of morph and still csv
+  directories, keyed by stat-based fingerprints (see fingerprint_path).
+  Curves are stored under CURVE_CACHE_DIR, named by the hash of their
+  metadata.
+
+  File contents are not hashed, so a dump regenerated with the same
+  file sizes and preserved modification times (ex. cp -p, rsync -t)
+  is taken as unchanged and its stale curves are returned. Delete
+  the cache or pass use_cache=False after such a change.
+  """
+
+  def __init__(self, curve_type: str, morphs_csvs_dir: str, stills_csvs_dir: str, gamma_list: np.ndarray,
+               distance_label: str, cache_dir: str = CURVE_CACHE_DIR):
+    self.cache_dir = cache_dir
+    self.metadata = {
+        'version': CURVE_CACHE_VERSION,
+        'curve': curve_type,
+        'morphs_csvs_dir': morphs_csvs_dir,
+        'morphs_fingerprint': fingerprint_path(morphs_csvs_dir),
+        'stills_csvs_dir': stills_csvs_dir,
+        'stills_fingerprint': fingerprint_path(stills_csvs_dir),
+        'gamma_start': float(gamma_list[0]),
+        'gamma_stop': float(gamma_list[-1]),
+        'gamma_count': len(gamma_list),
+        'distance_label': distance_label
+        }
+
+  def get_metadata(self, names: list[str]) -> dict:
+    """Returns the metadata of the curve of a list of morph names (None for all morphs)."""
+    metadata = dict(self.metadata)
+    metadata['subset'] = None if names is None else cache_key(sorted(names))
+    return metadata
+
+  def get_curve_file(self, metadata: dict) -> str:
+    # Directory paths are not part of the key, only their fingerprints.
+    key = cache_key({k: v for k, v in metadata.items() if k not in ['morphs_csvs_dir', 'stills_csvs_dir']})
+    return self.cache_dir + '/' + key + '.npz'
+
+  def lookup(self, subset) -> dict:
+    """Looks up the curves of a subset selector (see gen_roc_curve).
+
+    Returns:
+      A dict mapping each label of the subset (None if the subset is
+      not a dict) to its curve, or None if any curve is not cached.
+    """
+    if not isinstance(subset, dict):
+      subset = {None: subset}
+
+    curves = {}
+    for label, names in subset.items():
+      curve_file = self.get_curve_file(self.get_metadata(names))
+      if not os.path.exists(curve_file):
+        return None
+      curves[label] = load_curve(curve_file)[0]
+
+    return curves
+
+  def store(self, subset, curves: dict) -> None:
+    """Stores the curves computed for a subset selector."""
+    if not isinstance(subset, dict):
+      subset = {None: subset}
+
+    os.makedirs(self.cache_dir, exist_ok=True)
+
+    for label, names in subset.items():
+      metadata = self.get_metadata(names)
+      save_curve(self.get_curve_file(metadata), curves[label], metadata)
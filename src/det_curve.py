@@ -1,17 +1,29 @@
+import cache
 import matplotlib.pyplot as plt
 import numpy as np
-import os
-from tqdm import tqdm
-import utils
-
-
-def gen_det_curve(morphs_csvs_dir: str, stills_csvs_dir: str, gamma_step: float) -> tuple[list]:
+import operating_points
+import plotting
+import preview as previews
+import scores
+import timing
+
+
+def gen_det_curve(morphs_csvs_dir: str,
+                  stills_csvs_dir: str,
+                  gamma_step: float,
+                  subset=None,
+                  distance_label: str = 'VGG-Face_euclidean_l2',
+                  use_cache: bool = True,
+                  preview: float = None
+                  ) -> tuple[list]:
   """Generates x and y data for a DET curve.
 
   Generates the data for a DET curve given NearFace csvs for morphs
   (compared to all stills), a directory of stills, and an increment
   to step gamma (the recognition threshold) by.
 
+  Morph and still csvs are read only once, so any number of subset
+  curves (ex. one per rank) cost no more I/O than the full set.
 
   Args:
   morphs_csvs_dir: path to a directory containing csvs for morphs
@@ -20,6 +32,23 @@ def gen_det_curve(morphs_csvs_dir: str, stills_csvs_dir: str, gamma_step: float)
   gamma_step: a value by which to increment gamma by. Lower
     gamma_step will lead to more data and a higher resolution ROC
     curve.
+  subset: optional morph selector. Either a list of morph names
+    (ex. '00_0-01_0') to restrict the curve to, or a dict mapping
+    labels to lists of morph names, such as the output of
+    ranking.rank_morphs(). A value of None in the dict selects
+    all morphs.
+  distance_label: the csv file label for distances
+    (ex. 'VGG-Face_cosine', 'VGG-Face_euclidean_l2', etc.)
+  use_cache: if True, curves already generated from unchanged csv
+    directories are loaded from cache.CURVE_CACHE_DIR instead of
+    being recomputed, and new curves are stored there. Aggregate
+    tables are cached likewise (see scores.load_aggregates). If
+    False, no cache is read or written.
+  preview: if given, the fraction of morphs and stills to compute
+    the curves from, drawn as a stratified sample by rank (the
+    labels of a subset dict) and identity. The standard error of
+    the preview is reported. See preview.Preview for progressive
+    refinement. Previews are not cached.
 
   Returns:
   x and y coordinate data for the roc curve in the form
@@ -28,90 +57,57 @@ def gen_det_curve(morphs_csvs_dir: str, stills_csvs_dir: str, gamma_step: float)
 
   where x and y are both lists of float values, x is APCER, y is
   BPCER for all gamma.
-  """
 
-  # Create a list of all morph names
-  morphs = []
-
-  for file in os.listdir(morphs_csvs_dir):
-    morphs.append(file.split('.')[0])
+  If subset is a dict, a dict mapping each of its labels to such
+  a tuple is returned instead.
+  """
 
-  FP = 0
-  TN = 0
+  if preview is not None:
+    result = previews.Preview(morphs_csvs_dir, stills_csvs_dir, distance_label, subset).curve(
+        'det', preview, gamma_step, subset)
+    previews.report_error(result, 'det')
+    return result['curves'] if isinstance(subset, dict) else result['curves'][None]
 
   gamma_list = np.arange(0, 2 + gamma_step, gamma_step)
 
-  result_dict = {}
-
-  for gamma in gamma_list:
-    result_dict[gamma] = {'FP': 0, 'TN': 0, 'TP': 0, 'FN': 0, 'TPR': 0.0, 'FPR': 0.0}
+  curve_cache = None
+  if use_cache:
+    with timing.span('det.cache_lookup'):
+      curve_cache = cache.CurveCache('det', morphs_csvs_dir, stills_csvs_dir, gamma_list, distance_label)
+      curves = curve_cache.lookup(subset)
+    if curves is not None:
+      return curves if isinstance(subset, dict) else curves[None]
 
   # Start with morph compared to identities (these all should be negative/zero)
   print('Retrieving data from morphs...')
-  for file in tqdm(os.listdir(morphs_csvs_dir)):
-    a_b = utils.import_morph_nearface_csv(morphs_csvs_dir + '/' + file)
-    id_a = a_b[0]
-    id_b = a_b[1]
-
-    id_a_avg = np.nanmean(list(id_a.values()))
-    id_b_avg = np.nanmean(list(id_b.values()))
-
-    for gamma in gamma_list:
-      if not utils.classify(id_a_avg, gamma): # This should yield a 0 from the FRS
-        result_dict[gamma]['TP'] += 1
-      else:
-        result_dict[gamma]['FN'] += 1
-
-  # for distance in id_b.values():
-    if not utils.classify(id_b_avg, gamma):
-      result_dict[gamma]['TP'] += 1
-    else:
-      result_dict[gamma]['FN'] += 1
+  with timing.span('det.load_morphs'):
+    table = scores.load_aggregates(morphs_csvs_dir, distance_label, scores.subset_names(subset),
+                                    use_cache=use_cache)
+  timing.count('det.load_morphs', 'morphs', len(table))
 
   # Then compare stills to stills
   print('Retrieving data from stills...')
-  for file in tqdm(os.listdir(stills_csvs_dir)):
-    id = utils.import_still_nearface_csv(stills_csvs_dir + '/' + file)
-
-    for gamma in gamma_list:
-      for distance in id.values():
-        if distance != 0:
-          if utils.classify(distance, gamma): # This should yield a 1 from the FRS
-            result_dict[gamma]['TN'] += 1
-          else:
-            result_dict[gamma]['FP'] += 1
-
-  # Calculate true positive rate and false positive rate for each gamma
-  for gamma in result_dict.keys():
-    # Regular
-    FP = result_dict[gamma]['FP']
-    TN = result_dict[gamma]['TN']
-    TP = result_dict[gamma]['TP']
-    FN = result_dict[gamma]['FN']
-
-    # Zander's inverted
-    # FN = result_dict[gamma]['FP']
-    # TP = result_dict[gamma]['TN']
-    # TN = result_dict[gamma]['TP']
-    # FP = result_dict[gamma]['FN']
-
-    # Actual inverted
-    # TP = result_dict[gamma]['FP']
-    # FN = result_dict[gamma]['TN']
-    # FP = result_dict[gamma]['TP']
-    # TN = result_dict[gamma]['FN']
-
-    result_dict[gamma]['APCER'] = FN / (TP + FN)
-    result_dict[gamma]['BPCER'] = FP / (FP + TN)
-
-  x = []  # false positive rate
-  y = []  # true positive rate
-
-  for label in result_dict.keys():
-    x.append(result_dict[label]['APCER'])
-    y.append(result_dict[label]['BPCER'])
-
-  return (x, y)
+  with timing.span('det.load_stills'):
+    still_distances = scores.load_still_scores(stills_csvs_dir, distance_label)
+  timing.count('det.load_stills', 'distances', len(still_distances))
+
+  curves = {}
+
+  for label, names in scores.select_subsets(table, subset).items():
+    with timing.span('det.counts'):
+      counts = scores.confusion_counts(table.mated_means(names), still_distances, gamma_list)
+
+    x, y = scores.curve_rates(counts, 'det')
+    curves[label] = (x.tolist(), y.tolist())
+
+  if curve_cache is not None:
+    with timing.span('det.cache_store'):
+      curve_cache.store(subset, curves)
+
+  if isinstance(subset, dict):
+    return curves
+
+  return curves[None]
 
 
 def plot_det_curve(xy: tuple[list[float], list[float]], plot_title: str) -> None:
@@ -148,15 +144,15 @@ def det_curve_stats(xy: tuple[list[float], list[float]]) -> None:
     APCER @ BPCER = 0.1
     APCER @ BPCER = 0.05
     APCER @ BPCER = 0.01
+
+  Values are interpolated between the two nearest points of the curve
+  (see operating_points.query_curve).
   """
-  
-  apcer = xy[0]
-  bpcer = xy[1]
 
-  print('APCER @ BPCER = 1.0: ' + str(apcer[min(range(len(bpcer)), key=lambda i: abs(bpcer[i]-1.0))]))
-  print('APCER @ BPCER = 0.1: ' + str(apcer[min(range(len(bpcer)), key=lambda i: abs(bpcer[i]-0.1))]))
-  print('APCER @ BPCER = 0.05: ' + str(apcer[min(range(len(bpcer)), key=lambda i: abs(bpcer[i]-0.05))]))
-  print('APCER @ BPCER = 0.01: ' + str(apcer[min(range(len(bpcer)), key=lambda i: abs(bpcer[i]-0.01))]))
+  stats = operating_points.query_curve(xy, 'det', apcer_at_bpcer=[1.0, 0.1, 0.05, 0.01])
+
+  for name, value in stats.items():
+    print(name.replace('@', ' @ ').replace('=', ' = ') + ': ' + str(value))
 
 
 def plot_multiple_det_curve(
@@ -168,9 +164,22 @@ def plot_multiple_det_curve(
     xy0_label: str = '',
     xy1_label: str = '',
     xy2_label: str = '',
-    xy3_label: str = ''):
+    xy3_label: str = '',
+    output_file: str = None):
+
+  """Same as plot_det_curve, except can plot up to four curves on one plot.
+
+  If output_file is given, the curves are drawn as lines and written to
+  that file (png, svg, pdf, ...) through the Agg backend instead of being
+  shown. Use plotting.render_curves directly for more than four curves.
+  """
 
-  """Same as plot_det_curve, except can plot up to four curves on one plot."""
+  if output_file is not None:
+    curves = [xy for xy in [xy0, xy1, xy2, xy3] if xy is not None]
+    labels = [label for xy, label in zip([xy0, xy1, xy2, xy3], [xy0_label, xy1_label, xy2_label, xy3_label])
+              if xy is not None]
+    plotting.render_curves(curves, output_file, 'det', labels=labels, title=plot_title)
+    return
 
   size = 3
 
@@ -1,7 +1,13 @@
+import bootstrap
+import cache
 import det_curve
-import json
 import mmpmr
 import numpy as np
+import operating_points
+import os
+import profiling
+import ranking
+from utils import Rank
 
 
 def main():
@@ -9,48 +15,53 @@ def main():
   gamma_step = 0.001
   gamma_list = np.arange(0, 2 + gamma_step, gamma_step)
 
-  clarkson_morphs = [
-      'clarkson_morphs_l2',
-      'ranking_subsets/clarkson_subset_l2/rank_a',
-      'ranking_subsets/clarkson_subset_l2/rank_b',
-      'ranking_subsets/clarkson_subset_l2/rank_c']
-
-  clarkson_s_morphs = [
-      'clarkson_morphs_scanned_l2',
-      'ranking_subsets/clarkson_scanned_subset_l2/rank_a',
-      'ranking_subsets/clarkson_scanned_subset_l2/rank_b',
-      'ranking_subsets/clarkson_scanned_subset_l2/rank_c']
-
-  frll_morphs = [
-      'frll_morphs_l2',
-      'ranking_subsets/frll_subset_l2/rank_a',
-      'ranking_subsets/frll_subset_l2/rank_b',
-      'ranking_subsets/frll_subset_l2/rank_c']
-
-  frll_s_morphs = [
-      'frll_morphs_scanned_l2',
-      'ranking_subsets/frll_scanned_subset_l2/rank_a',
-      'ranking_subsets/frll_scanned_subset_l2/rank_b',
-      'ranking_subsets/frll_scanned_subset_l2/rank_c']
+  # Each dataset is read once; rank subsets are selected from the
+  # details file instead of being copied into ranking_subsets/.
+  clarkson_morphs = ('clarkson_morphs_l2', '../data/stats/details_clarkson_l2.txt')
+
+  clarkson_s_morphs = ('clarkson_morphs_scanned_l2', '../data/stats/details_clarkson_scanned_l2.txt')
+
+  frll_morphs = ('frll_morphs_l2', '../data/stats/details_frll_l2.txt')
+
+  frll_s_morphs = ('frll_morphs_scanned_l2', '../data/stats/details_frll_scanned_l2.txt')
+
+  morph, details = frll_s_morphs
+  ranks = ranking.rank_morphs(details, 0.86)
+
+  subsets = {
+      'All Ranks': None,
+      'Rank A': ranks[Rank.A],
+      'Rank B': ranks[Rank.B],
+      'Rank C': ranks[Rank.C]}
+
+  morphs_csvs_dir = '../data/stats/nearface_out/morphs/' + morph
+  stills_csvs_dir = '../data/stats/nearface_out/stills/frll_stills_l2_threshold'
+
+  curves = det_curve.gen_det_curve(morphs_csvs_dir, stills_csvs_dir, gamma_step, subset=subsets)
 
   xy = []
 
-  for morph in frll_s_morphs:
-    xy.append(det_curve.gen_det_curve(
-        '../data/stats/nearface_out/morphs/' + morph,
-        '../data/stats/nearface_out/stills/frll_stills_l2_threshold',
-        gamma_step))
+  for label, curve in curves.items():
+    xy.append(curve)
 
-    with open('../data/stats/det_curves/' + morph.replace('/', '_') + '_det_curve.json', 'w') as f:
-      json.dump(xy[-1], f)
+    cache.save_curve('../data/stats/det_curves/' + morph + '_' + label.lower().replace(' ', '_') + '_det_curve.npz',
+                     xy[-1], {'morphs': morph, 'subset': label, 'gamma_step': gamma_step})
 
-    print(morph + ':')
+    print(morph + ' ' + label + ':')
 
     det_curve.det_curve_stats(xy[-1])
 
-    tau = gamma_list[min(range(len(xy[-1][0])), key=lambda i: abs(xy[-1][0][i] - 0.001))]
+  taus = operating_points.query_operating_points(xy, 'det', gamma_list, tau_at_apcer=[0.001])['tau@APCER=0.001']
+
+  for label, tau in zip(curves.keys(), taus):
+    print(label + ' Tau @ APCER=10^-3: ' + str(tau))
 
-    print('Tau @ APCER=10^-3: ' + str(tau))
+  # Subject-level bootstrap confidence intervals
+  data = bootstrap.load_subject_scores(morphs_csvs_dir, stills_csvs_dir)
+  for label, names in subsets.items():
+    intervals = bootstrap.bootstrap_scores(data, names, 'det', gamma_step, n_replicates=1000, workers=os.cpu_count())
+    print(label + ':')
+    print(bootstrap.format_intervals(intervals))
 
   det_curve.plot_multiple_det_curve(
       xy[0],
@@ -65,4 +76,4 @@ def main():
 
 
 if __name__ == '__main__':
-  main()
+  profiling.run(main)
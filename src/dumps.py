@@ -0,0 +1,481 @@
+"""
+Morph Inspector
+Copyright (C) 2022  Cameron M Palmer [https://github.com/palmtrey/morphinspector]
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see [http://www.gnu.org/licenses/].
+
+=================================================================================
+
+dumps.py reads NearFace dump csvs in fixed-size chunks with bounded memory.
+
+A dump of one probe against a gallery-scale set of stills can be hundreds of
+MB of tab-separated text with a full identity path per row. Only the identity
+and distance columns are parsed (with explicit dtypes), identity paths are cut
+to their file names chunk by chunk, and per-identity statistics are reduced on
+the fly, so peak memory is bounded by the chunk size rather than the file size.
+Distance samples are only kept for the identities that need them (ex. the two
+subjects of a morph).
+
+Dump directories can also be stored compactly:
+  - every csv may be gzip or xz compressed ('00_0-01_0.png.csv.gz'), and
+  - a whole dump directory may be a single zip or tar archive
+    ('morphs_l2.zip', 'morphs_l2.tar.xz', ...).
+An archive is used like a directory: listdir('morphs_l2.zip') lists its csvs
+and 'morphs_l2.zip/00_0-01_0.png.csv' reads a member straight from the
+archive, without extracting it. Zip and uncompressed tar archives allow fast
+random access; members of a compressed tar are best read in listdir() order.
+DumpWriter writes any of these formats.
+
+    Typical usage example:
+
+    stats = reduce_identities('00_0-01_0.png.csv', 'VGG-Face_euclidean_l2', keep_samples=['00', '01'])
+    distanceA = stats['00']['mean']
+
+    for file in listdir('morphs_l2.zip'):
+      distances = read_distances('morphs_l2.zip/' + file)
+"""
+
+
+import aggregates
+import atexit
+import gzip
+import hashlib
+import identities as naming
+import io
+import lzma
+import numpy as np
+import os
+import pandas
+import shutil
+import tarfile
+import threading
+import timing
+import zipfile
+
+
+CHUNK_ROWS = 100000
+
+ARCHIVE_EXTENSIONS = ('.zip', '.tar', '.tar.gz', '.tgz', '.tar.xz', '.txz')
+
+COMPRESSION_EXTENSIONS = {'.gz': 'gzip', '.xz': 'xz'}
+
+# The open Archive of each archive path, with the (size, mtime) it was opened at
+_archives = {}
+_archives_lock = threading.Lock()
+
+
+def shard_of(file: str, shards: int) -> int:
+  """Returns the shard (0 to shards - 1) of a dump csv, from a hash of its morph or still name.
+
+  The shard is the same on every machine and for compressed or
+  uncompressed csvs, so nodes sharing a filesystem can split a dump
+  directory without coordination.
+  """
+  name = file.split('/')[-1].split('.')[0]
+  digest = hashlib.blake2b(name.encode(), digest_size=8).digest()
+  return int.from_bytes(digest, 'big') % shards
+
+
+def is_archive(path: str) -> bool:
+  """Returns True if path is a zip or tar archive file."""
+  return path.lower().endswith(ARCHIVE_EXTENSIONS) and os.path.isfile(path)
+
+
+def get_compression(file: str) -> str:
+  """Returns the compression of a csv file from its extension ('gzip', 'xz' or None)."""
+  return COMPRESSION_EXTENSIONS.get(os.path.splitext(file)[1].lower())
+
+
+def strip_compression(file: str) -> str:
+  """Returns a csv file name without its compression extension (ex. 'a.png.csv' for 'a.png.csv.gz')."""
+  if get_compression(file) is not None:
+    return os.path.splitext(file)[0]
+  return file
+
+
+class Archive():
+  """
+  Read access to the csvs of a zip or tar archive of a dump directory,
+  by file name. Members in subdirectories of the archive are listed
+  by their file name only.
+  """
+
+  def __init__(self, path: str):
+    self.path = path
+    self.lock = threading.Lock()
+    self.compressed = not path.lower().endswith(('.zip', '.tar'))
+
+    if path.lower().endswith('.zip'):
+      self.zip = zipfile.ZipFile(path)
+      self.tar = None
+      members = [info for info in self.zip.infolist() if not info.is_dir()]
+      self.members = {os.path.basename(info.filename): info for info in members}
+    else:
+      self.zip = None
+      self.tar = tarfile.open(path, 'r:*')
+      members = [info for info in self.tar.getmembers() if info.isfile()]
+      self.members = {os.path.basename(info.name): info for info in members}
+
+  def close(self) -> None:
+    """Closes the archive. Zip members still open stay readable until they are closed."""
+    with self.lock:
+      if self.zip is not None:
+        self.zip.close()
+      else:
+        self.tar.close()
+
+  def names(self) -> list[str]:
+    """Returns the file names of the members, in archive order."""
+    return list(self.members.keys())
+
+  def open(self, name: str):
+    """Opens a member for binary reading.
+
+    Zip members and members of an uncompressed tar are streamed (tar
+    reads of different members share one file, so each read seeks and
+    reads under a lock). Members of a compressed tar are read whole
+    under the lock, since seeking back in a compressed stream means
+    decompressing it again from the start.
+    """
+    member = self.members[name]
+    if self.zip is not None:
+      return self.zip.open(member)
+    with self.lock:
+      if self.compressed:
+        return io.BytesIO(self.tar.extractfile(member).read())
+      return LockedReader(self.tar.extractfile(member), self.lock)
+
+  def getsize(self, name: str) -> int:
+    member = self.members[name]
+    return member.file_size if self.zip is not None else member.size
+
+
+class LockedReader(io.RawIOBase):
+  """
+  A binary stream over another stream whose reads share a file with
+  other streams: every read holds lock.
+  """
+
+  def __init__(self, stream, lock: threading.Lock):
+    self.stream = stream
+    self.lock = lock
+
+  def readable(self) -> bool:
+    return True
+
+  def readinto(self, buffer) -> int:
+    with self.lock:
+      return self.stream.readinto(buffer)
+
+  def close(self) -> None:
+    if not self.closed:
+      self.stream.close()
+    super().close()
+
+
+def get_archive(path: str) -> Archive:
+  """Returns the open Archive of path, reopening it (and closing the old one) if the file has changed."""
+  stat = os.stat(path)
+  key = os.path.abspath(path)
+  version = (stat.st_size, stat.st_mtime_ns)
+
+  with _archives_lock:
+    archive, archive_version = _archives.get(key, (None, None))
+    if archive is None or archive_version != version:
+      if archive is not None:
+        archive.close()
+      archive = Archive(path)
+      _archives[key] = (archive, version)
+  return archive
+
+
+@atexit.register
+def close_archives() -> None:
+  """Closes every archive opened by get_archive()."""
+  with _archives_lock:
+    for archive, _ in _archives.values():
+      archive.close()
+    _archives.clear()
+
+
+def split_member(path: str) -> tuple[Archive, str]:
+  """Returns (archive, name) if path is a member of an archive ('dump.zip/name'), else None."""
+  if os.path.exists(path):
+    return None
+  parent = os.path.dirname(path)
+  if parent == '' or not is_archive(parent):
+    return None
+  return (get_archive(parent), os.path.basename(path))
+
+
+def listdir(path: str) -> list[str]:
+  """Lists the files of a dump directory or archive."""
+  if is_archive(path):
+    return get_archive(path).names()
+  return os.listdir(path)
+
+
+def getsize(path: str) -> int:
+  """Returns the stored size of a dump csv or archive member."""
+  member = split_member(path)
+  if member is not None:
+    return member[0].getsize(member[1])
+  return os.path.getsize(path)
+
+
+def open_file(path: str):
+  """Opens a dump csv or archive member for binary reading (not decompressed)."""
+  member = split_member(path)
+  if member is not None:
+    return member[0].open(member[1])
+  return open(path, 'rb')
+
+
+def read_csv(path: str, **kwargs) -> pandas.DataFrame:
+  """Calls pandas.read_csv on a dump csv, which may be compressed or an archive member.
+
+  For chunked reading, use read_chunks() instead.
+  """
+  with open_file(path) as f:
+    return pandas.read_csv(f, compression=get_compression(path), **kwargs)
+
+
+class DumpWriter():
+  """
+  Writes dump csvs to a directory (each optionally gzip or xz
+  compressed) or to a zip or tar archive, depending on the extension
+  of the output path.
+
+  Writing into an existing output behaves the same for every format:
+  csvs written replace those of the same name and every other csv is
+  kept. An archive is written to path + '.tmp', the members of the
+  existing archive that were not written are copied over on close(),
+  and the new archive then replaces the old one.
+  """
+
+  def __init__(self, path: str, compression: str = None):
+    """
+    Args:
+      path: an output directory, or an archive path ending in one of
+        ARCHIVE_EXTENSIONS.
+      compression: 'gzip' or 'xz' to compress every csv of an output
+        directory (ignored for archives).
+    """
+    if compression not in (None, 'gzip', 'xz'):
+      raise ValueError(str(compression) + ' is not a valid compression.')
+
+    self.path = path
+    self.compression = compression
+    self.zip = None
+    self.tar = None
+    self.written = set()
+
+    lower = path.lower()
+    if lower.endswith(ARCHIVE_EXTENSIONS):
+      if os.path.dirname(path) != '':
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+      if lower.endswith('.zip'):
+        self.zip = zipfile.ZipFile(path + '.tmp', 'w', compression=zipfile.ZIP_DEFLATED)
+      elif lower.endswith('.tar'):
+        self.tar = tarfile.open(path + '.tmp', 'w')
+      else:
+        self.tar = tarfile.open(path + '.tmp', 'w:gz' if lower.endswith(('.gz', '.tgz')) else 'w:xz')
+    else:
+      os.makedirs(path, exist_ok=True)
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    self.close()
+    return False
+
+  def write(self, name: str, text: str) -> None:
+    """Writes one csv (ex. write('00_0-01_0.png.csv', df.to_csv(sep='\\t')))."""
+    data = text.encode()
+    self.written.add(name)
+
+    if self.zip is not None:
+      self.zip.writestr(name, data)
+    elif self.tar is not None:
+      info = tarfile.TarInfo(name)
+      info.size = len(data)
+      self.tar.addfile(info, io.BytesIO(data))
+    elif self.compression == 'gzip':
+      with gzip.open(self.path + '/' + name + '.gz', 'wb') as f:
+        f.write(data)
+    elif self.compression == 'xz':
+      with lzma.open(self.path + '/' + name + '.xz', 'wb') as f:
+        f.write(data)
+    else:
+      with open(self.path + '/' + name, 'wb') as f:
+        f.write(data)
+
+  def copy_members(self) -> None:
+    """Copies the members of the existing archive at self.path that were not written, streaming each one."""
+    if not os.path.exists(self.path):
+      return
+
+    if self.zip is not None:
+      with zipfile.ZipFile(self.path) as old:
+        for info in old.infolist():
+          if not info.is_dir() and info.filename not in self.written:
+            with old.open(info) as source, self.zip.open(info, 'w') as target:
+              shutil.copyfileobj(source, target)
+    else:
+      with tarfile.open(self.path, 'r:*') as old:
+        for info in old:
+          if info.isfile() and info.name not in self.written:
+            self.tar.addfile(info, old.extractfile(info))
+
+  def close(self) -> None:
+    if self.zip is None and self.tar is None:
+      return
+
+    try:
+      self.copy_members()
+    finally:
+      if self.zip is not None:
+        self.zip.close()
+      if self.tar is not None:
+        self.tar.close()
+      self.zip = None
+      self.tar = None
+    os.replace(self.path + '.tmp', self.path)
+
+
+def read_chunks(csv_file: str, distance_label: str = 'VGG-Face_euclidean_l2', chunk_rows: int = CHUNK_ROWS):
+  """Yields the rows of a NearFace dump csv in chunks.
+
+  Args:
+    csv_file: a path to a csv file generated by NearFace (possibly
+      compressed or an archive member, see read_csv()).
+    distance_label: the csv file label for distances
+      (ex. 'VGG-Face_cosine', 'VGG-Face_euclidean_l2', etc.)
+    chunk_rows: the number of rows parsed at a time.
+
+  Yields:
+    Tuples (stills, distances) of a pandas Series of still file names
+    (the identity column without its directories) and a float array
+    of their distances, in the order of the csv file.
+  """
+  timing.count_bytes('csv.read', csv_file)
+
+  with open_file(csv_file) as f:
+    reader = pandas.read_csv(f, sep='\t', usecols=['identity', distance_label],
+                             dtype={'identity': str, distance_label: np.float64},
+                             compression=get_compression(csv_file), chunksize=chunk_rows)
+    with reader:
+      for chunk in reader:
+        yield (chunk['identity'].str.rsplit('/', n=1).str[-1], chunk[distance_label].to_numpy())
+
+
+def read_distances(csv_file: str, distance_label: str = 'VGG-Face_euclidean_l2',
+                   chunk_rows: int = CHUNK_ROWS) -> np.ndarray:
+  """Returns every distance of a NearFace dump csv as a float array, in csv order.
+
+  Identity paths are parsed one chunk at a time and never kept.
+  """
+  with timing.span('csv.read'):
+    distances = [chunk_distances for _, chunk_distances in read_chunks(csv_file, distance_label, chunk_rows)]
+
+  if len(distances) == 0:
+    return np.array([], dtype=float)
+  return np.concatenate(distances)
+
+
+def key_by_still(stills: pandas.Series, distances) -> pandas.Series:
+  """Returns distances as a Series indexed by still name, averaging the distances of a still that appears more than once.
+
+  Cosine and L2 dumps are paired by joining these Series, so every
+  still name must appear once. The Series keeps the name of
+  distances, if any.
+  """
+  series = pandas.Series(np.asarray(distances, dtype=float), index=np.asarray(stills), name=getattr(distances, 'name', None))
+  return series.groupby(level=0, sort=False).mean()
+
+
+def read_still_distances(csv_file: str, distance_label: str = 'VGG-Face_euclidean_l2',
+                         chunk_rows: int = CHUNK_ROWS) -> dict:
+  """Returns a dict {still: distance} of a NearFace dump csv, in csv order."""
+  result_dict = {}
+  with timing.span('csv.read'):
+    for stills, distances in read_chunks(csv_file, distance_label, chunk_rows):
+      result_dict.update(zip(stills.tolist(), distances))
+  return result_dict
+
+
+def reduce_identities(csv_file: str,
+                      distance_label: str = 'VGG-Face_euclidean_l2',
+                      identities: list[str] = None,
+                      keep_samples: list[str] = (),
+                      chunk_rows: int = CHUNK_ROWS
+                      ) -> dict[str, dict]:
+  """Reduces the distances of a NearFace dump csv per identity, chunk by chunk.
+
+  The identity of a still is the part of its file name before the
+  first underscore (ex. '00' for '00_1.jpg').
+
+  Args:
+    csv_file: a path to a csv file generated by NearFace.
+    distance_label: the csv file label for distances.
+    identities: if given, only these identities are reduced.
+    keep_samples: identities whose distances are also kept.
+    chunk_rows: the number of rows parsed at a time.
+
+  Returns:
+    A dict in the format
+
+    {identity: {'count': n, 'mean': mean_distance, 'samples': distances}}
+
+    where 'samples' (in csv order) is only present for identities in
+    keep_samples. NaN distances are not counted.
+  """
+  counts = {}
+  sums = {}
+  samples = {identity: [] for identity in keep_samples}
+
+  with timing.span('csv.read'):
+    for stills, distances in read_chunks(csv_file, distance_label, chunk_rows):
+      chunk_identities = naming.identity_series(stills)
+
+      if identities is not None:
+        selected = chunk_identities.isin(identities).to_numpy()
+        chunk_identities = chunk_identities[selected]
+        distances = distances[selected]
+
+      grouped = pandas.Series(distances, index=chunk_identities.to_numpy()).groupby(level=0, sort=False).agg(['count', 'sum'])
+      for identity, count, total in zip(grouped.index, grouped['count'], grouped['sum']):
+        counts[identity] = counts.get(identity, 0) + int(count)
+        sums[identity] = sums.get(identity, 0.0) + float(total)
+
+      if len(samples) > 0:
+        chunk_identities = chunk_identities.to_numpy()
+        for identity in samples:
+          samples[identity].append(distances[chunk_identities == identity])
+
+  result = {}
+  for identity in counts:
+    result[identity] = {'count': counts[identity],
+                        'mean': sums[identity] / counts[identity] if counts[identity] > 0 else np.nan}
+
+  for identity, parts in samples.items():
+    identity_samples = np.concatenate(parts) if len(parts) > 0 else np.array([], dtype=float)
+    entry = result.setdefault(identity, {'count': 0, 'mean': np.nan})
+    entry['samples'] = identity_samples
+    # Kept samples give the exact mean, as aggregates.AggregateTable averages.
+    if len(identity_samples) > 0:
+      entry['mean'] = aggregates.finite_mean(identity_samples)
+
+  return result
@@ -0,0 +1,289 @@
+"""
+Morph Inspector
+Copyright (C) 2022  Cameron M Palmer [https://github.com/palmtrey/morphinspector]
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see [http://www.gnu.org/licenses/].
+
+=================================================================================
+
+experiment.py runs a matrix of ROC/DET experiments described by a YAML file
+(datasets x subsets x metrics x curve types) across a process pool and writes
+one summary table for all of them. Curves are cached under the fingerprints of
+their inputs (see cache.CurveCache), so re-running after changing one dataset
+only recomputes the cells that read that dataset.
+
+See ../resources/experiments/rank_curves.yml for an example configuration.
+
+    Typical usage example:
+
+    python experiment.py ../resources/experiments/rank_curves.yml --workers 4
+"""
+
+
+import argparse
+import cache
+import csv
+import numpy as np
+import operating_points
+import os
+import plotting
+import profiling
+import ranking
+import sklearn.metrics
+import yaml
+from concurrent.futures import ProcessPoolExecutor
+from utils import Rank
+
+
+RANK_SUBSETS = {'rank_a': Rank.A, 'rank_b': Rank.B, 'rank_c': Rank.C}
+
+SUMMARY_COLUMNS = ['dataset', 'metric', 'subset', 'curve', 'AUC', 'EER']
+
+
+def load_experiment(config_file: str) -> dict:
+  """Loads an experiment YAML file and fills in defaults."""
+  with open(config_file, 'r') as f:
+    config = yaml.load(f, yaml.Loader)
+
+  config.setdefault('output_dir', '../data/stats/experiments')
+  config.setdefault('cache_dir', cache.CURVE_CACHE_DIR)
+  config.setdefault('gamma_step', 0.001)
+  config.setdefault('subsets', ['all'])
+  config.setdefault('curves', ['roc', 'det'])
+  config.setdefault('bpcer_targets', [0.1, 0.05, 0.01])
+  config.setdefault('tau_apcer_target', 0.001)
+  config.setdefault('workers', os.cpu_count())
+  config.setdefault('figure_formats', ['png'])
+
+  for subset in config['subsets']:
+    if subset != 'all' and subset not in RANK_SUBSETS:
+      raise ValueError(str(subset) + ' is not a valid subset.')
+
+  for curve in config['curves']:
+    if curve not in ['roc', 'det']:
+      raise ValueError(str(curve) + ' is not a valid curve type.')
+
+  return config
+
+
+def expand_matrix(config: dict) -> list[dict]:
+  """Expands an experiment config into one job per (dataset, metric, curve).
+
+  All subsets of a job are computed from a single read of the
+  dataset, so subsets are not split into separate jobs. A '{metric}'
+  placeholder in a dataset path is replaced by the metric name.
+
+  Returns:
+    A list of job dicts, each holding everything run_job() needs.
+  """
+  jobs = []
+
+  for dataset, paths in config['datasets'].items():
+    for metric, metric_config in config['metrics'].items():
+      morphs = paths['morphs'].replace('{metric}', metric)
+      stills = paths['stills'].replace('{metric}', metric)
+      details = paths.get('details', '').replace('{metric}', metric)
+
+      for curve in config['curves']:
+        job = {
+            'dataset': dataset,
+            'metric': metric,
+            'curve': curve,
+            'morphs': morphs,
+            'stills': stills,
+            'details': details,
+            'distance_label': metric_config['distance_label'],
+            'threshold': metric_config.get('threshold'),
+            'subsets': config['subsets'],
+            'gamma_step': config['gamma_step'],
+            'bpcer_targets': config['bpcer_targets'],
+            'tau_apcer_target': config['tau_apcer_target'],
+            'cache_dir': config['cache_dir'],
+            'force': config.get('force', False)
+            }
+
+        jobs.append(job)
+
+  return jobs
+
+
+def curve_summary(curve: str, curves: list, gamma_list: np.ndarray,
+                  bpcer_targets: list[float], tau_apcer_target: float) -> list[dict]:
+  """Calculates the summary table statistics for a list of curves of one type.
+
+  Returns:
+    A list with a dict per curve containing AUC, EER, APCER @ BPCER for
+    every target and tau @ APCER = tau_apcer_target.
+  """
+  points = operating_points.query_operating_points(
+      curves, curve, gamma_list, apcer_at_bpcer=bpcer_targets, tau_at_apcer=[tau_apcer_target], eer=True)
+
+  result = []
+  for i, xy in enumerate(curves):
+    apcer, bpcer = operating_points.to_apcer_bpcer(curve, xy)
+
+    stats = {}
+    stats['AUC'] = float(sklearn.metrics.auc(bpcer, 1 - apcer))
+    stats['EER'] = float(points['EER'][i])
+    for target in bpcer_targets:
+      stats['APCER@BPCER=' + str(target)] = float(points['APCER@BPCER=' + str(target)][i])
+    stats['tau@APCER=' + str(tau_apcer_target)] = float(points['tau@APCER=' + str(tau_apcer_target)][i])
+
+    result.append(stats)
+
+  return result
+
+
+def run_job(job: dict) -> dict:
+  """Computes (or loads from the curve cache) the curves and statistics of one job.
+
+  Returns:
+    A dict in the format
+
+    {'curves': {subset: (x, y)}, 'stats': {subset: summary}}
+  """
+  subsets = {}
+  ranks = None
+  for subset in job['subsets']:
+    if subset == 'all':
+      subsets[subset] = None
+    else:
+      if ranks is None:
+        ranks = ranking.rank_morphs(job['details'], job['threshold'])
+      subsets[subset] = ranks[RANK_SUBSETS[subset]]
+
+  gamma_list = np.arange(0, 2 + job['gamma_step'], job['gamma_step'])
+
+  curve_cache = cache.CurveCache(job['curve'], job['morphs'], job['stills'], gamma_list, job['distance_label'],
+                                 job['cache_dir'])
+
+  curves = None if job['force'] else curve_cache.lookup(subsets)
+
+  if curves is None:
+    # Imported here so that NearFace (imported by roc_curve) is only
+    # loaded by workers that actually compute a curve.
+    import det_curve
+    import roc_curve
+
+    if job['curve'] == 'roc':
+      gen_curve = roc_curve.gen_roc_curve
+    else:
+      gen_curve = det_curve.gen_det_curve
+
+    curves = gen_curve(job['morphs'], job['stills'], job['gamma_step'], subset=subsets,
+                       distance_label=job['distance_label'], use_cache=False)
+    curve_cache.store(subsets, curves)
+
+  stats = curve_summary(job['curve'], list(curves.values()), gamma_list, job['bpcer_targets'], job['tau_apcer_target'])
+
+  return {'curves': curves, 'stats': dict(zip(curves.keys(), stats))}
+
+
+def run_experiment(config: dict, workers: int = None) -> list[dict]:
+  """Runs every job of an experiment and writes curves and a summary table.
+
+  Curves are written to output_dir as one .npz file per cell (see
+  cache.save_curve), one figure per dataset, metric and curve type is
+  rendered for every format in figure_formats and the summary table is
+  written to output_dir/summary.csv.
+
+  Returns:
+    The rows of the summary table.
+  """
+  if workers is None:
+    workers = config['workers']
+
+  jobs = expand_matrix(config)
+
+  print('Running ' + str(len(jobs)) + ' jobs...')
+
+  if workers > 1:
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+      results = list(executor.map(run_job, jobs))
+  else:
+    results = [run_job(job) for job in jobs]
+
+  os.makedirs(config['output_dir'], exist_ok=True)
+
+  rows = []
+  for job, result in zip(jobs, results):
+    for subset in job['subsets']:
+      cell = job['dataset'] + '_' + job['metric'] + '_' + subset + '_' + job['curve']
+      row = {'dataset': job['dataset'], 'metric': job['metric'], 'subset': subset, 'curve': job['curve']}
+
+      metadata = dict(row)
+      metadata.update({'gamma_step': job['gamma_step'], 'distance_label': job['distance_label']})
+      cache.save_curve(config['output_dir'] + '/' + cell + '.npz', result['curves'][subset], metadata)
+      row.update(result['stats'][subset])
+      rows.append(row)
+
+  figures = []
+  for job, result in zip(jobs, results):
+    name = job['dataset'] + '_' + job['metric'] + '_' + job['curve']
+    for ext in config['figure_formats']:
+      figures.append({
+          'type': 'curves',
+          'curves': [result['curves'][subset] for subset in job['subsets']],
+          'output_file': config['output_dir'] + '/' + name + '.' + ext,
+          'curve_type': job['curve'],
+          'labels': job['subsets'],
+          'title': job['dataset'] + ' ' + job['metric'] + ' ' + job['curve'].upper() + ' Curves'})
+
+  plotting.render_batch(figures, workers)
+
+  write_summary(rows, config['output_dir'] + '/summary.csv')
+
+  return rows
+
+
+def write_summary(rows: list[dict], csv_out_file: str) -> None:
+  """Writes the summary table to a csv file and prints it."""
+  if len(rows) == 0:
+    return
+
+  columns = SUMMARY_COLUMNS + [column for column in rows[0].keys() if column not in SUMMARY_COLUMNS]
+
+  with open(csv_out_file, 'w', newline='') as f:
+    writer = csv.DictWriter(f, fieldnames=columns)
+    writer.writeheader()
+    writer.writerows(rows)
+
+  widths = [max([len(column)] + [len(format_value(row[column])) for row in rows]) for column in columns]
+  print('  '.join(column.ljust(width) for column, width in zip(columns, widths)))
+  for row in rows:
+    print('  '.join(format_value(row[column]).ljust(width) for column, width in zip(columns, widths)))
+
+
+def format_value(value) -> str:
+  if isinstance(value, float):
+    return format(value, '.4g')
+  return str(value)
+
+
+def main():
+  parser = argparse.ArgumentParser(description='Runs a matrix of ROC/DET experiments from a YAML file.')
+  parser.add_argument('config', help='path to an experiment YAML file')
+  parser.add_argument('--workers', type=int, default=None, help='number of worker processes')
+  parser.add_argument('--force', action='store_true', help='ignore cached results')
+  args = parser.parse_args()
+
+  config = load_experiment(args.config)
+
+  config['force'] = args.force
+
+  run_experiment(config, args.workers)
+
+
+if __name__ == '__main__':
+  profiling.run(main)
@@ -0,0 +1,147 @@
+"""
+Morph Inspector
+Copyright (C) 2022  Cameron M Palmer [https://github.com/palmtrey/morphinspector]
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see [http://www.gnu.org/licenses/].
+
+=================================================================================
+
+export.py exports morph details of one or more details files (ex. cosine and
+L2) as one table with a row per morph and a column per selected metric.
+
+Rows are streamed from the details stores in batches (see store.iter_table),
+so memory does not grow with the number of morphs:
+  - csv: rows are written with the csv module as they are read;
+  - npz: one array per column, built from the batch arrays;
+  - parquet: one row group per batch (requires pyarrow).
+
+    Typical usage example:
+
+    export_details({'cosine': 'details_cosine.txt', 'l2': 'details_l2.db'}, 'details.parquet',
+                   metrics=['avgdist', '1-wasserstein'])
+"""
+
+
+import csv
+import numpy as np
+import store
+
+try:
+  import pyarrow
+  import pyarrow.parquet
+except ImportError:
+  pyarrow = None
+
+
+FORMATS = ['csv', 'npz', 'parquet']
+
+
+def get_format(output_file: str) -> str:
+  """Returns the export format of an output file from its extension."""
+  extension = output_file.split('.')[-1].lower()
+  if extension not in FORMATS:
+    raise ValueError(output_file + ' does not have an export extension (' + ', '.join(FORMATS) + ').')
+  return extension
+
+
+def column_name(column: str) -> str:
+  """Returns the exported name of a store.iter_table column (ex. 'l2_avgdist' for 'l2 avgdist')."""
+  return column.replace(' ', '_')
+
+
+def export_details(details_files: dict[str, str], output_file: str, metrics: list[str] = None,
+                   format: str = None, batch_size: int = 65536) -> int:
+  """Exports details files as one table.
+
+  Args:
+    details_files: a dict mapping a distance type (ex. 'cosine', 'l2')
+      to a details file written by utils.writescores (a store or JSON).
+    output_file: the file to write.
+    metrics: the details keys to export (default all of store.METRICS).
+    format: 'csv', 'npz' or 'parquet' (default from the extension of
+      output_file).
+    batch_size: the number of morphs read at a time.
+
+  Returns:
+    The number of morphs exported.
+
+  Raises:
+    ImportError: if format is 'parquet' and pyarrow is not installed.
+  """
+  if format is None:
+    format = get_format(output_file)
+  if metrics is None:
+    metrics = list(store.METRICS.keys())
+  batches = store.iter_table(details_files, metrics, batch_size)
+
+  if format == 'csv':
+    header = ['name'] + [column_name(prefix + ' ' + metric) for prefix in details_files.keys() for metric in metrics]
+    return write_csv(batches, output_file, header)
+  elif format == 'npz':
+    return write_npz(batches, output_file)
+  elif format == 'parquet':
+    return write_parquet(batches, output_file)
+
+  raise ValueError(format + ' is not a valid export format.')
+
+
+def write_csv(batches, output_file: str, header: list[str]) -> int:
+  """Writes a header row, then the batches of store.iter_table as csv rows while they are read."""
+  count = 0
+  with open(output_file, 'w', newline='') as f:
+    writer = csv.writer(f, lineterminator='\n')
+    writer.writerow(header)
+    for names, columns in batches:
+      writer.writerows(zip(names, *[values.tolist() for values in columns.values()]))
+      count += len(names)
+
+  return count
+
+
+def write_npz(batches, output_file: str) -> int:
+  """Writes the batches of store.iter_table as an npz file of one array per column ('name' and the column names)."""
+  names = []
+  columns = {}
+  for batch_names, batch_columns in batches:
+    names.append(np.array(batch_names, dtype=str))
+    for column, values in batch_columns.items():
+      columns.setdefault(column_name(column), []).append(values)
+
+  names = np.concatenate(names) if len(names) > 0 else np.array([], dtype=str)
+  arrays = {column: np.concatenate(values) for column, values in columns.items()}
+  with open(output_file, 'wb') as f:
+    np.savez(f, name=names, **arrays)
+
+  return len(names)
+
+
+def write_parquet(batches, output_file: str) -> int:
+  """Writes the batches of store.iter_table to a Parquet file, one row group per batch."""
+  if pyarrow is None:
+    raise ImportError('Parquet export requires pyarrow (pip install pyarrow).')
+
+  count = 0
+  writer = None
+  try:
+    for names, columns in batches:
+      table = pyarrow.table({'name': names, **{column_name(column): values for column, values in columns.items()}})
+      if writer is None:
+        writer = pyarrow.parquet.ParquetWriter(output_file, table.schema)
+      writer.write_table(table)
+      count += len(names)
+  finally:
+    if writer is not None:
+      writer.close()
+
+  return count
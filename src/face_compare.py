@@ -3,40 +3,60 @@
 #
 # @brief Uses the NearFace library to run facial recognition on a set of images
 
-from turtle import distance
 from nearface import NearFace
+import dumps
+import metrics
 import os
+import profiling
+import timing
 from tqdm import tqdm
 
 
-def compare(morphs_dir:str, stills_dir:str, output_csvs_dir:str):
+def compare(morphs_dir:str, stills_dir:str, output_csvs_dir:str, metrics_dir:str = None, compression:str = None):
   '''
   Compares each morph image found in morphs_dir to all still images found in stills_dir
-  
+
+  output_csvs_dir is a directory, or a zip or tar archive path (ex. 'morphs_l2.zip')
+  to write every csv into a single archive. compression ('gzip' or 'xz') compresses
+  each csv written to a directory. See dumps.DumpWriter.
+
+  Progress metrics are exported to metrics_dir (see metrics.JobMetrics)
   '''
-  for filename in tqdm(os.listdir(morphs_dir)):
-    try:
-
-      df = NearFace.find(
-        img_path = morphs_dir + '/' + filename, 
-        db_path = stills_dir,
-        distance_metric='euclidean_l2',
-        enforce_detection=False, 
-        use_threshold=False
-      )
-
-      if not os.path.isdir(output_csvs_dir):
-        os.mkdir(output_csvs_dir)
-        
-      df.to_csv(output_csvs_dir + '/' + filename + '.csv', sep='\t')
-      
-    except AttributeError:
-      print('AttributeError encountered... skipping morph ' + filename)
+  filenames = os.listdir(morphs_dir)
 
+  with metrics.JobMetrics('face_compare', len(filenames), metrics_dir) as job_metrics, \
+       dumps.DumpWriter(output_csvs_dir, compression) as writer:
+    for filename in tqdm(filenames):
+      try:
 
-if __name__ == '__main__':
+        with timing.span('face_compare.find'):
+          timing.count_bytes('face_compare.find', morphs_dir + '/' + filename)
+          df = NearFace.find(
+            img_path = morphs_dir + '/' + filename,
+            db_path = stills_dir,
+            distance_metric='euclidean_l2',
+            enforce_detection=False,
+            use_threshold=False
+          )
+
+        with timing.span('face_compare.write_csv'):
+          writer.write(filename + '.csv', df.to_csv(sep='\t'))
+
+        job_metrics.advance(file=morphs_dir + '/' + filename)
+
+      except AttributeError:
+        print('AttributeError encountered... skipping morph ' + filename)
+        timing.count('face_compare.find', 'skipped')
+        job_metrics.error()
+
+
+def main():
   compare(
       morphs_dir='../data/images/frll_morphs',
       stills_dir='../data/images/frll_stills',
       output_csvs_dir='../data/nearface_out/morphs/frll_morphs_l2'
   )
+
+
+if __name__ == '__main__':
+  profiling.run(main)
@@ -1,3 +1,4 @@
+import timing
 import utils
 import windows
 import PyQt6.QtWidgets as QtWidgets
@@ -14,10 +15,12 @@ class MorphInspectorGUI():
     self.settings = settings
     self.settings.load_config()
 
-    self.Morphs = utils.encapsulate_morphs(self.settings)
+    with timing.span('gui.encapsulate_morphs'):
+      self.Morphs = utils.encapsulate_morphs(self.settings)
 
     # Create the main window for the app
-    self.mainwindow = windows.MainWindow(self.size, self.settings.precision, self.Morphs, self.settings)
+    with timing.span('gui.main_window'):
+      self.mainwindow = windows.MainWindow(self.size, self.settings.precision, self.Morphs, self.settings)
 
     # Show the window
     self.mainwindow.show()
@@ -31,12 +34,12 @@ class MorphInspectorGUI():
       else:
         if self.settings.csvs_cosine_path is not None:
           print('Generating cosine details...')
-          utils.writescores(self.settings.csvs_cosine_path, 'temp/details_cosine.txt', 'VGG-Face_cosine')
-          self.settings.details_cosine_path = 'temp/details_cosine.txt'
+          utils.writescores(self.settings.csvs_cosine_path, 'temp/details_cosine.db', 'VGG-Face_cosine')
+          self.settings.details_cosine_path = 'temp/details_cosine.db'
         if self.settings.csvs_l2_path is not None:
           print('Generating l2 details...')
-          utils.writescores(self.settings.csvs_l2_path, 'temp/details_l2.txt', 'VGG-Face_euclidean_l2')
-          self.settings.details_l2_path = 'temp/details_l2.txt'
+          utils.writescores(self.settings.csvs_l2_path, 'temp/details_l2.db', 'VGG-Face_euclidean_l2')
+          self.settings.details_l2_path = 'temp/details_l2.db'
 
     self.app.exec()
 
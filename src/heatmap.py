@@ -1,71 +1,118 @@
-import os
+import dumps
+import ingest
+import numpy as np
 import pandas
-import plotly.express as px
+import plotly.graph_objects as go
+import profiling
 from tqdm import tqdm
 
-def get_distances_from_df(df: pandas.DataFrame) -> list[float]:
-  '''Gets sorted distances from a NearFace dump dataframe.
+def read_keyed_distances(csv_file: str, distance_label: str) -> pandas.Series:
+  '''Reads a NearFace dump csv as a Series of distances indexed by still name.
 
-  Sorts a given dataframe by morph, and then returns a list of
-  float distance values in that order. NearFace dump files are
-  automatically sorted by descending distance - this won't work
-  for a heatmap. Sorting these distances by morph allows the
-  distances to be matched up exactly when potting.
+  A still compared more than once gets the mean of its distances, so
+  every still name appears once (see dumps.key_by_still).
 
   Args:
-    df: pandas DataFrame containing NearFace dump data (can be
-      either cosine or L2 metric data).
+    csv_file: path to a NearFace dump csv file.
+    distance_label: the csv file label for distances
+      (ex. 'VGG-Face_cosine', 'VGG-Face_euclidean_l2', etc.)
   '''
+  df = dumps.read_csv(csv_file, delimiter='\t', usecols=['identity', distance_label])
+  return dumps.key_by_still(df['identity'].str.split('/').str[-1], df[distance_label])
 
-  df.sort_values(by='identity', inplace=True)
 
-  if 'VGG-Face_cosine' in df.columns:
-    return df['VGG-Face_cosine'].tolist()
-  elif 'VGG-Face_euclidean_l2' in df.columns:
-    return df['VGG-Face_euclidean_l2'].tolist()
-  else:
-    return None
+def bin_heatmap(cosine_dir: str,
+                l2_dir: str,
+                bins: int = 200,
+                bin_range: tuple[tuple[float, float], tuple[float, float]] = ((0, 2), (0, 2)),
+                chunk_size: int = 500,
+                workers: int = None
+                ) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+  '''Bins cosine versus L2 distances into a 2D histogram.
 
+  Each cosine distance is paired with the L2 distance of the same
+  morph (csv file name) and still (identity), so the pairing does
+  not depend on file or row order. Pairs are accumulated into a
+  fixed grid chunk_size files at a time, so memory does not grow
+  with the size of the dataset. Morphs or stills missing from either
+  directory are skipped.
 
-def plot_heatmap(cosine_dir: str, l2_dir: str) -> None:
+  Args:
+    cosine_dir: path to a directory containg NearFace dump csv
+      files using the cosine distance metric.
+    l2_dir: path to a directory containing NearFace dump csv
+      files using the Euclidean L2 distance metric.
+    bins: the number of bins along each axis.
+    bin_range: ((cosine_min, cosine_max), (l2_min, l2_max)) covered by
+      the grid. Distances outside of it are not counted.
+    chunk_size: the number of morph files paired per chunk.
+    workers: the number of threads reading file pairs (see
+      ingest.get_workers).
+
+  Returns:
+    A tuple (counts, cosine_edges, l2_edges) as returned by
+    np.histogram2d.
+  '''
+  counts = np.zeros((bins, bins))
+  x_edges = np.linspace(bin_range[0][0], bin_range[0][1], bins + 1)
+  y_edges = np.linspace(bin_range[1][0], bin_range[1][1], bins + 1)
+
+  # Paired by file name, whichever of the two is compressed.
+  l2_files = {dumps.strip_compression(file): file for file in dumps.listdir(l2_dir)}
+  morphs = [(file, l2_files[dumps.strip_compression(file)]) for file in dumps.listdir(cosine_dir)
+            if dumps.strip_compression(file) in l2_files]
+
+  def read_pair(morph):
+    cosine = read_keyed_distances(cosine_dir + '/' + morph[0], 'VGG-Face_cosine')
+    l2 = read_keyed_distances(l2_dir + '/' + morph[1], 'VGG-Face_euclidean_l2')
+    joined = pandas.concat([cosine, l2], axis=1, join='inner')
+    return (joined['VGG-Face_cosine'].to_numpy(dtype=float), joined['VGG-Face_euclidean_l2'].to_numpy(dtype=float))
+
+  for start in tqdm(range(0, len(morphs), chunk_size)):
+    x = []
+    y = []
+    for _, (cosine, l2) in ingest.read_files(read_pair, morphs[start:start + chunk_size], workers):
+      x.append(cosine)
+      y.append(l2)
+
+    if len(x) > 0:
+      counts += np.histogram2d(np.concatenate(x), np.concatenate(y), bins=[x_edges, y_edges])[0]
+
+  return (counts, x_edges, y_edges)
+
+
+def plot_heatmap(cosine_dir: str, l2_dir: str, bins: int = 200, chunk_size: int = 500) -> None:
   '''Plots a heatmap of cosine distances versus L2 distances.
 
-  Uses plotly.express to plot a heatmap of a morph dataset given
+  Uses plotly to plot a density contour of a morph dataset given
   NearFace dump directories for the dataset's cosine and l2
-  folders. NearFace backend must be VGG-Face.
+  folders. NearFace backend must be VGG-Face. The contour is drawn
+  from the binned grid of bin_heatmap, so only bins * bins values
+  are handed to plotly regardless of dataset size.
 
   Args:
     cosine_dir: path to a directory containg NearFace dump csv
       files using the cosine distance metric.
     l2_dir: path to a directory containing NearFace dump csv
       files using the Euclidean L2 distance metric.
+    bins: the number of bins along each axis.
+    chunk_size: the number of morph files paired per chunk.
   '''
-  # df = px.data.tips()
-  x = []
-  y = []
-  for cosine_morph in tqdm(os.listdir(cosine_dir)):
-    with open(cosine_dir + '/' + cosine_morph) as f:
-      df = pandas.read_csv(f, delimiter='\t')
-      x += get_distances_from_df(df)
-
-  for l2_morph in tqdm(os.listdir(l2_dir)):
-    with open(l2_dir + '/' + l2_morph) as f:
-      df = pandas.read_csv(f, delimiter='\t')
-      y += get_distances_from_df(df)
-
-  df = pandas.DataFrame()
-  df['x'] = x
-  df['y'] = y
-
-  fig = px.density_contour(df, x='x', y='y')
+  counts, x_edges, y_edges = bin_heatmap(cosine_dir, l2_dir, bins=bins, chunk_size=chunk_size)
+
+  fig = go.Figure(go.Contour(
+      z=counts.T,
+      x=(x_edges[:-1] + x_edges[1:]) / 2,
+      y=(y_edges[:-1] + y_edges[1:]) / 2))
   fig.update_traces(contours_coloring="fill", contours_showlabels=True)
+  fig.update_layout(xaxis_title='Cosine distance', yaxis_title='L2 distance')
   fig.show()
 
 
-if __name__ == '__main__':
+def main():
   plot_heatmap('../data/nearface_out/morphs/clarkson_morphs_cosine', '../data/nearface_out/morphs/clarkson_morphs_l2')
-  # with open('../data/nearface_out/morphs/clarkson_morphs_cosine/00_0-01_0.png.csv') as f:
-  #   df = pandas.read_csv(f, delimiter='\t')
-  #   l = get_distances_from_df(df)
-  #   print(l)
+
+
+if __name__ == '__main__':
+  profiling.run(main)
 
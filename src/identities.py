@@ -0,0 +1,225 @@
+"""
+Morph Inspector
+Copyright (C) 2022  Cameron M Palmer [https://github.com/palmtrey/morphinspector]
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see [http://www.gnu.org/licenses/].
+
+=================================================================================
+
+identities.py parses still and morph file names in one place and registers
+identities and stills as integer codes.
+
+Stills are named 'id_imagenum.ext' (ex. '00_1.jpg') and morphs
+'still1-still2.ext' (ex. '00_1-01_0.png'); csvs add '.csv' to either name.
+The shared REGISTRY gives every identity and every still an integer code the
+first time it is seen, with the still's identity code and image number, so
+grouping and sorting are integer array operations. Stills sort by
+(identity, image number), numerically where the names are numeric.
+
+    Typical usage example:
+
+    codes = REGISTRY.stills(os.listdir(stills_dir))
+    stills = [files[i] for i in REGISTRY.sort_order(codes)]
+    id_1, id_2 = morph_identities('00_1-01_0.png.csv')
+"""
+
+
+import numpy as np
+import os
+import threading
+
+
+def parse_still(still: str) -> tuple[str, str]:
+  """Returns (identity, image number) of a still or still csv (ex. ('00', '1') for 'dir/00_1.jpg.csv')."""
+  name = still.split('/')[-1]
+  return (name.split('_')[0], name.split('.')[0].partition('_')[2])
+
+
+def still_identity(still: str) -> str:
+  """Returns the identity of a still or still csv (ex. '00' for '00_1.jpg')."""
+  return still.split('/')[-1].split('_')[0]
+
+
+def parse_morph(morph: str) -> tuple[str, str]:
+  """Returns the names of the two stills of a morph or morph csv (ex. ('00_1', '01_0') for '00_1-01_0.png.csv')."""
+  parts = morph.split('/')[-1].split('-')
+  return (parts[0].split('.')[0], parts[1].split('.')[0])
+
+
+def morph_identities(morph: str) -> tuple[str, str]:
+  """Returns the identities of the two stills of a morph or morph csv (ex. ('00', '01') for '00_1-01_0.png.csv')."""
+  still_1, still_2 = parse_morph(morph)
+  return (still_identity(still_1), still_identity(still_2))
+
+
+def identity_series(stills):
+  """Returns the identity of every still name of a pandas Series (vectorized still_identity)."""
+  return stills.str.split('_', n=1).str[0]
+
+
+def sort_value(text: str) -> tuple:
+  """Orders numeric names by value, before other names in string order."""
+  return (0, int(text), text) if text.isdigit() else (1, 0, text)
+
+
+def name_ranks(names: list[str]) -> np.ndarray:
+  """Returns the position of every name in sort_value order."""
+  order = sorted(range(len(names)), key=lambda code: sort_value(names[code]))
+  ranks = np.empty(len(order), dtype=np.int64)
+  ranks[order] = np.arange(len(order))
+  return ranks
+
+
+class Registry():
+  """
+  Assigns integer codes to identities and stills. A still is parsed
+  once, when it is first registered. Registration is thread safe.
+
+  Besides the codes, the registry keeps integer arrays updated at
+  registration time: the identity code and image number code of every
+  still, and the rank of every identity and image number in
+  (numeric) sort order, so stills are grouped and sorted without
+  revisiting their names.
+  """
+
+  def __init__(self):
+    self.lock = threading.Lock()
+
+    self.identity_codes = {}
+    self.identity_names = []
+    self.identity_ranks = np.array([], dtype=np.int64)
+
+    self.number_codes = {}
+    self.number_names = []
+    self.number_ranks = np.array([], dtype=np.int64)
+
+    self.still_codes = {}
+    self.still_names = []
+    self.still_identity_codes = np.array([], dtype=np.int64)
+    self.still_number_codes = np.array([], dtype=np.int64)
+
+    # Stills registered since the last update of the arrays
+    self.new_still_identity_codes = []
+    self.new_still_number_codes = []
+
+  def add_name(self, codes: dict, names: list[str], name: str) -> int:
+    """Returns the code of name in codes, appending it to names if needed. Called under self.lock."""
+    code = codes.get(name)
+    if code is None:
+      code = len(names)
+      names.append(name)
+      codes[name] = code
+    return code
+
+  def add_still(self, name: str) -> int:
+    """Returns the code of a still file name, registering it if needed. Called under self.lock."""
+    code = self.still_codes.get(name)
+    if code is None:
+      identity, number = parse_still(name)
+      code = len(self.still_names)
+      self.still_names.append(name)
+      self.new_still_identity_codes.append(self.add_name(self.identity_codes, self.identity_names, identity))
+      self.new_still_number_codes.append(self.add_name(self.number_codes, self.number_names, number))
+      self.still_codes[name] = code
+    return code
+
+  def update_arrays(self) -> None:
+    """Brings the arrays up to date with the names registered since the last call. Called under self.lock."""
+    if len(self.new_still_identity_codes) > 0:
+      self.still_identity_codes = np.concatenate([self.still_identity_codes,
+                                                  np.array(self.new_still_identity_codes, dtype=np.int64)])
+      self.still_number_codes = np.concatenate([self.still_number_codes,
+                                                np.array(self.new_still_number_codes, dtype=np.int64)])
+      self.new_still_identity_codes = []
+      self.new_still_number_codes = []
+
+    if len(self.identity_ranks) != len(self.identity_names):
+      self.identity_ranks = name_ranks(self.identity_names)
+    if len(self.number_ranks) != len(self.number_names):
+      self.number_ranks = name_ranks(self.number_names)
+
+  def identity(self, identity: str) -> int:
+    """Returns the code of an identity, registering it if needed."""
+    return int(self.identities([identity])[0])
+
+  def identities(self, identities: list[str]) -> np.ndarray:
+    """Returns the codes of a list of identities, registering new ones."""
+    codes = [self.identity_codes.get(identity) for identity in identities]
+    if None in codes:
+      with self.lock:
+        codes = [self.add_name(self.identity_codes, self.identity_names, identity) for identity in identities]
+        self.update_arrays()
+    return np.array(codes, dtype=np.int64)
+
+  def still(self, still: str) -> int:
+    """Returns the code of a still (file name or path), registering it if needed."""
+    return int(self.stills([still])[0])
+
+  def stills(self, stills: list[str]) -> np.ndarray:
+    """Returns the codes of a list of stills (file names or paths), registering new ones."""
+    names = [still.split('/')[-1] for still in stills]
+    codes = [self.still_codes.get(name) for name in names]
+    if None in codes:
+      with self.lock:
+        codes = [self.add_still(name) for name in names]
+        self.update_arrays()
+    return np.array(codes, dtype=np.int64)
+
+  def identity_of(self, still_codes: np.ndarray) -> np.ndarray:
+    """Returns the identity code of every still code."""
+    return self.still_identity_codes[still_codes]
+
+  def sort_order(self, still_codes: np.ndarray) -> np.ndarray:
+    """Returns the indices that sort still codes by (identity, image number)."""
+    still_codes = np.asarray(still_codes, dtype=np.int64)
+    return np.lexsort((self.number_ranks[self.still_number_codes[still_codes]],
+                       self.identity_ranks[self.still_identity_codes[still_codes]]))
+
+  def group(self, still_codes: np.ndarray) -> dict[str, np.ndarray]:
+    """Groups still codes by identity.
+
+    Returns:
+      A dict mapping each identity to the indices of its stills in
+      still_codes, in their original order.
+    """
+    identity_codes = self.identity_of(np.asarray(still_codes, dtype=np.int64))
+    order = np.argsort(identity_codes, kind='stable')
+    unique, starts = np.unique(identity_codes[order], return_index=True)
+    return {self.identity_names[code]: indices for code, indices in zip(unique, np.split(order, starts[1:]))}
+
+
+REGISTRY = Registry()
+
+_still_dirs = {}
+
+
+def stills_by_identity(stills_dir: str) -> dict[str, list[str]]:
+  """Lists a stills directory once and groups its files by identity.
+
+  The listing is cached until the directory changes, so the many
+  Morph objects of a dataset share one scan.
+
+  Returns:
+    A dict mapping each identity to its still files, in listing order.
+  """
+  key = (os.path.abspath(stills_dir), os.stat(stills_dir).st_mtime_ns)
+  groups = _still_dirs.get(key)
+
+  if groups is None:
+    files = os.listdir(stills_dir)
+    groups = {identity: [files[i] for i in indices]
+              for identity, indices in REGISTRY.group(REGISTRY.stills(files)).items()}
+    _still_dirs[key] = groups
+
+  return groups
@@ -0,0 +1,116 @@
+"""
+Morph Inspector
+Copyright (C) 2022  Cameron M Palmer [https://github.com/palmtrey/morphinspector]
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see [http://www.gnu.org/licenses/].
+
+=================================================================================
+
+ingest.py overlaps the reading and parsing of many small csv files with a
+bounded thread pool, for directories where every file costs a round trip to
+storage (ex. NFS). Reads run ahead of the consumer by a bounded number of
+files, and results are yielded in input order, so an analysis loop gets I/O
+parallelism without changing its results.
+
+The number of reader threads defaults to MORPHINSPECTOR_IO_WORKERS, or
+DEFAULT_WORKERS if it is not set. With 1 worker, files are read one after
+another in the calling thread.
+
+    Typical usage example:
+
+    for file, details in read_files(calc_details, files):
+      ...
+"""
+
+
+import collections
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+
+DEFAULT_WORKERS = 8
+
+
+def get_workers(workers: int = None) -> int:
+  """Returns workers, or MORPHINSPECTOR_IO_WORKERS or DEFAULT_WORKERS if it is None."""
+  if workers is None:
+    workers = int(os.environ.get('MORPHINSPECTOR_IO_WORKERS') or DEFAULT_WORKERS)
+  return max(1, workers)
+
+
+def read_files(function, items: list, workers: int = None, readahead: int = None, return_exceptions: bool = False):
+  """Calls function(item) on reader threads and yields the results in input order.
+
+  Args:
+    function: the reader, called once per item (ex. a csv parser
+      taking a path). It must be safe to call from several threads.
+    items: the items to read (ex. file paths).
+    workers: the number of reader threads (see get_workers()).
+    readahead: the maximum number of items read but not yet yielded
+      (default 4 * workers), which bounds the memory held by results
+      waiting for a slow item or a slow consumer.
+    return_exceptions: if True, an exception raised by function is
+      yielded in place of its result. Otherwise it is raised when its
+      item is reached, after every earlier result was yielded.
+
+  Yields:
+    Tuples (item, result), in the order of items.
+  """
+  workers = get_workers(workers)
+
+  if workers == 1:
+    for item in items:
+      try:
+        result = function(item)
+      except Exception as e:
+        if not return_exceptions:
+          raise
+        result = e
+      yield (item, result)
+    return
+
+  if readahead is None:
+    readahead = 4 * workers
+  readahead = max(readahead, workers)
+
+  items = iter(items)
+  pending = collections.deque()
+
+  with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='ingest') as executor:
+    try:
+      for item in items:
+        pending.append((item, executor.submit(function, item)))
+        if len(pending) >= readahead:
+          break
+
+      while len(pending) > 0:
+        item, future = pending.popleft()
+
+        # Refill before waiting, so the pool stays busy.
+        for next_item in items:
+          pending.append((next_item, executor.submit(function, next_item)))
+          break
+
+        try:
+          result = future.result()
+        except Exception as e:
+          if not return_exceptions:
+            raise
+          result = e
+        yield (item, result)
+    finally:
+      # On an error or an abandoned generator, do not start reads
+      # that nobody will consume.
+      for _, future in pending:
+        future.cancel()
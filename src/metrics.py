@@ -0,0 +1,238 @@
+"""
+Morph Inspector
+Copyright (C) 2022  Cameron M Palmer [https://github.com/palmtrey/morphinspector]
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see [http://www.gnu.org/licenses/].
+
+=================================================================================
+
+metrics.py exports the progress of long-running batch jobs (face_compare,
+compare_all_stills, writescores) so that a scheduler can follow them without a
+terminal: items done and total, items per second, errors, bytes read and the
+resident set size of the process.
+
+Metrics are written every few seconds, and once more when the job ends, to
+  <metrics_dir>/<job>.prom    a Prometheus textfile (node_exporter textfile collector)
+  <metrics_dir>/<job>.jsonl   a JSON-lines log with one record per update
+
+Export is enabled by passing metrics_dir to a batch job or by setting the
+environment variable MORPHINSPECTOR_METRICS_DIR. Otherwise JobMetrics only
+counts and writes nothing.
+
+    Typical usage example:
+
+    with JobMetrics('writescores', total=len(csvs), metrics_dir='../data/metrics') as job_metrics:
+      for csv in csvs:
+        ...
+        job_metrics.advance(file=csv)
+"""
+
+
+import dumps
+import json
+import os
+import resource
+import time
+
+
+DEFAULT_INTERVAL = 10.0
+
+PREFIX = 'morphinspector_job_'
+
+
+def get_metrics_dir(metrics_dir: str = None) -> str:
+  """Returns metrics_dir, or MORPHINSPECTOR_METRICS_DIR if it is None (None if neither is set)."""
+  if metrics_dir is None:
+    metrics_dir = os.environ.get('MORPHINSPECTOR_METRICS_DIR') or None
+  return metrics_dir
+
+
+def current_rss() -> int:
+  """Returns the resident set size of this process in bytes.
+
+  Reads /proc/self/statm where available and falls back to the peak
+  RSS reported by getrusage elsewhere.
+  """
+  try:
+    with open('/proc/self/statm', 'r') as f:
+      return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+  except (OSError, ValueError, IndexError):
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS.
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss if os.uname().sysname == 'Darwin' else maxrss * 1024
+
+
+class JobMetrics():
+  """
+  Tracks the progress of one batch job and periodically writes it to
+  a Prometheus textfile and a JSON-lines log. Use as a context
+  manager so that the final state is written when the job ends, even
+  if it fails.
+  """
+
+  def __init__(self, job: str, total: int = None, metrics_dir: str = None, interval: float = DEFAULT_INTERVAL):
+    """
+    Args:
+      job: the job name, used as the file name and the 'job' label.
+      total: the number of items the job will process, if known.
+      metrics_dir: the directory to write metrics to. Defaults to
+        MORPHINSPECTOR_METRICS_DIR; if neither is set, nothing is
+        written.
+      interval: the minimum number of seconds between two writes.
+    """
+    self.job = job
+    self.total = total
+    self.metrics_dir = get_metrics_dir(metrics_dir)
+    self.interval = interval
+
+    self.done = 0
+    self.errors = 0
+    self.bytes_read = 0
+    self.running = True
+
+    self.start_time = time.time()
+    self.last_progress_time = self.start_time
+    self.last_write = None
+    self.last_write_done = 0
+
+    if self.metrics_dir is not None:
+      os.makedirs(self.metrics_dir, exist_ok=True)
+      self.write()
+
+  @property
+  def enabled(self) -> bool:
+    return self.metrics_dir is not None
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    self.close()
+    return False
+
+  def advance(self, n: int = 1, bytes_read: int = 0, file: str = None) -> None:
+    """Records n finished items.
+
+    Args:
+      n: the number of items finished.
+      bytes_read: the number of bytes read for these items.
+      file: a file or archive member read for these items. Its size
+        (see dumps.getsize) is added to the bytes read (only looked up
+        while exporting).
+    """
+    self.done += n
+    self.bytes_read += bytes_read
+    self.last_progress_time = time.time()
+
+    if self.metrics_dir is None:
+      return
+
+    if file is not None:
+      try:
+        self.bytes_read += dumps.getsize(file)
+      except (OSError, KeyError):
+        pass
+
+    self.maybe_write()
+
+  def error(self, n: int = 1) -> None:
+    """Records n failed items. Failed items are not counted as done."""
+    self.errors += n
+    self.maybe_write()
+
+  def maybe_write(self) -> None:
+    if self.metrics_dir is not None and time.time() - self.last_write >= self.interval:
+      self.write()
+
+  def close(self) -> None:
+    """Marks the job as finished and writes the final metrics."""
+    if not self.running:
+      return
+    self.running = False
+    if self.metrics_dir is not None:
+      self.write()
+
+  def snapshot(self) -> dict:
+    """Returns the current metrics as a dict."""
+    now = time.time()
+    elapsed = now - self.start_time
+
+    if self.last_write is not None and now > self.last_write:
+      recent_rate = (self.done - self.last_write_done) / (now - self.last_write)
+    else:
+      recent_rate = 0.0
+
+    return {
+        'job': self.job,
+        'timestamp': now,
+        'running': self.running,
+        'items_done': self.done,
+        'items_total': self.total,
+        'errors': self.errors,
+        'bytes_read': self.bytes_read,
+        'elapsed_seconds': elapsed,
+        'items_per_second': self.done / elapsed if elapsed > 0 else 0.0,
+        'recent_items_per_second': recent_rate,
+        'last_progress_timestamp': self.last_progress_time,
+        'rss_bytes': current_rss(),
+        'pid': os.getpid()}
+
+  def write(self) -> None:
+    """Writes the current metrics to the Prometheus textfile and the JSON-lines log."""
+    record = self.snapshot()
+
+    with open(self.metrics_dir + '/' + self.job + '.jsonl', 'a') as f:
+      f.write(json.dumps(record) + '\n')
+
+    # Written to a temporary file and renamed, so that the textfile
+    # collector never reads a partial file.
+    prom_file = self.metrics_dir + '/' + self.job + '.prom'
+    with open(prom_file + '.tmp', 'w') as f:
+      f.write(format_prometheus(record))
+    os.replace(prom_file + '.tmp', prom_file)
+
+    self.last_write = record['timestamp']
+    self.last_write_done = record['items_done']
+
+
+PROMETHEUS_METRICS = [
+    # (record key, metric name, type, help)
+    ('running', 'running', 'gauge', '1 while the job is running, 0 once it has ended.'),
+    ('items_done', 'items_done', 'counter', 'Items processed so far.'),
+    ('items_total', 'items_total', 'gauge', 'Items the job will process.'),
+    ('errors', 'errors_total', 'counter', 'Items that failed.'),
+    ('bytes_read', 'bytes_read_total', 'counter', 'Bytes read so far.'),
+    ('elapsed_seconds', 'elapsed_seconds', 'gauge', 'Seconds since the job started.'),
+    ('items_per_second', 'items_per_second', 'gauge', 'Mean throughput since the job started.'),
+    ('recent_items_per_second', 'recent_items_per_second', 'gauge', 'Throughput since the previous update.'),
+    ('last_progress_timestamp', 'last_progress_timestamp_seconds', 'gauge', 'Unix time of the last finished item.'),
+    ('timestamp', 'last_update_timestamp_seconds', 'gauge', 'Unix time of this update.'),
+    ('rss_bytes', 'rss_bytes', 'gauge', 'Resident set size of the job process.')
+    ]
+
+
+def format_prometheus(record: dict) -> str:
+  """Formats a JobMetrics snapshot in the Prometheus text exposition format."""
+  labels = '{job="' + record['job'] + '"}'
+
+  lines = []
+  for key, name, metric_type, help in PROMETHEUS_METRICS:
+    value = record[key]
+    if value is None:
+      continue
+    lines.append('# HELP ' + PREFIX + name + ' ' + help)
+    lines.append('# TYPE ' + PREFIX + name + ' ' + metric_type)
+    lines.append(PREFIX + name + labels + ' ' + str(float(value)))
+
+  return '\n'.join(lines) + '\n'
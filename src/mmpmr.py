@@ -1,10 +1,12 @@
-import matplotlib.pyplot as plt
-import pandas
-import os
-from tqdm import tqdm
+import preview as previews
+import profiling
+import ranking
+import scores
+import timing
+from utils import Rank
 
 
-def calc_mmpmr(morphs_csvs_dir: str, tau: list[float], distance_label: str):
+def calc_mmpmr(morphs_csvs_dir: str, tau: list[float], distance_label: str, subset=None, preview: float = None):
   """Calculates MMPMR (Mated Morph Presentation Match Rate) for a fixed tau.
 
   Refer to: https://www.christoph-busch.de/files/Scherhag-Methodology-BIOSIG-2017.pdf
@@ -25,60 +27,46 @@ def calc_mmpmr(morphs_csvs_dir: str, tau: list[float], distance_label: str):
       to create graphs of tau vs. MMPMR).
     distance_label: the csv file label for distances 
       (ex. 'VGG-Face_cosine', 'VGG-Face_euclidean_l2', etc.)
+    subset: optional morph selector. Either a list of morph names
+      to restrict the calculation to, or a dict mapping labels to
+      lists of morph names, such as the output of
+      ranking.rank_morphs(). In the latter case a dict mapping each
+      label to its list of MMPMR values is returned.
+    preview: if given, the fraction of morphs to calculate MMPMR
+      from, drawn as a stratified sample by rank (the labels of a
+      subset dict) and identity. The standard error is reported.
   """
 
-  # print(os.listdir(morphs_csvs_dir))
+  if preview is not None:
+    result = previews.Preview(morphs_csvs_dir, None, distance_label, subset).mmpmr(preview, tau, subset)
+    previews.report_error(result, 'mmpmr')
+    return result['mmpmr'] if isinstance(subset, dict) else result['mmpmr'][None]
 
-  mmpmr_sum: dict[float:float] = {}
+  with timing.span('mmpmr.load_morphs'):
+    morph_scores = scores.load_morph_scores(morphs_csvs_dir, distance_label, scores.subset_names(subset))
+  timing.count('mmpmr.load_morphs', 'morphs', len(morph_scores))
 
-  M: int = len(os.listdir(morphs_csvs_dir))
+  results = {}
 
-  for morph_csv in tqdm(os.listdir(morphs_csvs_dir)):
-    morph_csv = morphs_csvs_dir + '/' + morph_csv
-    df = pandas.read_csv(morph_csv, sep='\t')
-    df.drop(columns=['Unnamed: 0'], inplace=True)
-    for i in range(len(df)):
-      df.at[i, 'identity'] = df['identity'][i].split('/')[-1]
+  for label, names in scores.select_subsets(morph_scores, subset).items():
+    results[label] = scores.mmpmr_values(morph_scores, names, tau)
 
-    identity_1 = morph_csv.split('/')[-1].split('-')[0].split('_')[0]
-    identity_2 = morph_csv.split('/')[-1].split('-')[1].split('.')[0].split('_')[0]
+  if isinstance(subset, dict):
+    return results
 
-    identity_1_distances = []
-    identity_2_distances = []
-
-    for i in range(len(df)):
-      if df['identity'][i].split('_')[0] == identity_1:
-        identity_1_distances.append(df[distance_label][i])
-      elif df['identity'][i].split('_')[0] == identity_2:
-        identity_2_distances.append(df[distance_label][i])
-      else:
-        pass
-    
-    try:
-      first_id_distances = [identity_1_distances[0], identity_2_distances[0]]
-    except IndexError:
-      print("No comparison image found for morph " + str(morph_csv) + '. Skipping.')
-      continue
-
-    for t in tau:
-      if max(first_id_distances) > t:
-        if t in mmpmr_sum.keys():
-          mmpmr_sum[t] += max(first_id_distances)
-        else:
-          mmpmr_sum[t] = max(first_id_distances)
-
-  result = []
-
-  for t in mmpmr_sum.keys():
-    result.append(1 / M * mmpmr_sum[t])
-
-  return result
+  return results[None]
     
 
-if __name__ == '__main__':
+def main():
   # Example usage
   tau = [0.0]
-  res = calc_mmpmr('../data/stats/nearface_out/morphs/ranking_subsets/frll_scanned_subset_l2/rank_c', tau, 'VGG-Face_euclidean_l2')
-  
+  ranks = ranking.rank_morphs('../data/stats/details_frll_scanned_l2.txt', 0.86)
+  res = calc_mmpmr('../data/stats/nearface_out/morphs/frll_morphs_scanned_l2', tau, 'VGG-Face_euclidean_l2',
+                   subset={Rank.C: ranks[Rank.C]})[Rank.C]
+
   # print(tau)
   print(res)
+
+
+if __name__ == '__main__':
+  profiling.run(main)
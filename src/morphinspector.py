@@ -1,8 +1,10 @@
 import gui
 import json
+import profiling
 import utils
 
-if __name__ == '__main__':
+
+def main():
   settings = utils.GUISettings(
              morphs_dir='', 
              stills_dir='', 
@@ -15,5 +17,9 @@ if __name__ == '__main__':
   with open('../resources/version.json', 'r') as f:
     utils.report('Running Morph Inspector version ' + str(json.load(f)), utils.ReportType.INFO)
 
-  gui = gui.MorphInspectorGUI(settings)
-  gui.start()
+  app = gui.MorphInspectorGUI(settings)
+  app.start()
+
+
+if __name__ == '__main__':
+  profiling.run(main, 'gui')
@@ -0,0 +1,264 @@
+"""
+Morph Inspector
+Copyright (C) 2022  Cameron M Palmer [https://github.com/palmtrey/morphinspector]
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see [http://www.gnu.org/licenses/].
+
+=================================================================================
+
+navigation.py orders and filters the morphs shown by the GUI by any details
+metric, and finds morphs by name prefix.
+
+A MorphIndex reads the details of every Morph once into one array per metric
+(ex. 'l2 1-wasserstein'). Orders are argsort indexes, computed once per
+metric and direction and reused for every view, and a sorted name table
+answers prefix searches with a binary search, so re-sorting and filtering
+100k morphs are array operations. Ranks (see ranking.rank_morphs) are
+computed from the distance arrays at any threshold.
+
+Dataset-wide rank counts, APCER and BPCER at a threshold are binary searches
+in sorted score arrays prepared once, so a threshold can be dragged without
+reading any file. APCER and BPCER are those of gen_det_curve, from the mated
+averages of the details and, if set, the still to still distances.
+
+A view is an array of morph indices (positions in the Morphs list) in display
+order.
+
+    Typical usage example:
+
+    morph_index = MorphIndex(Morphs)
+    view = morph_index.view('l2 avgdist', descending=True, ranks=[utils.Rank.C])
+    worst = [Morphs[i] for i in view[:50]]
+    position = morph_index.find_prefix('05_0-', view)
+    counts = morph_index.rank_counts('l2', 0.9)
+"""
+
+
+import numpy as np
+import store
+import utils
+
+
+TYPES = ['cosine', 'l2']
+
+DISTANCE_LABELS = {'cosine': 'VGG-Face_cosine', 'l2': 'VGG-Face_euclidean_l2'}
+
+# Recognition thresholds of VGG-Face, as shown by the GUI
+DEFAULT_THRESHOLDS = {'cosine': 0.4, 'l2': 0.86}
+
+RANK_CODES = {utils.Rank.A: 1, utils.Rank.B: 2, utils.Rank.C: 3}
+
+# Sort keys: a details metric of one distance type, or its rank
+KEYS = [type + ' ' + metric for type in TYPES for metric in store.METRICS.keys()] + [type + ' rank' for type in TYPES]
+
+
+def calc_ranks(distance_a: np.ndarray, distance_b: np.ndarray, threshold: float) -> np.ndarray:
+  """Returns the rank code (see RANK_CODES) of every morph, as ranking.rank_morphs ranks them."""
+  below_a = distance_a < threshold
+  below_b = distance_b < threshold
+  above_a = distance_a >= threshold
+  above_b = distance_b >= threshold
+
+  ranks = np.full(len(distance_a), RANK_CODES[utils.Rank.C], dtype=np.int8)
+  ranks[(below_a & above_b) | (above_a & below_b)] = RANK_CODES[utils.Rank.B]
+  ranks[below_a & below_b] = RANK_CODES[utils.Rank.A]
+  return ranks
+
+
+def rank_of(distance_a: float, distance_b: float, threshold: float) -> utils.Rank:
+  """Returns the rank of one morph at threshold."""
+  code = calc_ranks(np.array([distance_a], dtype=float), np.array([distance_b], dtype=float), threshold)[0]
+  return [rank for rank, rank_code in RANK_CODES.items() if rank_code == code][0]
+
+
+def load_metrics(Morphs: list) -> dict[str, np.ndarray]:
+  """Reads the details of every morph into one array per metric.
+
+  Details files are read whole, once per file, instead of once per
+  morph. Missing details are NaN.
+
+  Returns:
+    A dict mapping '<type> <metric>' (ex. 'l2 avgdist') to float arrays
+    holding one value per morph.
+  """
+  metrics = {}
+  for type in TYPES:
+    tables = {}
+    values = {metric: np.full(len(Morphs), np.nan) for metric in store.METRICS.keys()}
+
+    for i, morph in enumerate(Morphs):
+      details = getattr(morph, 'details_' + type, None)
+      details_path = getattr(morph, 'details_' + type + '_path', '')
+      if not isinstance(details, dict) and details_path != '':
+        if details_path not in tables:
+          tables[details_path] = store.load_details(details_path)
+        details = tables[details_path].get(morph.get_morph() + '.csv')
+
+      if isinstance(details, dict):
+        for metric in store.METRICS.keys():
+          values[metric][i] = details[metric]
+
+    for metric, array in values.items():
+      metrics[type + ' ' + metric] = array
+
+  return metrics
+
+
+class MorphIndex():
+  """
+  Precomputed orders and a prefix index over a list of Morphs.
+  """
+
+  def __init__(self, Morphs: list, metrics: dict[str, np.ndarray] = None):
+    """
+    Args:
+      Morphs: the Morphs to index, in their display order.
+      metrics: optional metric arrays (see load_metrics), read from
+        the Morphs if not given.
+    """
+    self.names = np.array([morph.get_morph() for morph in Morphs], dtype=str)
+    self.metrics = load_metrics(Morphs) if metrics is None else metrics
+    self.thresholds = dict(DEFAULT_THRESHOLDS)
+
+    self.orders = {}
+    self.rank_cache = {}
+
+    # Prefix index: the names in sorted order
+    self.name_order = np.argsort(self.names, kind='stable')
+    self.sorted_names = self.names[self.name_order]
+
+    # Sorted scores of each type for threshold readouts. A morph is rank
+    # A below its larger distance and rank C from its smaller distance
+    # on; morphs with a NaN distance are always rank C.
+    self.sorted_scores = {}
+    for type in TYPES:
+      distance_a = self.metrics[type + ' distanceA']
+      distance_b = self.metrics[type + ' distanceB']
+      finite = ~np.isnan(distance_a) & ~np.isnan(distance_b)
+      self.sorted_scores[type] = {
+          'larger': np.sort(np.maximum(distance_a, distance_b)[finite]),
+          'smaller': np.sort(np.minimum(distance_a, distance_b)[finite]),
+          'mated': np.sort(np.concatenate([distance_a, distance_b])),
+          'stills': None}
+
+  def __len__(self) -> int:
+    return len(self.names)
+
+  def values(self, key: str) -> np.ndarray:
+    """Returns the values of a sort key (see KEYS) for every morph."""
+    type, metric = key.split(' ', 1)
+    if metric == 'rank':
+      return self.ranks(type).astype(float)
+    return self.metrics[key]
+
+  def ranks(self, type: str = 'l2', threshold: float = None) -> np.ndarray:
+    """Returns the rank code of every morph at threshold (default self.thresholds[type])."""
+    if threshold is None:
+      threshold = self.thresholds[type]
+    key = (type, float(threshold))
+    if key not in self.rank_cache:
+      self.rank_cache[key] = calc_ranks(self.metrics[type + ' distanceA'], self.metrics[type + ' distanceB'], threshold)
+    return self.rank_cache[key]
+
+  def set_threshold(self, type: str, threshold: float) -> None:
+    """Sets the threshold of a type's ranks. Rank orders are recomputed for the new threshold."""
+    self.thresholds[type] = threshold
+    self.rank_cache = {key: ranks for key, ranks in self.rank_cache.items() if key[0] != type}
+    self.orders = {key: order for key, order in self.orders.items() if key[0] != type + ' rank'}
+
+  def set_still_distances(self, type: str, still_distances: np.ndarray) -> None:
+    """Sets the still to still distances of a type (ex. from scores.load_still_scores) for BPCER."""
+    self.sorted_scores[type]['stills'] = np.sort(still_distances)
+
+  def rank_counts(self, type: str, threshold: float) -> dict:
+    """Returns the number of morphs of each rank at threshold, as a dict {utils.Rank: count}."""
+    scores = self.sorted_scores[type]
+    rank_a = int(np.searchsorted(scores['larger'], threshold, side='left'))
+    not_rank_c = int(np.searchsorted(scores['smaller'], threshold, side='left'))
+    return {utils.Rank.A: rank_a, utils.Rank.B: not_rank_c - rank_a, utils.Rank.C: len(self.names) - not_rank_c}
+
+  def error_rates(self, type: str, threshold: float) -> tuple[float, float]:
+    """Returns (APCER, BPCER) at threshold, BPCER NaN if no still distances are set.
+
+    A mated average below threshold is an accepted morph attack (NaN is
+    never accepted), a still distance from threshold on a rejected bona
+    fide comparison, as in scores.confusion_counts.
+    """
+    scores = self.sorted_scores[type]
+    apcer = np.searchsorted(scores['mated'], threshold, side='left') / len(scores['mated']) if len(scores['mated']) > 0 else np.nan
+
+    stills = scores['stills']
+    if stills is None or len(stills) == 0:
+      return (float(apcer), np.nan)
+    bpcer = (len(stills) - np.searchsorted(stills, threshold, side='left')) / len(stills)
+    return (float(apcer), float(bpcer))
+
+  def order(self, key: str = None, descending: bool = False) -> np.ndarray:
+    """Returns the morph indices sorted by a key, NaN last, ties in display order.
+
+    Args:
+      key: a sort key (see KEYS), or None for the display order.
+      descending: sort the largest values first.
+    """
+    if key is None:
+      return np.arange(len(self.names))
+
+    if (key, descending) not in self.orders:
+      values = self.values(key)
+      self.orders[(key, descending)] = np.argsort(-values if descending else values, kind='stable')
+    return self.orders[(key, descending)]
+
+  def view(self, key: str = None, descending: bool = False, low: float = None, high: float = None,
+           ranks: list = None, rank_type: str = 'l2') -> np.ndarray:
+    """Returns the morph indices to show, in order.
+
+    Args:
+      key, descending: the order (see order()).
+      low, high: optional inclusive bounds on the values of key. Morphs
+        with NaN values are excluded by any bound.
+      ranks: optional list of utils.Rank to keep, ranked by rank_type
+        at its current threshold.
+    """
+    order = self.order(key, descending)
+
+    mask = np.ones(len(self.names), dtype=bool)
+    if key is not None and (low is not None or high is not None):
+      values = self.values(key)
+      with np.errstate(invalid='ignore'):
+        if low is not None:
+          mask &= values >= low
+        if high is not None:
+          mask &= values <= high
+    if ranks is not None:
+      mask &= np.isin(self.ranks(rank_type), [RANK_CODES[rank] for rank in ranks])
+
+    return order[mask[order]]
+
+  def find_prefix(self, prefix: str, view: np.ndarray) -> int:
+    """Finds the first morph of a view whose name starts with prefix.
+
+    Returns:
+      The position of the morph in view, or None if no morph of the
+      view matches.
+    """
+    start = np.searchsorted(self.sorted_names, prefix, side='left')
+    # Names with the prefix are a contiguous run of the sorted names.
+    end = np.searchsorted(self.sorted_names, prefix + '\U0010ffff', side='left')
+    if end <= start or len(view) == 0:
+      return None
+
+    positions = np.full(len(self.names), len(view), dtype=np.int64)
+    positions[view] = np.arange(len(view))
+    position = int(np.min(positions[self.name_order[start:end]]))
+    return None if position == len(view) else position
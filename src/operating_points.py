@@ -0,0 +1,188 @@
+"""
+Morph Inspector
+Copyright (C) 2022  Cameron M Palmer [https://github.com/palmtrey/morphinspector]
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see [http://www.gnu.org/licenses/].
+
+=================================================================================
+
+operating_points.py answers operating point queries (APCER @ BPCER,
+BPCER @ APCER, FNMR @ FMR, EER and tau @ rate) for any number of ROC or DET
+curves at once. Values are linearly interpolated between the two gamma grid
+points that bracket each target instead of snapping to the nearest point.
+
+With morphs as attack presentations, a morph accepted by the FRS is a false
+match and a rejected bona fide still comparison is a false non-match, so
+FMR = APCER and FNMR = BPCER.
+
+    Typical usage example:
+
+    xy = det_curve.gen_det_curve('morph_csvs_dir', 'still_csvs_dir', 0.001)
+    points = query_curve(xy, apcer_at_bpcer=[0.1, 0.01], eer=True)
+    print(points['APCER@BPCER=0.1'], points['EER'])
+"""
+
+
+import numpy as np
+
+
+def to_apcer_bpcer(curve_type: str, xy: tuple[list[float], list[float]]) -> tuple[np.ndarray, np.ndarray]:
+  """Converts ROC (FPR, TPR) or DET (APCER, BPCER) data to APCER and BPCER arrays."""
+  if curve_type == 'roc':
+    return (1 - np.asarray(xy[1], dtype=float), np.asarray(xy[0], dtype=float))
+  elif curve_type == 'det':
+    return (np.asarray(xy[0], dtype=float), np.asarray(xy[1], dtype=float))
+  else:
+    raise ValueError(curve_type + ' is not a valid curve type.')
+
+
+def interp_monotone(x: np.ndarray, y: np.ndarray, targets: np.ndarray) -> np.ndarray:
+  """Interpolates y at x = target for every row of x and y at once.
+
+  Each row of x must be non-decreasing (small violations are removed
+  with a running maximum). For every target, y is interpolated
+  between the last point with x < target and the first point with
+  x >= target. Targets outside a row's range are clamped to its
+  first or last point, and rows containing NaN give NaN.
+
+  Args:
+    x: a (n_curves, n_points) array.
+    y: a (n_curves, n_points) array.
+    targets: a (n_targets,) array.
+
+  Returns:
+    A (n_curves, n_targets) array.
+  """
+  n_curves, n_points = x.shape
+  targets = np.asarray(targets, dtype=float)
+
+  invalid = np.isnan(x).any(axis=1) | np.isnan(y).any(axis=1)
+  x = np.maximum.accumulate(np.where(invalid[:, None], 0, x), axis=1)
+
+  # Offset every row into its own disjoint range so that a single
+  # searchsorted call over the flattened array serves all curves.
+  low = min(x.min(), targets.min()) if targets.size else x.min()
+  high = max(x.max(), targets.max()) if targets.size else x.max()
+  span = high - low + 1
+  offsets = np.arange(n_curves)[:, None] * span
+
+  flat_x = (x - low + offsets).ravel()
+  flat_targets = (targets[None, :] - low + offsets).ravel()
+  idx = np.searchsorted(flat_x, flat_targets, side='left').reshape(n_curves, -1)
+  idx -= np.arange(n_curves)[:, None] * n_points
+
+  upper = np.clip(idx, 0, n_points - 1)
+  lower = np.clip(idx - 1, 0, n_points - 1)
+
+  rows = np.arange(n_curves)[:, None]
+  x0, x1 = x[rows, lower], x[rows, upper]
+  y0, y1 = y[rows, lower], y[rows, upper]
+
+  with np.errstate(divide='ignore', invalid='ignore'):
+    weight = np.where(x1 > x0, (targets[None, :] - x0) / (x1 - x0), 1.0)
+
+  result = y0 + np.clip(weight, 0, 1) * (y1 - y0)
+  result[invalid] = np.nan
+
+  return result
+
+
+def query_operating_points(curves: list,
+                           curve_type: str = 'det',
+                           gamma_list: np.ndarray = None,
+                           apcer_at_bpcer: list[float] = (),
+                           bpcer_at_apcer: list[float] = (),
+                           fnmr_at_fmr: list[float] = (),
+                           tau_at_apcer: list[float] = (),
+                           tau_at_bpcer: list[float] = (),
+                           eer: bool = False
+                           ) -> dict[str, np.ndarray]:
+  """Answers operating point queries for many curves at once.
+
+  Args:
+    curves: a list of curves as returned by gen_roc_curve or
+      gen_det_curve. All curves must use the same gamma grid.
+    curve_type: 'roc' or 'det', the type of all curves.
+    gamma_list: the gamma grid of the curves, needed for tau queries.
+    apcer_at_bpcer: BPCER targets to report APCER at.
+    bpcer_at_apcer: APCER targets to report BPCER at.
+    fnmr_at_fmr: FMR targets to report FNMR at.
+    tau_at_apcer: APCER targets to report the threshold tau at.
+    tau_at_bpcer: BPCER targets to report the threshold tau at.
+    eer: if True, also report the equal error rate and its tau.
+
+  Returns:
+    A dict mapping query names (ex. 'APCER@BPCER=0.1', 'EER',
+    'tau@APCER=0.001') to arrays holding one value per curve.
+  """
+  if len(curves) == 0:
+    return {}
+
+  apcer = []
+  bpcer = []
+  for xy in curves:
+    a, b = to_apcer_bpcer(curve_type, xy)
+    apcer.append(a)
+    bpcer.append(b)
+  apcer = np.vstack(apcer)
+  bpcer = np.vstack(bpcer)
+
+  if (len(tau_at_apcer) > 0 or len(tau_at_bpcer) > 0) and gamma_list is None:
+    raise ValueError('gamma_list is required for tau queries.')
+
+  # Along increasing gamma APCER rises and BPCER falls, so BPCER based
+  # queries run over the reversed grid.
+  gamma = None
+  if gamma_list is not None:
+    gamma = np.broadcast_to(np.asarray(gamma_list, dtype=float), apcer.shape)
+
+  result = {}
+
+  def add(name: str, targets: list[float], values: np.ndarray) -> None:
+    for i, target in enumerate(targets):
+      result[name + '=' + str(target)] = values[:, i]
+
+  if len(apcer_at_bpcer) > 0:
+    add('APCER@BPCER', apcer_at_bpcer, interp_monotone(bpcer[:, ::-1], apcer[:, ::-1], apcer_at_bpcer))
+
+  if len(bpcer_at_apcer) > 0:
+    add('BPCER@APCER', bpcer_at_apcer, interp_monotone(apcer, bpcer, bpcer_at_apcer))
+
+  if len(fnmr_at_fmr) > 0:
+    add('FNMR@FMR', fnmr_at_fmr, interp_monotone(apcer, bpcer, fnmr_at_fmr))
+
+  if len(tau_at_apcer) > 0:
+    add('tau@APCER', tau_at_apcer, interp_monotone(apcer, gamma, tau_at_apcer))
+
+  if len(tau_at_bpcer) > 0:
+    add('tau@BPCER', tau_at_bpcer, interp_monotone(bpcer[:, ::-1], gamma[:, ::-1], tau_at_bpcer))
+
+  if eer:
+    difference = apcer - bpcer
+    result['EER'] = interp_monotone(difference, (apcer + bpcer) / 2, [0.0])[:, 0]
+    if gamma is not None:
+      result['tau@EER'] = interp_monotone(difference, gamma, [0.0])[:, 0]
+
+  return result
+
+
+def query_curve(xy: tuple[list[float], list[float]], curve_type: str = 'det', gamma_list: np.ndarray = None,
+                **queries) -> dict[str, float]:
+  """Same as query_operating_points, but for a single curve.
+
+  Returns:
+    A dict mapping query names to float values.
+  """
+  result = query_operating_points([xy], curve_type, gamma_list, **queries)
+  return {name: float(values[0]) for name, values in result.items()}
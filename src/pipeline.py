@@ -0,0 +1,630 @@
+"""
+Morph Inspector
+Copyright (C) 2022  Cameron M Palmer [https://github.com/palmtrey/morphinspector]
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see [http://www.gnu.org/licenses/].
+
+=================================================================================
+
+pipeline.py computes any number of analyses of a dump directory from a single
+streaming read of each csv. Every morph csv is parsed once into a record, and
+every registered consumer (details, ROC/DET curves, MMPMR, ranks, density
+bins) updates its own partial state from it. Still csvs are read once for all
+consumers that need them.
+
+Consumers keep mergeable partial state that does not depend on the order in
+which files were seen, so files can be split across worker processes or
+machines and the states merged. The results are the same as those of
+writescores, gen_roc_curve, gen_det_curve, calc_mmpmr, rank_morphs and
+bin_heatmap (details and ranks are listed in morph name order).
+
+To split a run across machines sharing a filesystem, run every shard with
+the same arguments, each writing a partial result file, then merge them:
+
+  python pipeline.py run MORPHS STILLS --shard 0 --shards 4 --partial part-0.json
+  ...
+  python pipeline.py merge part-*.json --details details.txt
+
+Morph and still csvs are assigned to shards by a hash of their name (see
+dumps.shard_of()), so every node selects its files without coordination. The merged
+output is identical to that of a single-node run.
+
+    Typical usage example:
+
+    pipeline = Pipeline('morph_csvs_dir', stills_csvs_dir='still_csvs_dir')
+    pipeline.add('details', DetailsConsumer())
+    pipeline.add('det', CurveConsumer('det', 0.001))
+    pipeline.add('mmpmr', MMPMRConsumer([0.86]))
+    results = pipeline.run(workers=4)
+"""
+
+
+import argparse
+import copy
+import aggregates
+import dumps
+import identities
+import ingest
+import json
+import numpy as np
+import os
+import pandas
+import profiling
+import scores
+import statistics
+import store
+import timing
+import utils
+from concurrent.futures import ProcessPoolExecutor
+from utils import Rank
+
+
+PARTIAL_FORMAT = 'morphinspector-partial'
+PARTIAL_VERSION = 2
+
+
+class Consumer():
+  """
+  The interface of a pipeline consumer. consume() and consume_stills()
+  update the partial state, merge() adds the state of a consumer that
+  saw other files, and result() returns the final result.
+  get_state() and set_state() convert the partial state to and from
+  JSON-serializable values for partial result files.
+  """
+
+  # Whether the pipeline must read still csvs and paired morph csvs for this consumer
+  needs_stills = False
+  needs_paired = False
+
+  def consume(self, record: dict) -> None:
+    """Updates the state with one morph record (see read_morph_record())."""
+
+  def consume_stills(self, distances: np.ndarray) -> None:
+    """Updates the state with the nonzero distances of one still csv."""
+
+  def merge(self, other: 'Consumer') -> None:
+    """Adds the state of another consumer of the same configuration, which saw later files."""
+    raise NotImplementedError
+
+  def result(self):
+    raise NotImplementedError
+
+  def get_state(self) -> dict:
+    raise NotImplementedError
+
+  def set_state(self, state: dict) -> None:
+    raise NotImplementedError
+
+
+class DetailsConsumer(Consumer):
+  """Morph details as written by utils.writescores, keyed by csv file name."""
+
+  def __init__(self):
+    self.details = {}
+    self.errors = 0
+
+  def consume(self, record: dict) -> None:
+    try:
+      self.details[record['key']] = utils.morph_details(*record['mated'])
+    except statistics.StatisticsError:
+      print('StatisticsError. Skipping morph.')
+      self.errors += 1
+
+  def merge(self, other: 'DetailsConsumer') -> None:
+    self.details.update(other.details)
+    self.errors += other.errors
+
+  def result(self) -> dict:
+    return dict(sorted(self.details.items()))
+
+  def get_state(self) -> dict:
+    return {'details': self.details, 'errors': self.errors}
+
+  def set_state(self, state: dict) -> None:
+    self.details = state['details']
+    self.errors = state['errors']
+
+
+class RankConsumer(Consumer):
+  """Morph ranks as returned by ranking.rank_morphs for a threshold."""
+
+  def __init__(self, threshold: float):
+    self.threshold = threshold
+    self.ranks = {}
+
+  def consume(self, record: dict) -> None:
+    distanceA = aggregates.finite_mean(record['mated'][0])
+    distanceB = aggregates.finite_mean(record['mated'][1])
+    if np.isnan(distanceA) or np.isnan(distanceB):
+      # No details, as in DetailsConsumer
+      return
+
+    if distanceA < self.threshold and distanceB < self.threshold:
+      self.ranks[record['name']] = Rank.A
+    elif distanceA < self.threshold and distanceB >= self.threshold:
+      self.ranks[record['name']] = Rank.B
+    elif distanceA >= self.threshold and distanceB < self.threshold:
+      self.ranks[record['name']] = Rank.B
+    else:
+      self.ranks[record['name']] = Rank.C
+
+  def merge(self, other: 'RankConsumer') -> None:
+    self.ranks.update(other.ranks)
+
+  def result(self) -> dict:
+    result = {Rank.A: [], Rank.B: [], Rank.C: []}
+    for name in sorted(self.ranks.keys()):
+      result[self.ranks[name]].append(name)
+    return result
+
+  def get_state(self) -> dict:
+    return {'ranks': {name: rank.name for name, rank in self.ranks.items()}}
+
+  def set_state(self, state: dict) -> None:
+    self.ranks = {name: Rank[rank] for name, rank in state['ranks'].items()}
+
+
+class CurveConsumer(Consumer):
+  """
+  ROC or DET curves as returned by gen_roc_curve or gen_det_curve.
+  Keeps the two mated means of every morph and, per gamma, the number
+  of still distances below it, so still distances are never held.
+  """
+
+  needs_stills = True
+
+  def __init__(self, curve_type: str, gamma_step: float, subset=None):
+    if curve_type not in ['roc', 'det']:
+      raise ValueError(curve_type + ' is not a valid curve type.')
+
+    self.curve_type = curve_type
+    self.subset = subset
+    self.gamma_list = np.arange(0, 2 + gamma_step, gamma_step)
+
+    self.mated = {}
+    self.still_below = np.zeros(len(self.gamma_list), dtype=np.int64)
+    self.still_total = 0
+
+  def consume(self, record: dict) -> None:
+    self.mated[record['name']] = (aggregates.finite_mean(record['mated'][0]), aggregates.finite_mean(record['mated'][1]))
+
+  def consume_stills(self, distances: np.ndarray) -> None:
+    self.still_below += np.searchsorted(np.sort(distances), self.gamma_list, side='left')
+    self.still_total += len(distances)
+
+  def merge(self, other: 'CurveConsumer') -> None:
+    self.mated.update(other.mated)
+    self.still_below += other.still_below
+    self.still_total += other.still_total
+
+  def result(self):
+    curves = {}
+    for label, names in scores.select_subsets(dict(sorted(self.mated.items())), self.subset).items():
+      mated = np.sort(np.array([mean for name in names for mean in self.mated[name]], dtype=float))
+      FN = np.searchsorted(mated, self.gamma_list, side='left')
+      counts = {'TP': len(mated) - FN, 'FN': FN, 'TN': self.still_below, 'FP': self.still_total - self.still_below}
+      x, y = scores.curve_rates(counts, self.curve_type)
+      curves[label] = (x.tolist(), y.tolist())
+
+    return curves if isinstance(self.subset, dict) else curves[None]
+
+  def get_state(self) -> dict:
+    return {'mated': {name: list(means) for name, means in self.mated.items()},
+            'still_below': self.still_below.tolist(), 'still_total': self.still_total}
+
+  def set_state(self, state: dict) -> None:
+    self.mated = {name: tuple(means) for name, means in state['mated'].items()}
+    self.still_below = np.array(state['still_below'], dtype=np.int64)
+    self.still_total = state['still_total']
+
+
+class MMPMRConsumer(Consumer):
+  """
+  MMPMR as returned by calc_mmpmr, keeping the larger of the first
+  distances to the two identities of every morph. Values are listed
+  in the order of tau.
+  """
+
+  def __init__(self, tau: list[float], subset=None):
+    self.tau = list(tau)
+    self.subset = subset
+    self.first = {}
+
+  def consume(self, record: dict) -> None:
+    identity_1_distances, identity_2_distances = record['mated']
+    if len(identity_1_distances) == 0 or len(identity_2_distances) == 0:
+      print("No comparison image found for morph " + record['name'] + '. Skipping.')
+      self.first[record['name']] = None
+    else:
+      self.first[record['name']] = max(identity_1_distances[0], identity_2_distances[0])
+
+  def merge(self, other: 'MMPMRConsumer') -> None:
+    self.first.update(other.first)
+
+  def result(self):
+    values = {}
+    for label, names in scores.select_subsets(dict(sorted(self.first.items())), self.subset).items():
+      first = np.array([self.first[name] for name in names if self.first[name] is not None], dtype=float)
+      values[label] = [float(np.sum(first[first > t])) / len(names) for t in self.tau if np.any(first > t)]
+
+    return values if isinstance(self.subset, dict) else values[None]
+
+  def get_state(self) -> dict:
+    return {'first': {name: None if first is None else float(first) for name, first in self.first.items()}}
+
+  def set_state(self, state: dict) -> None:
+    self.first = dict(state['first'])
+
+
+class DensityConsumer(Consumer):
+  """
+  The 2D histogram of paired (ex. cosine) against primary (ex. L2)
+  distances, as returned by heatmap.bin_heatmap.
+  """
+
+  needs_paired = True
+
+  def __init__(self, bins: int = 200,
+               bin_range: tuple[tuple[float, float], tuple[float, float]] = ((0, 2), (0, 2))):
+    self.x_edges = np.linspace(bin_range[0][0], bin_range[0][1], bins + 1)
+    self.y_edges = np.linspace(bin_range[1][0], bin_range[1][1], bins + 1)
+    self.counts = np.zeros((bins, bins))
+
+  def consume(self, record: dict) -> None:
+    if record['paired'] is None:
+      return
+    primary = dumps.key_by_still(record['stills'], record['distances'])
+    joined = pandas.concat([record['paired'], primary], axis=1, join='inner')
+    self.counts += np.histogram2d(joined.iloc[:, 0].to_numpy(dtype=float), joined.iloc[:, 1].to_numpy(dtype=float),
+                                  bins=[self.x_edges, self.y_edges])[0]
+
+  def merge(self, other: 'DensityConsumer') -> None:
+    self.counts += other.counts
+
+  def result(self) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    return (self.counts, self.x_edges, self.y_edges)
+
+  def get_state(self) -> dict:
+    return {'counts': self.counts.tolist()}
+
+  def set_state(self, state: dict) -> None:
+    self.counts = np.array(state['counts'], dtype=float)
+
+
+def read_morph_record(csv_file: str, distance_label: str, paired_file: str = None, paired_label: str = None) -> dict:
+  """Parses a morph csv (and its paired csv) once into the record handed to every consumer.
+
+  Returns:
+    A dict with keys
+      'key': the csv file name without compression extension,
+      'name': the morph name,
+      'stills', 'distances': still names and distances in csv order,
+      'mated': (identity_1_distances, identity_2_distances) arrays as
+        in utils.import_morph_nearface_csv,
+      'paired': a Series of paired distances indexed by still name
+        (see dumps.key_by_still), or None.
+  """
+  chunks = list(dumps.read_chunks(csv_file, distance_label))
+  if len(chunks) > 0:
+    stills = pandas.concat([chunk[0] for chunk in chunks], ignore_index=True)
+    distances = np.concatenate([chunk[1] for chunk in chunks])
+  else:
+    stills = pandas.Series([], dtype=str)
+    distances = np.array([], dtype=float)
+
+  identity_1, identity_2 = identities.morph_identities(csv_file)
+  still_identities = identities.identity_series(stills).to_numpy()
+  is_1 = still_identities == identity_1
+  is_2 = (still_identities == identity_2) & ~is_1
+
+  paired = None
+  if paired_file is not None:
+    paired = dumps.read_csv(paired_file, sep='\t', usecols=['identity', paired_label])
+    paired = dumps.key_by_still(paired['identity'].str.split('/').str[-1], paired[paired_label])
+
+  return {
+      'key': dumps.strip_compression(csv_file.split('/')[-1]),
+      'name': scores.morph_name(csv_file),
+      'stills': stills,
+      'distances': distances,
+      'mated': (distances[is_1], distances[is_2]),
+      'paired': paired}
+
+
+def run_shard(consumers: dict[str, Consumer], jobs: dict, files: list, io_workers: int = None) -> dict[str, Consumer]:
+  """Feeds one shard of files to consumers. Runs in a worker process when sharded.
+
+  Args:
+    consumers: the consumers to update.
+    jobs: the pipeline settings (see Pipeline.get_jobs()).
+    files: a list of ('morph', file) and ('still', file) items.
+    io_workers: the number of reader threads.
+
+  Returns:
+    consumers, updated.
+  """
+  morph_consumers = list(consumers.values())
+  still_consumers = [consumer for consumer in consumers.values() if consumer.needs_stills]
+
+  def read(item):
+    kind, file = item
+    if kind == 'still':
+      distances = dumps.read_distances(jobs['stills_csvs_dir'] + '/' + file, jobs['distance_label'])
+      return distances[distances != 0]
+
+    paired_file = None
+    if jobs['paired'] is not None:
+      paired_file = jobs['paired'].get(dumps.strip_compression(file))
+      paired_file = jobs['paired_csvs_dir'] + '/' + paired_file if paired_file is not None else None
+    return read_morph_record(jobs['morphs_csvs_dir'] + '/' + file, jobs['distance_label'], paired_file,
+                             jobs['paired_label'])
+
+  for (kind, _), result in ingest.read_files(read, files, io_workers):
+    with timing.span('pipeline.consume'):
+      if kind == 'still':
+        for consumer in still_consumers:
+          consumer.consume_stills(result)
+      else:
+        for consumer in morph_consumers:
+          consumer.consume(result)
+
+  return consumers
+
+
+class Pipeline():
+  """
+  Reads a morph dump directory (and, if needed, a still dump directory
+  and a paired morph dump directory) once for a set of consumers.
+  """
+
+  def __init__(self, morphs_csvs_dir: str,
+               distance_label: str = 'VGG-Face_euclidean_l2',
+               stills_csvs_dir: str = None,
+               paired_csvs_dir: str = None,
+               paired_label: str = 'VGG-Face_cosine'):
+    """
+    Args:
+      morphs_csvs_dir: path to a morph dump directory or archive.
+      distance_label: the csv file label for distances.
+      stills_csvs_dir: path to a still dump directory or archive, needed
+        by curve consumers.
+      paired_csvs_dir: path to a second morph dump directory of another
+        metric, needed by density consumers (ex. the cosine dumps of
+        the same morphs).
+      paired_label: the distance label of paired_csvs_dir.
+    """
+    self.morphs_csvs_dir = morphs_csvs_dir
+    self.distance_label = distance_label
+    self.stills_csvs_dir = stills_csvs_dir
+    self.paired_csvs_dir = paired_csvs_dir
+    self.paired_label = paired_label
+    self.consumers = {}
+
+  def add(self, name: str, consumer: Consumer) -> Consumer:
+    """Registers a consumer whose result is returned by run() under name."""
+    self.consumers[name] = consumer
+    return consumer
+
+  def get_jobs(self) -> dict:
+    """Returns the settings shared by every shard."""
+    needs_paired = any(consumer.needs_paired for consumer in self.consumers.values())
+    if needs_paired and self.paired_csvs_dir is None:
+      raise ValueError('A density consumer needs paired_csvs_dir.')
+
+    paired = None
+    if needs_paired:
+      paired = {dumps.strip_compression(file): file for file in dumps.listdir(self.paired_csvs_dir)}
+
+    return {'morphs_csvs_dir': self.morphs_csvs_dir, 'distance_label': self.distance_label,
+            'stills_csvs_dir': self.stills_csvs_dir, 'paired_csvs_dir': self.paired_csvs_dir,
+            'paired_label': self.paired_label, 'paired': paired}
+
+  def get_files(self, shard: int = None, shards: int = 1) -> list[tuple[str, str]]:
+    """Returns the ('morph', file) and ('still', file) items to read, in a deterministic order.
+
+    Args:
+      shard: if given, only the files of this shard (see dumps.shard_of()).
+      shards: the total number of shards.
+    """
+    files = [('morph', file) for file in sorted(dumps.listdir(self.morphs_csvs_dir))]
+
+    if any(consumer.needs_stills for consumer in self.consumers.values()):
+      if self.stills_csvs_dir is None:
+        raise ValueError('A curve consumer needs stills_csvs_dir.')
+      files += [('still', file) for file in sorted(dumps.listdir(self.stills_csvs_dir))]
+
+    if shard is not None:
+      files = [(kind, file) for kind, file in files if dumps.shard_of(file, shards) == shard]
+
+    return files
+
+  def run(self, workers: int = 1, io_workers: int = None, shard: int = None, shards: int = 1) -> dict:
+    """Reads every file once and returns the result of every consumer.
+
+    Args:
+      workers: the number of worker processes. Files are split into
+        contiguous blocks whose consumer states are merged, so results
+        do not depend on workers.
+      io_workers: the number of reader threads per process (see
+        ingest.get_workers).
+      shard: if given, only the files of this shard are read, for a
+        partial result (see save_partial()).
+      shards: the total number of shards.
+
+    Returns:
+      A dict mapping each consumer name to its result.
+    """
+    if shard is not None and not 0 <= shard < shards:
+      raise ValueError('shard must be between 0 and ' + str(shards - 1) + '.')
+
+    jobs = self.get_jobs()
+    files = self.get_files(shard, shards)
+
+    if workers <= 1 or len(files) < 2:
+      consumers = run_shard(self.consumers, jobs, files, io_workers)
+    else:
+      size = -(-len(files) // workers)
+      shards = [files[i:i + size] for i in range(0, len(files), size)]
+      with ProcessPoolExecutor(max_workers=workers) as executor:
+        states = list(executor.map(run_shard, [copy.deepcopy(self.consumers) for _ in shards], [jobs] * len(shards),
+                                   shards, [io_workers] * len(shards)))
+
+      consumers = states[0]
+      for state in states[1:]:
+        for name, consumer in consumers.items():
+          consumer.merge(state[name])
+      self.consumers = consumers
+
+    return {name: consumer.result() for name, consumer in consumers.items()}
+
+  def save_partial(self, partial_file: str, shard: int, shards: int, args: dict = None) -> None:
+    """Writes the partial state of every consumer after run(shard=shard, shards=shards).
+
+    Args:
+      partial_file: the JSON file to write.
+      shard, shards: the shard that was run.
+      args: optional JSON-serializable arguments needed to rebuild the
+        pipeline when merging (see main()).
+    """
+    partial = {
+        'format': PARTIAL_FORMAT,
+        'version': PARTIAL_VERSION,
+        'shard': shard,
+        'shards': shards,
+        'args': args,
+        'consumers': {name: {'type': type(consumer).__name__, 'state': consumer.get_state()}
+                      for name, consumer in self.consumers.items()}}
+
+    with open(partial_file + '.tmp', 'w') as f:
+      json.dump(partial, f)
+    os.replace(partial_file + '.tmp', partial_file)
+
+  def merge_partials(self, partials: list[dict]) -> dict:
+    """Merges the partial results of every shard into the results of a single-node run.
+
+    The consumers of this pipeline must be configured as those of the
+    shard runs; their own state is replaced.
+
+    Args:
+      partials: the partial results of every shard (see load_partial()).
+
+    Returns:
+      A dict mapping each consumer name to its result, as run().
+    """
+    shards = set(partial['shards'] for partial in partials)
+    if len(shards) != 1:
+      raise ValueError('Partial results of different shard counts cannot be merged.')
+    shards = shards.pop()
+
+    found = sorted(partial['shard'] for partial in partials)
+    if found != list(range(shards)):
+      raise ValueError('Expected shards 0 to ' + str(shards - 1) + ' once each, got ' + str(found) + '.')
+
+    merged = {name: copy.deepcopy(consumer) for name, consumer in self.consumers.items()}
+    for i, partial in enumerate(partials):
+      for name, consumer in merged.items():
+        entry = partial['consumers'].get(name)
+        if entry is None or entry['type'] != type(consumer).__name__:
+          raise ValueError('Shard ' + str(partial['shard']) + ' has no ' + type(consumer).__name__ + ' ' + name + '.')
+
+        if i == 0:
+          consumer.set_state(entry['state'])
+        else:
+          shard_consumer = copy.deepcopy(self.consumers[name])
+          shard_consumer.set_state(entry['state'])
+          consumer.merge(shard_consumer)
+
+    self.consumers = merged
+    return {name: consumer.result() for name, consumer in merged.items()}
+
+
+def load_partial(partial_file: str) -> dict:
+  """Loads a partial result file written by Pipeline.save_partial()."""
+  with open(partial_file, 'r') as f:
+    partial = json.load(f)
+
+  if partial.get('format') != PARTIAL_FORMAT or partial.get('version') != PARTIAL_VERSION:
+    raise ValueError(partial_file + ' is not a partial result file of version ' + str(PARTIAL_VERSION) + '.')
+
+  return partial
+
+
+def build_pipeline(args: dict) -> Pipeline:
+  """Builds the pipeline of the command line (the same for run and merge)."""
+  pipeline = Pipeline(args['morphs_csvs_dir'], args['distance_label'], args['stills_csvs_dir'])
+  pipeline.add('details', DetailsConsumer())
+  pipeline.add('ranks', RankConsumer(args['threshold']))
+  pipeline.add('roc', CurveConsumer('roc', args['gamma_step']))
+  pipeline.add('det', CurveConsumer('det', args['gamma_step']))
+  pipeline.add('mmpmr', MMPMRConsumer([args['threshold']]))
+  return pipeline
+
+
+def write_results(results: dict, args: dict, details_file: str = None) -> None:
+  if details_file is not None:
+    store.save_details(results['details'], details_file)
+
+  for rank, names in results['ranks'].items():
+    utils.report(str(rank) + ': ' + str(len(names)) + ' morphs', utils.ReportType.INFO)
+  utils.report('MMPMR at ' + str(args['threshold']) + ': ' + str(results['mmpmr']), utils.ReportType.INFO)
+
+
+def main():
+  parser = argparse.ArgumentParser(description='Computes details, ranks, curves and MMPMR of a dump directory in one pass.')
+  subparsers = parser.add_subparsers(dest='command', required=True)
+
+  run_parser = subparsers.add_parser('run', help='run the pipeline, or one shard of it')
+  run_parser.add_argument('morphs_csvs_dir', help='morph dump directory or archive')
+  run_parser.add_argument('stills_csvs_dir', help='still dump directory or archive')
+  run_parser.add_argument('--distance-label', default='VGG-Face_euclidean_l2', help='csv distance column')
+  run_parser.add_argument('--threshold', type=float, default=0.86, help='rank and MMPMR threshold')
+  run_parser.add_argument('--gamma-step', type=float, default=0.001, help='gamma step of the curves')
+  run_parser.add_argument('--workers', type=int, default=1, help='number of worker processes')
+  run_parser.add_argument('--shard', type=int, default=None, help='run only this shard (0 to shards - 1)')
+  run_parser.add_argument('--shards', type=int, default=1, help='total number of shards')
+  run_parser.add_argument('--partial', default=None, help='write the partial result of the shard to this file')
+  run_parser.add_argument('--details', default=None, help='write morph details (as writescores) to this file')
+
+  merge_parser = subparsers.add_parser('merge', help='merge the partial results of every shard')
+  merge_parser.add_argument('partials', nargs='+', help='partial result files')
+  merge_parser.add_argument('--details', default=None, help='write morph details (as writescores) to this file')
+
+  args = parser.parse_args()
+
+  if args.command == 'run':
+    pipeline_args = {key: getattr(args, key) for key in
+                     ['morphs_csvs_dir', 'stills_csvs_dir', 'distance_label', 'threshold', 'gamma_step']}
+    pipeline = build_pipeline(pipeline_args)
+    results = pipeline.run(args.workers, shard=args.shard, shards=args.shards)
+
+    if args.partial is not None:
+      if args.shard is None:
+        pipeline.save_partial(args.partial, 0, 1, pipeline_args)
+      else:
+        pipeline.save_partial(args.partial, args.shard, args.shards, pipeline_args)
+    if args.shard is None:
+      write_results(results, pipeline_args, args.details)
+
+  else:
+    partials = [load_partial(partial_file) for partial_file in args.partials]
+    pipeline_args = partials[0]['args']
+    if any(partial['args'] != pipeline_args for partial in partials):
+      raise ValueError('Partial results of different arguments cannot be merged.')
+
+    results = build_pipeline(pipeline_args).merge_partials(partials)
+    write_results(results, pipeline_args, args.details)
+
+
+if __name__ == '__main__':
+  profiling.run(main)
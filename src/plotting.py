@@ -0,0 +1,359 @@
+"""
+Morph Inspector
+Copyright (C) 2022  Cameron M Palmer [https://github.com/palmtrey/morphinspector]
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see [http://www.gnu.org/licenses/].
+
+=================================================================================
+
+plotting.py renders ROC, DET and Wasserstein figures straight to PNG, SVG or
+PDF files through the Agg backend, without pyplot or a display. Any number of
+curves can be drawn on one figure; dense curves are drawn as decimated lines
+instead of thousands of scatter markers. Independent figures can be rendered
+in a process pool with render_batch().
+
+For large details files, the Wasserstein figures can be drawn from binned
+counts and per-bin quantiles instead of one marker per morph. These
+aggregates are cached next to the details file for instant re-plotting.
+
+    Typical usage example:
+
+    render_curves([xy, xya, xyb, xyc], 'roc.png', 'roc', labels=['All', 'A', 'B', 'C'])
+
+    render_batch([
+        {'type': 'curves', 'curves': [xy], 'output_file': 'roc.svg', 'curve_type': 'roc'},
+        {'type': 'wasserstein', 'morph_details_file': 'details_l2.txt', 'output_prefix': 'l2'}])
+"""
+
+
+import cache
+import numpy as np
+import os
+import store
+from concurrent.futures import ProcessPoolExecutor
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.colors import LogNorm
+from matplotlib.figure import Figure
+
+
+# The largest number of points drawn per curve. 2001 point curves from a
+# 0.001 gamma step look identical at this resolution.
+DEFAULT_MAX_POINTS = 500
+
+WASSERSTEIN_QUANTILES = [0.05, 0.25, 0.5, 0.75, 0.95]
+
+AXIS_LABELS = {
+    'roc': ('False Positive Rate', 'True Positive Rate'),
+    'det': ('APCER', 'BPCER')
+    }
+
+
+def decimate(x: list[float], y: list[float], max_points: int = DEFAULT_MAX_POINTS) -> tuple[np.ndarray, np.ndarray]:
+  """Reduces a curve to at most max_points points for drawing.
+
+  Consecutive repeated points (common when a gamma step changes no
+  counts) are dropped first, then the remaining points are sampled
+  evenly, always keeping the first and last point.
+  """
+  x = np.asarray(x, dtype=float)
+  y = np.asarray(y, dtype=float)
+
+  if len(x) == 0:
+    return (x, y)
+
+  keep = np.ones(len(x), dtype=bool)
+  keep[1:] = (np.diff(x) != 0) | (np.diff(y) != 0)
+  x = x[keep]
+  y = y[keep]
+
+  if len(x) > max_points:
+    idx = np.unique(np.linspace(0, len(x) - 1, max_points).round().astype(int))
+    x = x[idx]
+    y = y[idx]
+
+  return (x, y)
+
+
+def new_figure() -> Figure:
+  """Creates a figure attached to an Agg canvas."""
+  fig = Figure(figsize=(6.4, 4.8))
+  FigureCanvasAgg(fig)
+  return fig
+
+
+def render_curves(curves: list,
+                  output_file: str,
+                  curve_type: str = 'roc',
+                  labels: list[str] = None,
+                  title: str = '',
+                  max_points: int = DEFAULT_MAX_POINTS
+                  ) -> None:
+  """Renders any number of ROC or DET curves on one figure to a file.
+
+  Args:
+    curves: a list of curves as returned by gen_roc_curve or
+      gen_det_curve.
+    output_file: the file to write. The format (png, svg, pdf, ...)
+      is taken from its extension.
+    curve_type: 'roc' or 'det', used for the axis labels.
+    labels: optional legend labels, one per curve.
+    title: the title of the figure.
+    max_points: the largest number of points drawn per curve.
+  """
+  fig = new_figure()
+  ax = fig.add_subplot()
+
+  for i, xy in enumerate(curves):
+    x, y = decimate(xy[0], xy[1], max_points)
+    ax.plot(x, y, linewidth=1, label=None if labels is None else labels[i])
+
+  ax.set_title(title)
+  ax.set_xlabel(AXIS_LABELS[curve_type][0])
+  ax.set_ylabel(AXIS_LABELS[curve_type][1])
+  ax.set_xlim([0, 1])
+  ax.set_ylim([0, 1])
+
+  if labels is not None and any(labels):
+    ax.legend(loc='upper right')
+
+  fig.savefig(output_file)
+
+
+def load_details_arrays(morph_details_file: str) -> dict[str, np.ndarray]:
+  """Reads a details file written by utils.writescores into NumPy arrays.
+
+  Returns:
+    A dict mapping 'distanceA', 'distanceB' and '1-wasserstein' to
+    float arrays holding one value per morph.
+  """
+  details = store.load_details(morph_details_file)
+
+  result = {}
+  for metric in ['distanceA', 'distanceB', '1-wasserstein']:
+    result[metric] = np.fromiter((details[key][metric] for key in details.keys()), dtype=float, count=len(details))
+
+  return result
+
+
+def binned_quantiles(x: np.ndarray, y: np.ndarray, edges: np.ndarray, quantiles: list[float]) -> np.ndarray:
+  """Calculates quantiles of y within each bin of x.
+
+  Returns:
+    A (len(quantiles), len(edges) - 1) array, NaN for empty bins.
+  """
+  n_bins = len(edges) - 1
+  bin_idx = np.clip(np.searchsorted(edges, x, side='right') - 1, 0, n_bins - 1)
+
+  # Sort by bin, then by y within each bin, so that every bin is a
+  # sorted slice of y.
+  order = np.lexsort((y, bin_idx))
+  y_sorted = y[order]
+  bin_sorted = bin_idx[order]
+
+  starts = np.searchsorted(bin_sorted, np.arange(n_bins), side='left')
+  counts = np.searchsorted(bin_sorted, np.arange(n_bins), side='right') - starts
+  nonempty = counts > 0
+
+  result = np.full((len(quantiles), n_bins), np.nan)
+  for i, q in enumerate(quantiles):
+    position = starts[nonempty] + q * (counts[nonempty] - 1)
+    low = np.floor(position).astype(int)
+    high = np.ceil(position).astype(int)
+    result[i, nonempty] = y_sorted[low] + (position - low) * (y_sorted[high] - y_sorted[low])
+
+  return result
+
+
+def calc_wasserstein_aggregates(arrays: dict[str, np.ndarray], bins: int = 100) -> dict[str, np.ndarray]:
+  """Bins distance A, distance B and their mean against the 1-wasserstein distance.
+
+  Args:
+    arrays: output of load_details_arrays().
+    bins: the number of bins along each axis.
+
+  Returns:
+    A dict of arrays. For each of 'distance_a', 'distance_b' and
+    'distance_mean' it holds <name>_counts (2D histogram counts),
+    <name>_edges (distance bin edges) and <name>_quantiles
+    (WASSERSTEIN_QUANTILES of the 1-wasserstein distance per distance
+    bin). 'wasserstein_edges' and 'wasserstein_hist' hold the shared
+    1-wasserstein bin edges and histogram.
+  """
+  wasserstein = arrays['1-wasserstein']
+  distances = {
+      'distance_a': arrays['distanceA'],
+      'distance_b': arrays['distanceB'],
+      'distance_mean': (arrays['distanceA'] + arrays['distanceB']) / 2}
+
+  valid = np.isfinite(wasserstein)
+  for x in distances.values():
+    valid &= np.isfinite(x)
+
+  wasserstein = wasserstein[valid]
+  result = {}
+  result['wasserstein_edges'] = np.histogram_bin_edges(wasserstein, bins)
+  result['wasserstein_hist'] = np.histogram(wasserstein, result['wasserstein_edges'])[0]
+
+  for name, x in distances.items():
+    x = x[valid]
+    edges = np.histogram_bin_edges(x, bins)
+    result[name + '_edges'] = edges
+    result[name + '_counts'] = np.histogram2d(x, wasserstein, bins=[edges, result['wasserstein_edges']])[0]
+    result[name + '_quantiles'] = binned_quantiles(x, wasserstein, edges, WASSERSTEIN_QUANTILES)
+
+  return result
+
+
+def load_wasserstein_aggregates(morph_details_file: str, bins: int = 100) -> dict[str, np.ndarray]:
+  """Returns the aggregates of a details file, cached next to it.
+
+  The aggregates are stored in morph_details_file + '.agg.npz' and
+  reused for as long as the details file is unchanged.
+  """
+  cache_file = morph_details_file + '.agg.npz'
+  fingerprint = cache.fingerprint_path(morph_details_file)
+
+  if os.path.exists(cache_file):
+    with np.load(cache_file) as npz:
+      if str(npz['fingerprint']) == fingerprint and int(npz['bins']) == bins:
+        return {key: npz[key] for key in npz.files if key not in ['fingerprint', 'bins']}
+
+  result = calc_wasserstein_aggregates(load_details_arrays(morph_details_file), bins)
+
+  with open(cache_file + '.tmp', 'wb') as f:
+    np.savez(f, fingerprint=np.array(fingerprint), bins=np.array(bins), **result)
+  os.replace(cache_file + '.tmp', cache_file)
+
+  return result
+
+
+def draw_wasserstein_aggregate(ax, aggregates: dict[str, np.ndarray], name: str, xlabel: str) -> None:
+  """Draws the binned counts and per-bin quantiles of one distance against the 1-wasserstein distance."""
+  counts = np.ma.masked_equal(aggregates[name + '_counts'].T, 0)
+  edges = aggregates[name + '_edges']
+  centers = (edges[:-1] + edges[1:]) / 2
+  quantiles = aggregates[name + '_quantiles']
+
+  mesh = ax.pcolormesh(edges, aggregates['wasserstein_edges'], counts, norm=LogNorm(), cmap='viridis')
+  ax.figure.colorbar(mesh, ax=ax, label='morphs')
+
+  # Quantile rows are WASSERSTEIN_QUANTILES: 5, 25, 50, 75, 95 %.
+  ax.fill_between(centers, quantiles[1], quantiles[3], color='tab:red', alpha=0.2, linewidth=0)
+  ax.plot(centers, quantiles[2], color='tab:red', linewidth=1, label='median')
+  ax.plot(centers, quantiles[0], color='tab:red', linewidth=0.5, linestyle='--', label='5 / 95 %')
+  ax.plot(centers, quantiles[4], color='tab:red', linewidth=0.5, linestyle='--')
+
+  ax.set_xlabel(xlabel)
+  ax.set_ylabel('1-wasserstein distance')
+  ax.legend(loc='upper right')
+
+
+def render_wasserstein(morph_details_file: str, output_prefix: str, ext: str = 'png', aggregate: bool = False,
+                       bins: int = 100) -> list[str]:
+  """Renders the four utils.plot_wasserstein figures to files.
+
+  Args:
+    morph_details_file: a details file written by utils.writescores.
+    output_prefix: the path prefix of the files to write.
+    ext: the file format (png, svg, pdf, ...).
+    aggregate: if True, draw binned counts with per-bin quantiles
+      (see load_wasserstein_aggregates) instead of one marker per
+      morph.
+    bins: the number of bins along each axis when aggregating.
+
+  Returns:
+    The list of files written.
+  """
+  figures = [
+      ('distance_a', 'distanceA', 'distance A'),
+      ('distance_b', 'distanceB', 'distance B'),
+      ('distance_mean', None, 'Average of distance A and B')]
+
+  output_files = []
+
+  if aggregate:
+    aggregates = load_wasserstein_aggregates(morph_details_file, bins)
+
+    for name, metric, xlabel in figures:
+      fig = new_figure()
+      draw_wasserstein_aggregate(fig.add_subplot(), aggregates, name, xlabel)
+      output_files.append(output_prefix + '_' + name + '.' + ext)
+      fig.savefig(output_files[-1])
+
+    fig = new_figure()
+    ax = fig.add_subplot()
+    ax.stairs(aggregates['wasserstein_hist'], aggregates['wasserstein_edges'], fill=True)
+    ax.set_xlabel('1-wasserstein distance')
+    output_files.append(output_prefix + '_wasserstein_hist.' + ext)
+    fig.savefig(output_files[-1])
+
+    return output_files
+
+  arrays = load_details_arrays(morph_details_file)
+  wasserstein = arrays['1-wasserstein']
+
+  for name, metric, xlabel in figures:
+    if metric is None:
+      x = (arrays['distanceA'] + arrays['distanceB']) / 2
+    else:
+      x = arrays[metric]
+
+    fig = new_figure()
+    ax = fig.add_subplot()
+    # Rasterize the markers so that svg and pdf files stay small.
+    ax.scatter(x, wasserstein, s=5, rasterized=True)
+    ax.set_xlabel(xlabel)
+    ax.set_ylabel('1-wasserstein distance')
+    output_files.append(output_prefix + '_' + name + '.' + ext)
+    fig.savefig(output_files[-1])
+
+  fig = new_figure()
+  ax = fig.add_subplot()
+  ax.hist(wasserstein, bins=bins)
+  ax.set_xlabel('1-wasserstein distance')
+  output_files.append(output_prefix + '_wasserstein_hist.' + ext)
+  fig.savefig(output_files[-1])
+
+  return output_files
+
+
+RENDERERS = {
+    'curves': render_curves,
+    'wasserstein': render_wasserstein
+    }
+
+
+def render_job(job: dict) -> None:
+  """Renders a single figure job (see render_batch)."""
+  job = dict(job)
+  RENDERERS[job.pop('type')](**job)
+
+
+def render_batch(jobs: list[dict], workers: int = None) -> None:
+  """Renders independent figures in a process pool.
+
+  Args:
+    jobs: a list of dicts, each holding a 'type' ('curves' or
+      'wasserstein') and the keyword arguments of render_curves or
+      render_wasserstein.
+    workers: the number of worker processes (defaults to the number
+      of CPUs). With 1 worker, figures are rendered in this process.
+  """
+  if workers == 1 or len(jobs) <= 1:
+    for job in jobs:
+      render_job(job)
+    return
+
+  with ProcessPoolExecutor(max_workers=workers) as executor:
+    list(executor.map(render_job, jobs))
@@ -0,0 +1,260 @@
+"""
+Morph Inspector
+Copyright (C) 2022  Cameron M Palmer [https://github.com/palmtrey/morphinspector]
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see [http://www.gnu.org/licenses/].
+
+=================================================================================
+
+preview.py computes ROC curves, DET curves and MMPMR from a stratified sample
+of the morph and still csvs, with a standard error estimate, so that
+thresholds and subsets can be explored in seconds.
+
+Morphs are stratified by rank (the labels of a subset dict, ex. the output of
+ranking.rank_morphs) and by their first identity, stills by identity. Each
+stratum contributes the sampled fraction of its files (rounded up or down at
+random, so the expected fraction is exact).
+
+Samples are nested: for a fixed seed, the sample at a larger fraction contains
+the sample at every smaller fraction. A Preview object keeps the csvs it has
+read, so progressive refinement (see Preview.refine) only reads the new files
+of each step, ending with the exact full-dataset result at fraction 1.
+
+Standard errors are binomial (curves) or sample (MMPMR) standard errors with
+a finite population correction, so they shrink to 0 at fraction 1.
+
+    Typical usage example:
+
+    curves = roc_curve.gen_roc_curve('morph_csvs_dir', 'still_csvs_dir', 0.001, preview=0.05)
+
+    preview = Preview('morph_csvs_dir', 'still_csvs_dir', subset=ranks)
+    for result in preview.refine('det', fractions=[0.05, 0.25, 1.0]):
+      print(result['fraction'], result['max_se'])
+"""
+
+
+import dumps
+import identities
+import ingest
+import numpy as np
+import scores
+import utils
+
+
+def stratified_sample(keys: list, fraction: float, seed: int = 0) -> np.ndarray:
+  """Draws a nested stratified sample.
+
+  Args:
+    keys: the stratum key of every item.
+    fraction: the fraction of each stratum to sample (0 to 1).
+    seed: the random seed. For a fixed seed and keys, samples at
+      larger fractions contain samples at smaller fractions.
+
+  Returns:
+    A boolean mask of the sampled items.
+  """
+  rng = np.random.default_rng(seed)
+  priority = rng.random(len(keys))
+
+  strata = {}
+  for i, key in enumerate(keys):
+    strata.setdefault(key, []).append(i)
+
+  mask = np.zeros(len(keys), dtype=bool)
+  if fraction <= 0:
+    return mask
+
+  for key in sorted(strata.keys(), key=str):
+    members = np.array(strata[key])
+    offset = rng.random()
+    n = min(len(members), int(np.floor(fraction * len(members) + offset)))
+    mask[members[np.argsort(priority[members], kind='stable')[:n]]] = True
+
+  return mask
+
+
+def proportion_se(p: np.ndarray, n: float, fraction: float) -> np.ndarray:
+  """Returns the standard error of sampled proportions p over n items with a finite population correction."""
+  if n == 0:
+    return np.full(np.shape(p), np.nan)
+  with np.errstate(invalid='ignore'):
+    return np.sqrt(p * (1 - p) / n * max(1 - fraction, 0))
+
+
+class Preview():
+  """
+  Computes curves and MMPMR from growing stratified samples of one
+  pair of morph and still csv directories.
+  """
+
+  def __init__(self, morphs_csvs_dir: str, stills_csvs_dir: str = None,
+               distance_label: str = 'VGG-Face_euclidean_l2', subset=None, seed: int = 0):
+    """
+    Args:
+      morphs_csvs_dir: path to a directory containing morph csvs.
+      stills_csvs_dir: path to a directory containing still csvs
+        (not needed for MMPMR).
+      distance_label: the csv file label for distances.
+      subset: an optional subset dict (ex. ranks) whose labels are
+        used as rank strata.
+      seed: the random seed of the samples.
+    """
+    self.morphs_csvs_dir = morphs_csvs_dir
+    self.stills_csvs_dir = stills_csvs_dir
+    self.distance_label = distance_label
+    self.seed = seed
+
+    self.morph_files = sorted(dumps.listdir(morphs_csvs_dir))
+    self.still_files = sorted(dumps.listdir(stills_csvs_dir)) if stills_csvs_dir is not None else []
+
+    ranks = {}
+    if isinstance(subset, dict):
+      for label, names in subset.items():
+        for name in names or []:
+          ranks.setdefault(name, str(label))
+
+    morph_names = [scores.morph_name(file) for file in self.morph_files]
+    self.morph_keys = [(ranks.get(name), identities.morph_identities(name)[0]) for name in morph_names]
+    self.still_keys = [identities.still_identity(file) for file in self.still_files]
+
+    self.morph_scores = {}
+    self.still_distances = {}
+
+  def load(self, fraction: float) -> tuple[list[str], list[str]]:
+    """Reads the csvs of the sample at fraction that have not been read yet.
+
+    Returns:
+      A tuple (morph_names, still_files) of the sample.
+    """
+    morph_mask = stratified_sample(self.morph_keys, fraction, self.seed)
+    still_mask = stratified_sample(self.still_keys, fraction, self.seed + 1)
+
+    morph_names = [scores.morph_name(file) for file, sampled in zip(self.morph_files, morph_mask) if sampled]
+    still_files = [file for file, sampled in zip(self.still_files, still_mask) if sampled]
+
+    missing = set(name for name in morph_names if name not in self.morph_scores)
+    if len(missing) > 0:
+      self.morph_scores.update(scores.load_morph_scores(self.morphs_csvs_dir, self.distance_label, missing))
+
+    read = lambda file: dumps.read_distances(self.stills_csvs_dir + '/' + file, self.distance_label)
+    new_files = [file for file in still_files if file not in self.still_distances]
+    for file, distances in ingest.read_files(read, new_files):
+      self.still_distances[file] = distances[distances != 0]
+
+    return (morph_names, still_files)
+
+  def curve(self, curve_type: str, fraction: float, gamma_step: float = 0.001, subset=None) -> dict:
+    """Computes ROC or DET curves from the sample at fraction.
+
+    Args:
+      curve_type: 'roc' or 'det'.
+      fraction: the sampled fraction of morphs and stills.
+      gamma_step: the gamma step of the curves.
+      subset: a subset selector as for gen_roc_curve.
+
+    Returns:
+      A dict with keys
+        'curves': {label: (x, y)} lists, label None if subset is not a dict,
+        'se': {label: (se_x, se_y)} standard error arrays,
+        'max_se': the largest standard error over all curves,
+        'fraction', 'morphs', 'stills': the sampled fraction and sizes.
+    """
+    gamma_list = np.arange(0, 2 + gamma_step, gamma_step)
+    morph_names, still_files = self.load(fraction)
+
+    sampled_scores = {name: self.morph_scores[name] for name in morph_names}
+    if len(still_files) > 0:
+      still_distances = np.sort(np.concatenate([self.still_distances[file] for file in still_files]))
+    else:
+      still_distances = np.array([], dtype=float)
+
+    morph_fraction = len(morph_names) / max(len(self.morph_files), 1)
+    still_fraction = len(still_files) / max(len(self.still_files), 1)
+
+    curves = {}
+    se = {}
+    for label, names in scores.select_subsets(sampled_scores, subset).items():
+      counts = scores.confusion_counts(scores.mated_means(sampled_scores, names), still_distances, gamma_list)
+      x, y = scores.curve_rates(counts, curve_type)
+      curves[label] = (x.tolist(), y.tolist())
+
+      # ROC x and DET y are still rates, ROC y and DET x morph rates.
+      mated_se = lambda p: proportion_se(p, 2 * len(names), morph_fraction)
+      still_se = lambda p: proportion_se(p, len(still_distances), still_fraction)
+      se[label] = (still_se(x), mated_se(y)) if curve_type == 'roc' else (mated_se(x), still_se(y))
+
+    max_se = max([float(np.nanmax(np.r_[se_x, se_y, 0])) for se_x, se_y in se.values()], default=0.0)
+
+    return {'curves': curves, 'se': se, 'max_se': max_se, 'fraction': fraction,
+            'morphs': len(morph_names), 'stills': len(still_files)}
+
+  def mmpmr(self, fraction: float, tau: list[float], subset=None) -> dict:
+    """Computes MMPMR from the sample at fraction.
+
+    Returns:
+      A dict with keys
+        'mmpmr': {label: values} as returned by calc_mmpmr,
+        'se': {label: standard error per tau},
+        'max_se', 'fraction', 'morphs': as for curve().
+    """
+    morph_names, _ = self.load(fraction)
+    sampled_scores = {name: self.morph_scores[name] for name in morph_names}
+    morph_fraction = len(morph_names) / max(len(self.morph_files), 1)
+
+    values = {}
+    se = {}
+    for label, names in scores.select_subsets(sampled_scores, subset).items():
+      values[label] = scores.mmpmr_values(sampled_scores, names, tau)
+
+      first = np.array([max(sampled_scores[name][0][0], sampled_scores[name][1][0]) for name in names
+                        if len(sampled_scores[name][0]) > 0 and len(sampled_scores[name][1]) > 0])
+      errors = []
+      for t in tau:
+        contributions = np.r_[np.where(first > t, first, 0), np.zeros(len(names) - len(first))]
+        if len(contributions) > 1:
+          errors.append(float(np.std(contributions, ddof=1) / np.sqrt(len(contributions))
+                              * np.sqrt(max(1 - morph_fraction, 0))))
+        else:
+          errors.append(np.nan)
+      se[label] = errors
+
+    max_se = max([float(np.nanmax(np.r_[errors, 0])) for errors in se.values()], default=0.0)
+
+    return {'mmpmr': values, 'se': se, 'max_se': max_se, 'fraction': fraction, 'morphs': len(morph_names)}
+
+  def refine(self, kind: str, fractions: list[float] = (0.05, 0.25, 1.0), **kwargs):
+    """Yields results for growing fractions, reading only the new csvs of each step.
+
+    Args:
+      kind: 'roc', 'det' or 'mmpmr'.
+      fractions: increasing sample fractions. End with 1.0 for the
+        exact full-dataset result.
+      kwargs: passed on to curve() (gamma_step, subset) or mmpmr()
+        (tau, subset).
+    """
+    for fraction in fractions:
+      if kind == 'mmpmr':
+        yield self.mmpmr(fraction, **kwargs)
+      else:
+        yield self.curve(kind, fraction, **kwargs)
+
+
+def report_error(result: dict, kind: str) -> None:
+  """Reports the size and standard error of a preview through utils.report."""
+  message = (kind.upper() + ' preview from ' + format(result['fraction'], '.0%') + ' of the data ('
+             + str(result['morphs']) + ' morphs')
+  if 'stills' in result:
+    message += ', ' + str(result['stills']) + ' still csvs'
+  message += '), max standard error ' + format(result['max_se'], '.4f')
+  utils.report(message, utils.ReportType.INFO)
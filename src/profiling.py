@@ -0,0 +1,296 @@
+"""
+Morph Inspector
+Copyright (C) 2022  Cameron M Palmer [https://github.com/palmtrey/morphinspector]
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see [http://www.gnu.org/licenses/].
+
+=================================================================================
+
+profiling.py provides the --profile option shared by every entry point
+(det_main.py, roc_main.py, mmpmr.py, heatmap.py, face_compare.py,
+experiment.py and the GUI). Entry points call run(main), which strips the
+profiling options from the command line and runs main under the requested
+profiler:
+
+  --profile            cProfile, plus a stack sampler for flame graphs
+  --profile-sample     the stack sampler only, for long runs where cProfile's
+                       overhead would distort the result
+  --profile-output P   output path prefix (default ../data/profiles/<entry>-<time>)
+  --tracemalloc N      also snapshot allocations and report the top N sites
+
+Outputs, next to the prefix P:
+  P.pstats             cProfile statistics (python -m pstats, snakeviz, ...)
+  P.txt                the top functions by cumulative time
+  P.collapsed          collapsed stacks ('frame;frame;frame count') for
+                       flamegraph.pl, speedscope or inferno
+  P.tracemalloc.txt    the peak traced memory and the top allocation
+                       sites, snapshotted near the peak
+
+The stack sampler samples every thread of the main process (ex. the csv
+reader threads of ingest.py), with each stack rooted at its thread name.
+cProfile only sees the thread that calls profile(), so under --profile
+ingest.py reads files in that thread (MORPHINSPECTOR_IO_WORKERS=1, unless it
+is set); readers given an explicit number of workers are not affected.
+Worker processes are not profiled.
+
+    Typical usage example:
+
+    python det_main.py --profile
+    python heatmap.py --profile-sample --tracemalloc 25
+"""
+
+
+import argparse
+import cProfile
+import io
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+
+
+PROFILE_DIR = '../data/profiles'
+
+DEFAULT_SAMPLE_INTERVAL = 0.005
+
+# A new peak snapshot is taken once traced memory exceeds the last one
+# by this factor, so steadily growing runs are not snapshotted every tick.
+PEAK_SNAPSHOT_STEP = 1.05
+
+
+class StackSampler():
+  """
+  Samples the stacks of every thread (or of one thread) at a fixed
+  interval from a background thread and counts identical stacks,
+  giving collapsed stack output for flame graphs. Stacks are rooted
+  at their thread name (ex. 'MainThread', 'ingest_0').
+
+  While tracemalloc is tracing, the sampler also snapshots allocations
+  whenever traced memory reaches a new peak (see PEAK_SNAPSHOT_STEP),
+  keeping the snapshot closest to the peak in peak_snapshot.
+  """
+
+  def __init__(self, thread_id: int = None, interval: float = DEFAULT_SAMPLE_INTERVAL):
+    """
+    Args:
+      thread_id: the thread to sample, or None for every thread.
+      interval: the sampling interval in seconds.
+    """
+    self.thread_id = thread_id
+    self.peak_snapshot = None
+    self.peak_snapshot_size = 0
+    self.interval = interval
+    self.counts = {}
+    self.stop_event = threading.Event()
+    self.thread = threading.Thread(target=self.sample, name='StackSampler', daemon=True)
+
+  def start(self) -> None:
+    self.thread.start()
+
+  def stop(self) -> None:
+    self.stop_event.set()
+    self.thread.join()
+
+  def snapshot_peak(self) -> None:
+    """Snapshots allocations if traced memory is at a new peak."""
+    if not tracemalloc.is_tracing():
+      return
+    current = tracemalloc.get_traced_memory()[0]
+    if current > self.peak_snapshot_size * PEAK_SNAPSHOT_STEP:
+      self.peak_snapshot = tracemalloc.take_snapshot()
+      self.peak_snapshot_size = current
+
+  def sample(self) -> None:
+    while not self.stop_event.wait(self.interval):
+      self.snapshot_peak()
+      frames = sys._current_frames()
+      if self.thread_id is not None:
+        frames = {self.thread_id: frames[self.thread_id]} if self.thread_id in frames else {}
+      names = {thread.ident: thread.name for thread in threading.enumerate()}
+
+      for thread_id, frame in frames.items():
+        if thread_id == self.thread.ident:
+          continue
+
+        stack = []
+        while frame is not None:
+          code = frame.f_code
+          stack.append(code.co_name + ' (' + os.path.basename(code.co_filename) + ':' + str(code.co_firstlineno) + ')')
+          frame = frame.f_back
+        stack.append(names.get(thread_id, 'thread ' + str(thread_id)))
+
+        key = ';'.join(reversed(stack))
+        self.counts[key] = self.counts.get(key, 0) + 1
+
+  def write_collapsed(self, collapsed_file: str) -> None:
+    """Writes the sampled stacks in collapsed format, one 'stack count' line per distinct stack."""
+    with open(collapsed_file, 'w') as f:
+      for stack, count in sorted(self.counts.items()):
+        f.write(stack + ' ' + str(count) + '\n')
+
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+  """Adds the profiling options to an argument parser."""
+  parser.add_argument('--profile', action='store_true',
+                      help='profile the run with cProfile and the stack sampler (csv files are read on the main '
+                           'thread, so that cProfile sees them)')
+  parser.add_argument('--profile-sample', action='store_true',
+                      help='profile the run (every thread) with the stack sampler only')
+  parser.add_argument('--profile-output', default=None, help='output path prefix for profiling results')
+  parser.add_argument('--tracemalloc', type=int, default=0, metavar='N',
+                      help='report the top N allocation sites (slows the run down)')
+
+
+def get_output_prefix(name: str) -> str:
+  return PROFILE_DIR + '/' + name + '-' + time.strftime('%Y%m%d-%H%M%S')
+
+
+def write_allocations(snapshot: tracemalloc.Snapshot, output_file: str, top: int, peak: int = None,
+                      snapshot_size: int = None) -> None:
+  """Writes the top allocation sites of a tracemalloc snapshot.
+
+  Args:
+    snapshot: the snapshot, ideally taken at peak traced memory.
+    output_file: the report file.
+    top: the number of allocation sites to report.
+    peak: the peak traced memory in bytes, reported if given.
+    snapshot_size: the traced memory when the snapshot was taken.
+  """
+  snapshot = snapshot.filter_traces([
+      tracemalloc.Filter(False, tracemalloc.__file__),
+      tracemalloc.Filter(False, cProfile.__file__),
+      tracemalloc.Filter(False, __file__),
+      tracemalloc.Filter(False, '<frozen importlib._bootstrap>')])
+  statistics = snapshot.statistics('lineno')
+
+  with open(output_file, 'w') as f:
+    if peak is not None:
+      f.write('Peak traced memory: ' + format(peak / 2**20, '.2f') + ' MiB')
+      if snapshot_size is not None:
+        f.write(' (snapshot taken at ' + format(snapshot_size / 2**20, '.2f') + ' MiB)')
+      f.write('\n')
+    f.write('Top ' + str(top) + ' allocation sites of ' + str(len(statistics)) + '\n')
+    for stat in statistics[:top]:
+      frame = stat.traceback[0]
+      f.write(frame.filename + ':' + str(frame.lineno) + '  ' + format(stat.size / 2**10, '.1f') + ' KiB  '
+              + str(stat.count) + ' blocks\n')
+    f.write('Total: ' + format(sum(stat.size for stat in statistics) / 2**20, '.2f') + ' MiB\n')
+
+
+def profile(function, mode: str = 'cprofile', output_prefix: str = None, tracemalloc_top: int = 0,
+            name: str = None):
+  """Runs function() under a profiler and writes the results.
+
+  Args:
+    function: the callable to profile.
+    mode: 'cprofile' or 'sample' (see the module docstring).
+    output_prefix: the path prefix of the output files.
+    tracemalloc_top: if > 0, the number of allocation sites to report.
+    name: the entry point name used in the default output prefix.
+
+  Returns:
+    The return value of function().
+  """
+  if output_prefix is None:
+    output_prefix = get_output_prefix(name or getattr(function, '__module__', 'profile'))
+
+  if os.path.dirname(output_prefix) != '':
+    os.makedirs(os.path.dirname(output_prefix), exist_ok=True)
+
+  profiler = cProfile.Profile() if mode == 'cprofile' else None
+  sampler = StackSampler()
+
+  # cProfile only sees this thread, so csv readers run on it.
+  io_workers = os.environ.get('MORPHINSPECTOR_IO_WORKERS')
+  if profiler is not None and io_workers is None:
+    os.environ['MORPHINSPECTOR_IO_WORKERS'] = '1'
+
+  if tracemalloc_top > 0:
+    tracemalloc.start(25)
+
+  sampler.start()
+  if profiler is not None:
+    profiler.enable()
+
+  try:
+    return function()
+  finally:
+    if profiler is not None:
+      profiler.disable()
+      if io_workers is None:
+        os.environ.pop('MORPHINSPECTOR_IO_WORKERS', None)
+    sampler.stop()
+
+    # Stop tracing before writing the other outputs, so that their
+    # allocations are not reported. The snapshot closest to the peak
+    # is kept, the one at exit only if memory never grew past it.
+    snapshot = None
+    if tracemalloc_top > 0:
+      sampler.snapshot_peak()
+      peak = tracemalloc.get_traced_memory()[1]
+      snapshot, snapshot_size = sampler.peak_snapshot, sampler.peak_snapshot_size
+      if snapshot is None:
+        snapshot, snapshot_size = tracemalloc.take_snapshot(), tracemalloc.get_traced_memory()[0]
+      tracemalloc.stop()
+
+    outputs = []
+
+    if profiler is not None:
+      profiler.dump_stats(output_prefix + '.pstats')
+      stream = io.StringIO()
+      pstats.Stats(profiler, stream=stream).sort_stats('cumulative').print_stats(50)
+      with open(output_prefix + '.txt', 'w') as f:
+        f.write(stream.getvalue())
+      outputs += [output_prefix + '.pstats', output_prefix + '.txt']
+
+    sampler.write_collapsed(output_prefix + '.collapsed')
+    outputs.append(output_prefix + '.collapsed')
+
+    if snapshot is not None:
+      write_allocations(snapshot, output_prefix + '.tracemalloc.txt', tracemalloc_top, peak, snapshot_size)
+      outputs.append(output_prefix + '.tracemalloc.txt')
+
+    # Imported here so that importing profiling stays cheap.
+    import utils
+    utils.report('Profile written to ' + ', '.join(outputs), utils.ReportType.INFO)
+
+
+def run(main, name: str = None):
+  """Runs an entry point's main function, profiled if --profile was given.
+
+  The profiling options are removed from sys.argv before main runs,
+  so entry points with their own argument parser are unaffected.
+
+  Args:
+    main: the entry point's main function, taking no arguments.
+    name: the entry point name used in the default output prefix
+      (defaults to the name of the script).
+
+  Returns:
+    The return value of main().
+  """
+  parser = argparse.ArgumentParser(add_help=False)
+  add_arguments(parser)
+  args, rest = parser.parse_known_args(sys.argv[1:])
+  sys.argv = sys.argv[:1] + rest
+
+  if not args.profile and not args.profile_sample and args.tracemalloc == 0:
+    return main()
+
+  if name is None:
+    name = os.path.splitext(os.path.basename(sys.argv[0]))[0]
+
+  return profile(main, 'cprofile' if args.profile else 'sample', args.profile_output, args.tracemalloc, name)
@@ -25,9 +25,11 @@ ranking morphs based on their ability to fool a facial recognition system.
   TODO
 """
 
+import dumps
 import json
 import os
 import shutil
+import store
 from utils import Rank
 
 
@@ -52,9 +54,7 @@ def rank_morphs(morph_details: str, threshold: float
   rankA = []
   rankB = []
   rankC = []
-  details = {}
-  with open(morph_details, 'r') as f:
-    details = json.load(f)
+  details = store.load_details(morph_details)
 
   for morph in details.keys():
     morph_name = morph.split('.')[0]
@@ -76,38 +76,86 @@ def rank_morphs(morph_details: str, threshold: float
           }
 
 
-def copy_ranked_morphs_csvs(morph_csv_dir: str, dest_dir: str, ranks: dict[Rank, list]) -> None:
+def copy_ranked_morphs_csvs(morph_csv_dir: str, dest_dir: str, ranks: dict[Rank, list], method: str = 'copy') -> None:
   """
   Copies a set of ranked morphs' csvs given by rank_morphs to their own folders.
 
+  gen_roc_curve, gen_det_curve and calc_mmpmr accept the output of
+  rank_morphs directly as a subset, so this is only needed by tools
+  that still expect one directory per rank.
+
   Args:
-    morph_csv_dir: the path to a directory containing morph images.
+    morph_csv_dir: the path to a directory (or archive, see dumps.py)
+      containing morph csvs.
     dest_dir: the path to a directory within which to create rank
       directories within which to store ranked morphs.
     ranks: output dictionary from rank_morphs()
+    method: 'copy' to copy the csvs, 'hardlink' to hard link them
+      (no extra disk space, same filesystem only) or 'manifest' to
+      write a single manifest.json to dest_dir instead of any rank
+      directories (see load_ranked_morphs_manifest()).
   """
 
   folder_names = ['rank_a', 'rank_b', 'rank_c']
 
+  if method not in ['copy', 'hardlink', 'manifest']:
+    raise ValueError(method + ' is not a valid method.')
+
   if not os.path.isdir(dest_dir):
     os.mkdir(dest_dir)
 
+  if method == 'manifest':
+    manifest = {'morph_csv_dir': morph_csv_dir}
+    manifest[folder_names[0]] = ranks[Rank.A]
+    manifest[folder_names[1]] = ranks[Rank.B]
+    manifest[folder_names[2]] = ranks[Rank.C]
+
+    with open(dest_dir + '/manifest.json', 'w') as f:
+      json.dump(manifest, f)
+    return
+
   for name in folder_names:
     if not os.path.isdir(dest_dir + '/' + name):
       os.mkdir(dest_dir + '/' + name)
 
-  morph_0 = os.listdir(morph_csv_dir)[0]
+  morph_0 = dumps.listdir(morph_csv_dir)[0]
 
   file_ext = morph_0[morph_0.find('.') + 1:]
 
-  for morph_A in ranks[Rank.A]:
-    shutil.copy(morph_csv_dir + '/' + morph_A + '.' + file_ext, dest_dir + '/' + folder_names[0])
+  # Members of an archive can only be copied out of it.
+  from_archive = dumps.is_archive(morph_csv_dir)
 
-  for morph_B in ranks[Rank.B]:
-    shutil.copy(morph_csv_dir + '/' + morph_B + '.' + file_ext, dest_dir + '/' + folder_names[1])
+  for rank, folder_name in zip([Rank.A, Rank.B, Rank.C], folder_names):
+    for morph in ranks[rank]:
+      src = morph_csv_dir + '/' + morph + '.' + file_ext
+      dest = dest_dir + '/' + folder_name + '/' + morph + '.' + file_ext
+      if from_archive:
+        with dumps.open_file(src) as f_src, open(dest, 'wb') as f_dest:
+          shutil.copyfileobj(f_src, f_dest)
+      elif method == 'hardlink':
+        if not os.path.exists(dest):
+          os.link(src, dest)
+      else:
+        shutil.copy(src, dest_dir + '/' + folder_name)
 
-  for morph_C in ranks[Rank.C]:
-    shutil.copy(morph_csv_dir + '/' + morph_C + '.' + file_ext, dest_dir + '/' + folder_names[2])
+
+def load_ranked_morphs_manifest(manifest_file: str) -> tuple[str, dict[Rank, list]]:
+  """Loads a manifest written by copy_ranked_morphs_csvs(method='manifest').
+
+  Returns:
+    A tuple containing the morph csv directory the manifest refers
+    to and a dict in the same format as the output of rank_morphs(),
+    which can be passed as a subset to gen_roc_curve, gen_det_curve
+    and calc_mmpmr.
+  """
+  with open(manifest_file, 'r') as f:
+    manifest = json.load(f)
+
+  return (manifest['morph_csv_dir'],
+          {Rank.A: manifest['rank_a'],
+           Rank.B: manifest['rank_b'],
+           Rank.C: manifest['rank_c']
+           })
 
 
 def export_ranked_morphs(morph_details: str, threshold: float, outfile: str) -> None:
@@ -29,16 +29,24 @@ and the true positive rate (TPR, y-axis) for morphs to perform well.
 """
 
 
+import cache
+import identities
 import os
 import shutil
 import matplotlib.pyplot as plt
+import metrics
 from nearface import NearFace
 import numpy as np
+import plotting
+import preview as previews
 from tqdm import tqdm
-import utils
+import scores
+import sketch
+import timing
 
 
-def compare_stills(stills_dir: str, output_dir: str, still_id: str, use_threshold=False) -> None:
+def compare_stills(stills_dir: str, output_dir: str, still_id: str, use_threshold=False,
+                   job_metrics: metrics.JobMetrics = None, digest: sketch.TDigest = None) -> None:
   """Uses NearFace to compare one still to all others.
 
   Takes a still and compares it to all the other stills, excluding itself.
@@ -49,6 +57,9 @@ def compare_stills(stills_dir: str, output_dir: str, still_id: str, use_threshol
     output_dir: the path to a directory in which to write the NearFace
       dump csvs.
     still_id: the id of the still to compare. Example: '00'
+    job_metrics: optional JobMetrics to record each compared still in.
+    digest: optional sketch.TDigest to feed the nonzero distances to, so
+      that thresholds can be calibrated without reading the csvs back.
 
   Raises:
     AttributeError: An error occurred when making a comparison.
@@ -56,11 +67,7 @@ def compare_stills(stills_dir: str, output_dir: str, still_id: str, use_threshol
   """
   temp_dir = 'temp'
 
-  id_files = []
-
-  for filename in os.listdir(stills_dir):
-    if filename.startswith(still_id + '_'):
-      id_files.append(filename)
+  id_files = identities.stills_by_identity(stills_dir).get(still_id, [])
 
   # Copy necessary images to a temp folder. Send this temp
   # folder to nearface.
@@ -84,8 +91,17 @@ def compare_stills(stills_dir: str, output_dir: str, still_id: str, use_threshol
 
       df.to_csv(output_dir + '/' + still + '.csv', sep='\t')
 
+      if digest is not None:
+        distances = df['VGG-Face_euclidean_l2'].to_numpy(dtype=float)
+        digest.update(distances[distances != 0])
+
+      if job_metrics is not None:
+        job_metrics.advance(file=stills_dir + '/' + still)
+
     except AttributeError:
       print('AttributeError encountered... skipping still ' + still)
+      if job_metrics is not None:
+        job_metrics.error()
 
   shutil.rmtree(temp_dir)
 
@@ -94,26 +110,46 @@ def compare_all_stills(stills_dir: str,
                        output_dir: str,
                        ids: list = [],
                        compare_all: bool = False,
-                       use_threshold=False
+                       use_threshold=False,
+                       metrics_dir: str = None,
+                       digest: sketch.TDigest = None
                        ):
-  """Makes many still comparisons by calling compare_stills multiple times."""
+  """Makes many still comparisons by calling compare_stills multiple times.
+
+  Progress is counted per still and exported to metrics_dir (see
+  metrics.JobMetrics). If digest is given, every distance is fed to it
+  (see compare_stills).
+  """
+  groups = identities.stills_by_identity(stills_dir)
 
+  # Each id is compared once, however many stills it has.
+  ids = list(dict.fromkeys(ids))
   if compare_all:
-    stills = os.listdir(stills_dir)
-    for still in stills:
-      ids.append(still.split('_')[0])
+    ids = list(dict.fromkeys(ids + list(groups.keys())))
+
+  total = sum(len(groups.get(id, [])) for id in ids)
 
-  for id in tqdm(ids):
-    compare_stills(stills_dir, output_dir, id, use_threshold=use_threshold)
+  with metrics.JobMetrics('compare_all_stills', total, metrics_dir) as job_metrics:
+    for id in tqdm(ids):
+      compare_stills(stills_dir, output_dir, id, use_threshold=use_threshold, job_metrics=job_metrics, digest=digest)
 
 
-def gen_roc_curve(morphs_csvs_dir: str, stills_csvs_dir: str, gamma_step: float) -> tuple[list]:
+def gen_roc_curve(morphs_csvs_dir: str,
+                  stills_csvs_dir: str,
+                  gamma_step: float,
+                  subset=None,
+                  distance_label: str = 'VGG-Face_euclidean_l2',
+                  use_cache: bool = True,
+                  preview: float = None
+                  ) -> tuple[list]:
   """Generates x and y data for an ROC curve.
 
   Generates the data for an ROC curve given NearFace csvs for morphs
   (compared to all stills), a directory of stills, and an increment
   to step gamma (the recognition threshold) by.
 
+  Morph and still csvs are read only once, so any number of subset
+  curves (ex. one per rank) cost no more I/O than the full set.
 
   Args:
     morphs_csvs_dir: path to a directory containing csvs for morphs
@@ -122,6 +158,23 @@ def gen_roc_curve(morphs_csvs_dir: str, stills_csvs_dir: str, gamma_step: float)
     gamma_step: a value by which to increment gamma by. Lower
       gamma_step will lead to more data and a higher resolution ROC
       curve.
+    subset: optional morph selector. Either a list of morph names
+      (ex. '00_0-01_0') to restrict the curve to, or a dict mapping
+      labels to lists of morph names, such as the output of
+      ranking.rank_morphs(). A value of None in the dict selects
+      all morphs.
+    distance_label: the csv file label for distances
+      (ex. 'VGG-Face_cosine', 'VGG-Face_euclidean_l2', etc.)
+    use_cache: if True, curves already generated from unchanged csv
+      directories are loaded from cache.CURVE_CACHE_DIR instead of
+      being recomputed, and new curves are stored there. Aggregate
+      tables are cached likewise (see scores.load_aggregates). If
+      False, no cache is read or written.
+    preview: if given, the fraction of morphs and stills to compute
+      the curves from, drawn as a stratified sample by rank (the
+      labels of a subset dict) and identity. The standard error of
+      the preview is reported. See preview.Preview for progressive
+      refinement. Previews are not cached.
 
   Returns:
     x and y coordinate data for the roc curve in the form
@@ -130,93 +183,57 @@ def gen_roc_curve(morphs_csvs_dir: str, stills_csvs_dir: str, gamma_step: float)
 
     where x and y are both lists of float values, x is false positive rate
     (FPR), y is true positive rate (TPR) for all gamma.
-  """
-
-  # Create a list of all morph names
-  morphs = []
 
-  for file in os.listdir(morphs_csvs_dir):
-    morphs.append(file.split('.')[0])
+    If subset is a dict, a dict mapping each of its labels to such
+    a tuple is returned instead.
+  """
 
-  FP = 0
-  TN = 0
+  if preview is not None:
+    result = previews.Preview(morphs_csvs_dir, stills_csvs_dir, distance_label, subset).curve(
+        'roc', preview, gamma_step, subset)
+    previews.report_error(result, 'roc')
+    return result['curves'] if isinstance(subset, dict) else result['curves'][None]
 
   gamma_list = np.arange(0, 2 + gamma_step, gamma_step)
 
-  result_dict = {}
-
-  for gamma in gamma_list:
-    result_dict[gamma] = {'FP': 0, 'TN': 0, 'TP': 0, 'FN': 0, 'TPR': 0.0, 'FPR': 0.0}
+  curve_cache = None
+  if use_cache:
+    with timing.span('roc.cache_lookup'):
+      curve_cache = cache.CurveCache('roc', morphs_csvs_dir, stills_csvs_dir, gamma_list, distance_label)
+      curves = curve_cache.lookup(subset)
+    if curves is not None:
+      return curves if isinstance(subset, dict) else curves[None]
 
   # Start with morph compared to identities (these all should be negative/zero)
   print('Retrieving data from morphs...')
-  for file in tqdm(os.listdir(morphs_csvs_dir)):
-    a_b = utils.import_morph_nearface_csv(morphs_csvs_dir + '/' + file)
-    id_a = a_b[0]
-    id_b = a_b[1]
-
-    id_a_avg = np.mean(list(id_a.values()))
-    id_b_avg = np.mean(list(id_b.values()))
-
-    for gamma in gamma_list:
-      if not utils.classify(id_a_avg, gamma): # This should yield a 0 from the FRS
-        result_dict[gamma]['TP'] += 1
-      else:
-        result_dict[gamma]['FN'] += 1
-
-     # for distance in id_b.values():
-      if not utils.classify(id_b_avg, gamma):
-        result_dict[gamma]['TP'] += 1
-      else:
-        result_dict[gamma]['FN'] += 1
+  with timing.span('roc.load_morphs'):
+    table = scores.load_aggregates(morphs_csvs_dir, distance_label, scores.subset_names(subset),
+                                    use_cache=use_cache)
+  timing.count('roc.load_morphs', 'morphs', len(table))
 
   # Then compare stills to stills
   print('Retrieving data from stills...')
-  for file in tqdm(os.listdir(stills_csvs_dir)):
-    id = utils.import_still_nearface_csv(stills_csvs_dir + '/' + file)
-
-    for gamma in gamma_list:
-      for distance in id.values():
-        if distance != 0:
-          if utils.classify(distance, gamma): # This should yield a 1 from the FRS
-            result_dict[gamma]['TN'] += 1
-          else:
-            result_dict[gamma]['FP'] += 1
-
-  # Calculate true positive rate and false positive rate for each gamma
-  for gamma in result_dict.keys():
-    # Regular below
-    FP = result_dict[gamma]['FP']
-    TN = result_dict[gamma]['TN']
-    TP = result_dict[gamma]['TP']
-    FN = result_dict[gamma]['FN']
+  with timing.span('roc.load_stills'):
+    still_distances = scores.load_still_scores(stills_csvs_dir, distance_label)
+  timing.count('roc.load_stills', 'distances', len(still_distances))
 
-    # Zander's inverted below
-    # FN = result_dict[gamma]['FP']
-    # TP = result_dict[gamma]['TN']
-    # TN = result_dict[gamma]['TP']
-    # FP = result_dict[gamma]['FN']
+  curves = {}
 
-    # Actual inverted below
-    # TP = result_dict[gamma]['FP']
-    # FN = result_dict[gamma]['TN']
-    # FP = result_dict[gamma]['TP']
-    # TN = result_dict[gamma]['FN']
+  for label, names in scores.select_subsets(table, subset).items():
+    with timing.span('roc.counts'):
+      counts = scores.confusion_counts(table.mated_means(names), still_distances, gamma_list)
 
-    #print('FN + TP: ' + str(FN+TP))
-    #print('TN + FP: ' + str(TN+FP))
+    x, y = scores.curve_rates(counts, 'roc')
+    curves[label] = (x.tolist(), y.tolist())
 
-    result_dict[gamma]['TPR'] = TP / (TP + FN)
-    result_dict[gamma]['FPR'] = FP / (FP + TN)
+  if curve_cache is not None:
+    with timing.span('roc.cache_store'):
+      curve_cache.store(subset, curves)
 
-  x = []  # false positive rate
-  y = []  # true positive rate
+  if isinstance(subset, dict):
+    return curves
 
-  for label in result_dict.keys():
-    x.append(result_dict[label]['FPR'])
-    y.append(result_dict[label]['TPR'])
-
-  return (x, y)
+  return curves[None]
 
 
 def plot_roc_curve(xy: tuple[list[float], list[float]], plot_title: str) -> None:
@@ -254,8 +271,21 @@ def plot_multiple_roc_curve(
     xy0_label: str = '',
     xy1_label: str = '',
     xy2_label: str = '',
-    xy3_label: str = ''):
-  """Same as plot_roc_curve, except can plot up to four curves on one plot."""
+    xy3_label: str = '',
+    output_file: str = None):
+  """Same as plot_roc_curve, except can plot up to four curves on one plot.
+
+  If output_file is given, the curves are drawn as lines and written to
+  that file (png, svg, pdf, ...) through the Agg backend instead of being
+  shown. Use plotting.render_curves directly for more than four curves.
+  """
+
+  if output_file is not None:
+    curves = [xy for xy in [xy0, xy1, xy2, xy3] if xy is not None]
+    labels = [label for xy, label in zip([xy0, xy1, xy2, xy3], [xy0_label, xy1_label, xy2_label, xy3_label])
+              if xy is not None]
+    plotting.render_curves(curves, output_file, 'roc', labels=labels, title=plot_title)
+    return
 
   size = 3
 
@@ -1,58 +1,53 @@
-import json
+import bootstrap
+import cache
+import os
+import profiling
+import ranking
 import roc_curve
 import sklearn.metrics
+from utils import Rank
 
 def main():
+    ranks = ranking.rank_morphs('../data/stats/details_clarkson_scanned_l2.txt', 0.86)
+
+    morphs_csvs_dir = '../data/stats/nearface_out/morphs/clarkson_morphs_scanned_l2'
+    stills_csvs_dir = '../data/stats/nearface_out/stills/clarkson_stills_l2_threshold'
+    subsets = {'all': None, Rank.A: ranks[Rank.A], Rank.B: ranks[Rank.B], Rank.C: ranks[Rank.C]}
+
+    # All four curves are computed from a single read of the morph and
+    # still csvs.
+    curves = roc_curve.gen_roc_curve(morphs_csvs_dir, stills_csvs_dir, 0.001, subset=subsets)
+
     # All Ranks
-    xy = roc_curve.gen_roc_curve(
-        '../data/stats/nearface_out/morphs/clarkson_morphs_scanned_l2',
-        '../data/stats/nearface_out/stills/clarkson_stills_l2_threshold',
-        0.001) 
+    xy = curves['all']
 
-    with open('../data/stats/roc_curves/clarkson_morphs_scanned_rc.json', 'w') as f:
-        json.dump(xy, f)
+    cache.save_curve('../data/stats/roc_curves/clarkson_morphs_scanned_rc.npz', xy, {'gamma_step': 0.001})
 
     # Rank A
-    xya = roc_curve.gen_roc_curve(
-        '../data/stats/nearface_out/morphs/ranking_subsets/clarkson_scanned_subset_l2/rank_a',
-        '../data/stats/nearface_out/stills/clarkson_stills_l2_threshold',
-        0.001) 
+    xya = curves[Rank.A]
     
-    with open('../data/stats/roc_curves/clarkson_morphs_scanned_rc_ranka.json', 'w') as f:
-        json.dump(xya, f)
+    cache.save_curve('../data/stats/roc_curves/clarkson_morphs_scanned_rc_ranka.npz', xya, {'gamma_step': 0.001})
 
 
     # Rank B
-    xyb = roc_curve.gen_roc_curve(
-        '../data/stats/nearface_out/morphs/ranking_subsets/clarkson_scanned_subset_l2/rank_b',
-        '../data/stats/nearface_out/stills/clarkson_stills_l2_threshold',
-        0.001) 
+    xyb = curves[Rank.B]
     
-    with open('../data/stats/roc_curves/clarkson_morphs_scanned_rc_rankb.json', 'w') as f:
-        json.dump(xyb, f)
+    cache.save_curve('../data/stats/roc_curves/clarkson_morphs_scanned_rc_rankb.npz', xyb, {'gamma_step': 0.001})
 
     
     # Rank C
-    xyc = roc_curve.gen_roc_curve(
-        '../data/stats/nearface_out/morphs/ranking_subsets/clarkson_scanned_subset_l2/rank_c',
-        '../data/stats/nearface_out/stills/clarkson_stills_l2_threshold',
-        0.001) 
+    xyc = curves[Rank.C]
     
-    with open('../data/stats/roc_curves/clarkson_morphs_scanned_rc_rankc.json', 'w') as f:
-        json.dump(xyc, f)
+    cache.save_curve('../data/stats/roc_curves/clarkson_morphs_scanned_rc_rankc.npz', xyc, {'gamma_step': 0.001})
     
     
-    # with open('../data/stats/roc_curves/clarkson_morphs_scanned_rc.json', 'r') as f:
-    #     xy = json.load(f)
+    # xy = cache.load_curve('../data/stats/roc_curves/clarkson_morphs_scanned_rc.npz')[0]
 
-    # with open('../data/stats/roc_curves/clarkson_morphs_scanned_rc_ranka.json', 'r') as f:
-    #     xya = json.load(f)
+    # xya = cache.load_curve('../data/stats/roc_curves/clarkson_morphs_scanned_rc_ranka.npz')[0]
 
-    # with open('../data/stats/roc_curves/clarkson_morphs_scanned_rc_rankb.json', 'r') as f:
-    #     xyb = json.load(f)
+    # xyb = cache.load_curve('../data/stats/roc_curves/clarkson_morphs_scanned_rc_rankb.npz')[0]
 
-    # with open('../data/stats/roc_curves/clarkson_morphs_scanned_rc_rankc.json', 'r') as f:
-    #     xyc = json.load(f)
+    # xyc = cache.load_curve('../data/stats/roc_curves/clarkson_morphs_scanned_rc_rankc.npz')[0]
 
 
 
@@ -61,6 +56,13 @@ def main():
     print('Rank A AUC: ' + str(sklearn.metrics.auc(xya[0], xya[1])))
     print('Rank B AUC: ' + str(sklearn.metrics.auc(xyb[0], xyb[1])))
     print('Rank C AUC: ' + str(sklearn.metrics.auc(xyc[0], xyc[1])))
+
+    # Subject-level bootstrap confidence intervals
+    data = bootstrap.load_subject_scores(morphs_csvs_dir, stills_csvs_dir)
+    for label, names in subsets.items():
+        intervals = bootstrap.bootstrap_scores(data, names, 'roc', 0.001, n_replicates=1000, workers=os.cpu_count())
+        print(str(label) + ':')
+        print(bootstrap.format_intervals(intervals))
    
     roc_curve.plot_multiple_roc_curve(
         xy,
@@ -82,4 +84,4 @@ def main():
     #     compare_all=True, use_threshold=True)
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    profiling.run(main)
@@ -0,0 +1,383 @@
+"""
+Morph Inspector
+Copyright (C) 2022  Cameron M Palmer [https://github.com/palmtrey/morphinspector]
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see [http://www.gnu.org/licenses/].
+
+=================================================================================
+
+scores.py provides functions for reading a NearFace dump directory once and
+computing confusion counts for any number of morph subsets from the scores
+held in memory. A subset selector is either a list of morph names or a dict
+mapping a label (such as a Rank from rank_morphs) to a list of morph names.
+
+Mated averages come from an aggregates.AggregateTable, built once per dump set
+and cached (see load_aggregates), so every curve averages the same way.
+
+    Typical usage example:
+
+    ranks = ranking.rank_morphs('details_l2.txt', 0.86)
+    table = load_aggregates('morph_csvs_dir', names=subset_names(ranks))
+    for rank, names in select_subsets(table, ranks).items():
+      mated = mated_means(table, names)
+"""
+
+
+import aggregates
+import cache
+import collections
+import dumps
+import ingest
+import numpy as np
+import os
+import sketch
+import timing
+from concurrent.futures import ProcessPoolExecutor
+from tqdm import tqdm
+import utils
+
+
+def morph_name(csv_file: str) -> str:
+  """Returns the morph name of a morph csv file (ex. '00_0-01_0' for '00_0-01_0.png.csv')."""
+  return csv_file.split('/')[-1].split('.')[0]
+
+
+def subset_names(subset) -> set[str]:
+  """Returns the set of all morph names needed by a subset selector.
+
+  Args:
+    subset: None, a list of morph names, or a dict mapping labels to
+      lists of morph names (a value of None selects all morphs).
+
+  Returns:
+    A set of morph names, or None if every morph is needed.
+  """
+  if subset is None:
+    return None
+
+  if isinstance(subset, dict):
+    if any(names is None for names in subset.values()):
+      return None
+    return set().union(*[set(names) for names in subset.values()])
+
+  return set(subset)
+
+
+def load_morph_scores(morphs_csvs_dir: str,
+                      distance_label: str = 'VGG-Face_euclidean_l2',
+                      names: set[str] = None,
+                      workers: int = None
+                      ) -> dict[str, tuple[np.ndarray, np.ndarray]]:
+  """Reads every morph csv in a directory once.
+
+  Files are read in parallel (see ingest.read_files), and the result
+  does not depend on the number of workers.
+
+  Args:
+    morphs_csvs_dir: path to a directory containing csvs for morphs
+      output by nearface.
+    distance_label: the csv file label for distances
+      (ex. 'VGG-Face_cosine', 'VGG-Face_euclidean_l2', etc.)
+    names: if given, only morphs with these names are read.
+    workers: the number of reader threads (see ingest.get_workers).
+
+  Returns:
+    A dict in the format
+
+    {morph_name: (identity_1_distances, identity_2_distances)}
+
+    where both distance arrays keep the order of the csv file.
+  """
+  morph_scores = {}
+
+  with timing.span('scores.scan_morphs'):
+    files = dumps.listdir(morphs_csvs_dir)
+
+  if names is not None:
+    files = [file for file in files if morph_name(file) in names]
+
+  def read(file):
+    a_b = utils.import_morph_nearface_csv(morphs_csvs_dir + '/' + file, distance_label)
+    return (np.array(list(a_b[0].values()), dtype=float),
+            np.array(list(a_b[1].values()), dtype=float))
+
+  for file, a_b in tqdm(ingest.read_files(read, files, workers), total=len(files)):
+    morph_scores[morph_name(file)] = a_b
+
+  return morph_scores
+
+
+# Tables of whole directories, most recently used last
+_tables = collections.OrderedDict()
+
+# The largest number of tables kept in memory
+MAX_CACHED_TABLES = 4
+
+
+def clear_aggregates() -> None:
+  """Drops the aggregate tables kept in memory by load_aggregates()."""
+  _tables.clear()
+
+
+def load_aggregates(morphs_csvs_dir: str,
+                    distance_label: str = 'VGG-Face_euclidean_l2',
+                    names: set[str] = None,
+                    workers: int = None,
+                    use_cache: bool = True,
+                    cache_dir: str = aggregates.AGGREGATE_CACHE_DIR
+                    ) -> aggregates.AggregateTable:
+  """Returns the aggregate table of every morph csv in a directory.
+
+  With use_cache, the table of a whole directory is built once and
+  cached until the directory changes (see cache.fingerprint_path): in
+  memory for the last MAX_CACHED_TABLES directories, and under
+  cache_dir.
+
+  Args:
+    morphs_csvs_dir: path to a directory containing csvs for morphs
+      output by nearface.
+    distance_label: the csv file label for distances.
+    names: if given, only these morphs are needed. Without a cached
+      table of the directory, only their csvs are read and the
+      resulting table is not cached.
+    workers: the number of reader threads (see ingest.get_workers).
+    use_cache: if False, the table is always built from the csvs and
+      neither read from nor written to any cache.
+    cache_dir: the directory of cached tables, or None to only cache
+      tables in memory.
+
+  Returns:
+    An aggregates.AggregateTable.
+  """
+  if not use_cache:
+    return aggregates.AggregateTable.from_scores(load_morph_scores(morphs_csvs_dir, distance_label, names, workers))
+
+  key = cache.cache_key(aggregates.AGGREGATE_CACHE_VERSION, cache.fingerprint_path(morphs_csvs_dir), distance_label)
+  table_file = None if cache_dir is None else cache_dir + '/' + key + '.npz'
+
+  if key in _tables:
+    _tables.move_to_end(key)
+    return _tables[key]
+
+  if table_file is not None and os.path.exists(table_file):
+    table = aggregates.AggregateTable.load(table_file)
+  else:
+    table = aggregates.AggregateTable.from_scores(load_morph_scores(morphs_csvs_dir, distance_label, names, workers))
+    if names is not None:
+      return table
+
+    if table_file is not None:
+      os.makedirs(cache_dir, exist_ok=True)
+      table.save(table_file + '.tmp')
+      os.replace(table_file + '.tmp', table_file)
+
+  _tables[key] = table
+  while len(_tables) > MAX_CACHED_TABLES:
+    _tables.popitem(last=False)
+
+  return table
+
+
+def load_still_scores(stills_csvs_dir: str, distance_label: str = 'VGG-Face_euclidean_l2',
+                      files: list[str] = None, workers: int = None) -> np.ndarray:
+  """Reads every still csv in a directory once, in parallel (see ingest.read_files).
+
+  Distances of a still to itself (exactly 0) are dropped.
+
+  Args:
+    stills_csvs_dir: path to a directory containing still csvs.
+    distance_label: the csv file label for distances.
+    files: if given, only these csv file names are read.
+    workers: the number of reader threads (see ingest.get_workers).
+
+  Returns:
+    A sorted array of all still to still distances.
+  """
+  distances = []
+
+  if files is None:
+    with timing.span('scores.scan_stills'):
+      files = dumps.listdir(stills_csvs_dir)
+
+  read = lambda file: dumps.read_distances(stills_csvs_dir + '/' + file, distance_label)
+  for _, file_distances in tqdm(ingest.read_files(read, files, workers), total=len(files)):
+    distances.append(file_distances)
+
+  if len(distances) == 0:
+    return np.array([], dtype=float)
+
+  distances = np.concatenate(distances)
+  return np.sort(distances[distances != 0])
+
+
+def sketch_csv_files(csv_files: list[str], distance_label: str = 'VGG-Face_euclidean_l2',
+                     compression: float = sketch.DEFAULT_COMPRESSION) -> sketch.TDigest:
+  """Feeds the distances of a list of NearFace dump csvs into a new quantile sketch.
+
+  Distances of exactly 0 (a still compared to itself) are dropped.
+  Only one csv is held in memory at a time.
+  """
+  digest = sketch.TDigest(compression)
+
+  for csv_file in csv_files:
+    distances = dumps.read_distances(csv_file, distance_label)
+    digest.update(distances[distances != 0])
+
+  return digest
+
+
+def sketch_scores(csvs_dir: str,
+                  distance_label: str = 'VGG-Face_euclidean_l2',
+                  compression: float = sketch.DEFAULT_COMPRESSION,
+                  workers: int = 1
+                  ) -> sketch.TDigest:
+  """Builds a quantile sketch of every distance in a directory of NearFace dump csvs.
+
+  Unlike load_still_scores(), memory does not grow with the number of
+  distances, so thresholds can be calibrated on all-pairs comparisons.
+
+  Args:
+    csvs_dir: path to a directory of NearFace dump csvs.
+    distance_label: the csv file label for distances.
+    compression: the sketch accuracy (see sketch.TDigest).
+    workers: the number of worker processes. Each worker sketches a
+      share of the files and the sketches are merged.
+
+  Returns:
+    A sketch.TDigest. Ex. sketch_scores(dir).tau_at_fmr(1e-4).
+  """
+  files = sorted(csvs_dir + '/' + file for file in dumps.listdir(csvs_dir))
+
+  if workers <= 1 or len(files) < 2:
+    return sketch_csv_files(files, distance_label, compression)
+
+  shares = [files[i::workers] for i in range(workers)]
+  with ProcessPoolExecutor(max_workers=workers) as executor:
+    digests = list(executor.map(sketch_csv_files, shares, [distance_label] * workers, [compression] * workers))
+
+  return sketch.merge_all(digests)
+
+
+def select_subsets(morph_scores: dict, subset) -> dict:
+  """Resolves a subset selector against a set of loaded morph scores.
+
+  Args:
+    morph_scores: output of load_morph_scores() or load_aggregates().
+    subset: None, a list of morph names, or a dict mapping labels to
+      lists of morph names (a value of None selects all morphs).
+
+  Returns:
+    A dict mapping each label to the list of selected morph names
+    that exist in morph_scores. A subset that is not a dict is
+    returned under the label None.
+  """
+  if not isinstance(subset, dict):
+    subset = {None: subset}
+
+  result = {}
+  for label, names in subset.items():
+    if names is None:
+      result[label] = list(morph_scores.keys())
+    else:
+      result[label] = [name for name in names if name in morph_scores]
+
+  return result
+
+
+def mated_means(morph_scores, names: list[str]) -> np.ndarray:
+  """Returns the mean distance of each selected morph to each of its two identities.
+
+  Means are those of aggregates.AggregateTable: NaN distances are not
+  counted, and an identity without distances has a NaN mean.
+
+  Args:
+    morph_scores: output of load_aggregates() or load_morph_scores().
+    names: the morph names to use.
+
+  Returns:
+    An array of length 2 * len(names) holding the identity 1 and
+    identity 2 averages of every morph.
+  """
+  if not isinstance(morph_scores, aggregates.AggregateTable):
+    morph_scores = aggregates.AggregateTable.from_scores({name: morph_scores[name] for name in names})
+
+  return morph_scores.mated_means(names)
+
+
+def curve_rates(counts: dict[str, np.ndarray], curve_type: str) -> tuple[np.ndarray, np.ndarray]:
+  """Converts the output of confusion_counts() to ROC (FPR, TPR) or DET (APCER, BPCER) arrays."""
+  with np.errstate(divide='ignore', invalid='ignore'):
+    if curve_type == 'roc':
+      return (counts['FP'] / (counts['FP'] + counts['TN']), counts['TP'] / (counts['TP'] + counts['FN']))
+    elif curve_type == 'det':
+      return (counts['FN'] / (counts['TP'] + counts['FN']), counts['FP'] / (counts['FP'] + counts['TN']))
+
+  raise ValueError(curve_type + ' is not a valid curve type.')
+
+
+def mmpmr_values(morph_scores: dict, names: list[str], tau: list[float]) -> list[float]:
+  """Calculates MMPMR for a list of taus from loaded morph scores (see mmpmr.calc_mmpmr).
+
+  Only taus exceeded by at least one morph get a value.
+  """
+  mmpmr_sum: dict[float:float] = {}
+
+  M: int = len(names)
+
+  for name in names:
+    identity_1_distances, identity_2_distances = morph_scores[name]
+
+    try:
+      first_id_distances = [identity_1_distances[0], identity_2_distances[0]]
+    except IndexError:
+      print("No comparison image found for morph " + name + '. Skipping.')
+      continue
+
+    for t in tau:
+      if max(first_id_distances) > t:
+        if t in mmpmr_sum.keys():
+          mmpmr_sum[t] += max(first_id_distances)
+        else:
+          mmpmr_sum[t] = max(first_id_distances)
+
+  result = []
+
+  for t in mmpmr_sum.keys():
+    result.append(1 / M * mmpmr_sum[t])
+
+  return result
+
+
+def confusion_counts(mated: np.ndarray, still_distances: np.ndarray, gamma_list: np.ndarray) -> dict[str, np.ndarray]:
+  """Counts TP, FN, TN and FP for every gamma at once.
+
+  A morph average is a true positive when it is not recognized
+  (utils.classify is False) and a still distance is a true negative
+  when it is recognized. NaN values are never recognized.
+
+  Args:
+    mated: output of mated_means().
+    still_distances: sorted output of load_still_scores().
+    gamma_list: the recognition thresholds.
+
+  Returns:
+    A dict of integer arrays {'TP': ..., 'FN': ..., 'TN': ..., 'FP': ...},
+    each of the same length as gamma_list.
+  """
+  mated = np.sort(mated)
+
+  FN = np.searchsorted(mated, gamma_list, side='left')
+  TN = np.searchsorted(still_distances, gamma_list, side='left')
+
+  return {'TP': len(mated) - FN, 'FN': FN, 'TN': TN, 'FP': len(still_distances) - TN}
@@ -0,0 +1,226 @@
+"""
+Morph Inspector
+Copyright (C) 2022  Cameron M Palmer [https://github.com/palmtrey/morphinspector]
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see [http://www.gnu.org/licenses/].
+
+=================================================================================
+
+sketch.py provides a mergeable streaming quantile sketch (a merging t-digest)
+for calibrating thresholds on score sets too large to hold in memory, such as
+all-pairs still comparisons.
+
+Scores are fed chunk by chunk with update(). The sketch keeps at most about
+compression centroids, whatever the number of scores. Centroids are small
+near both tails, so extreme quantiles (ex. tau at FMR = 1e-4) stay accurate:
+the rank error at quantile q is bounded by about
+2 * pi * sqrt(q * (1 - q)) / compression (see rank_error_bound()).
+
+Sketches built by different workers or from different shards are combined
+with merge(), and can be saved to and loaded from .npz files.
+
+    Typical usage example:
+
+    digest = TDigest(compression=2000)
+    for chunk in chunks:
+      digest.update(chunk)
+    tau = digest.tau_at_fmr(1e-4)
+"""
+
+
+import numpy as np
+
+
+DEFAULT_COMPRESSION = 1000
+
+
+class TDigest():
+  """
+  A merging t-digest over float values, using the arcsine scale
+  function k(q) = compression / (2 * pi) * arcsin(2q - 1).
+  """
+
+  def __init__(self, compression: float = DEFAULT_COMPRESSION, buffer_size: int = None):
+    """
+    Args:
+      compression: the accuracy parameter. Memory and the number of
+        centroids grow linearly with it, errors shrink with it.
+      buffer_size: the number of values buffered before they are
+        compressed into centroids (default 10 * compression).
+    """
+    self.compression = compression
+    self.buffer_size = buffer_size if buffer_size is not None else int(10 * compression)
+
+    self.means = np.empty(0, dtype=float)
+    self.weights = np.empty(0, dtype=float)
+    self.min = np.inf
+    self.max = -np.inf
+
+    self.buffer_means = []
+    self.buffer_weights = []
+    self.buffered = 0
+
+  @property
+  def count(self) -> float:
+    """The total weight (number of values) added to the sketch."""
+    return float(self.weights.sum()) + float(sum(weights.sum() for weights in self.buffer_weights))
+
+  def update(self, values, weights=None) -> None:
+    """Adds an array of values (NaN values are ignored).
+
+    Args:
+      values: an array-like of values.
+      weights: an optional array-like of positive weights, one per value.
+    """
+    values = np.asarray(values, dtype=float).ravel()
+    if weights is None:
+      weights = np.ones(len(values))
+    else:
+      weights = np.asarray(weights, dtype=float).ravel()
+
+    valid = ~np.isnan(values)
+    values = values[valid]
+    weights = weights[valid]
+
+    if len(values) == 0:
+      return
+
+    self.min = min(self.min, float(values.min()))
+    self.max = max(self.max, float(values.max()))
+
+    self.buffer_means.append(values)
+    self.buffer_weights.append(weights)
+    self.buffered += len(values)
+
+    if self.buffered >= self.buffer_size:
+      self.compress()
+
+  def merge(self, other: 'TDigest') -> 'TDigest':
+    """Merges another sketch into this one and returns this sketch."""
+    other.compress()
+    if len(other.means) > 0:
+      self.min = min(self.min, other.min)
+      self.max = max(self.max, other.max)
+      self.buffer_means.append(other.means)
+      self.buffer_weights.append(other.weights)
+      self.buffered += len(other.means)
+      self.compress()
+    return self
+
+  def compress(self) -> None:
+    """Merges the buffered values into the centroids."""
+    if self.buffered == 0:
+      return
+
+    means = np.concatenate([self.means] + self.buffer_means)
+    weights = np.concatenate([self.weights] + self.buffer_weights)
+    self.buffer_means = []
+    self.buffer_weights = []
+    self.buffered = 0
+
+    order = np.argsort(means, kind='stable')
+    means = means[order]
+    weights = weights[order]
+
+    # Every point joins the centroid of the unit k interval in which
+    # its cumulative weight starts, which bounds the q range a
+    # centroid can span (narrow near the tails, wide at the median).
+    total = weights.sum()
+    q_left = (np.cumsum(weights) - weights) / total
+    k = self.compression / (2 * np.pi) * np.arcsin(2 * q_left - 1)
+    cluster = np.floor(k).astype(np.int64)
+
+    starts = np.flatnonzero(np.r_[True, cluster[1:] != cluster[:-1]])
+    self.weights = np.add.reduceat(weights, starts)
+    self.means = np.add.reduceat(means * weights, starts) / self.weights
+
+  def quantile(self, q) -> np.ndarray:
+    """Returns the estimated values at quantiles q (array-like in [0, 1])."""
+    self.compress()
+    q = np.asarray(q, dtype=float)
+
+    if len(self.means) == 0:
+      return np.full(q.shape, np.nan)
+
+    # Each centroid sits at the middle of its weight. The extremes are
+    # known exactly.
+    total = self.weights.sum()
+    centers = np.cumsum(self.weights) - self.weights / 2
+    ranks = np.r_[0, centers, total]
+    values = np.r_[self.min, self.means, self.max]
+
+    return np.interp(q * total, ranks, values)
+
+  def cdf(self, x) -> np.ndarray:
+    """Returns the estimated fraction of values below x (array-like)."""
+    self.compress()
+    x = np.asarray(x, dtype=float)
+
+    if len(self.means) == 0:
+      return np.full(x.shape, np.nan)
+
+    total = self.weights.sum()
+    centers = np.cumsum(self.weights) - self.weights / 2
+    ranks = np.r_[0, centers, total]
+    values = np.r_[self.min, self.means, self.max]
+
+    return np.interp(x, values, ranks, left=0, right=total) / total
+
+  def rank_error_bound(self, q) -> np.ndarray:
+    """Returns the approximate bound on the rank error of quantile(q)."""
+    q = np.asarray(q, dtype=float)
+    return 2 * np.pi * np.sqrt(q * (1 - q)) / self.compression + 1 / max(self.count, 1)
+
+  def tau_at_fmr(self, fmr):
+    """Returns the threshold tau with a fraction fmr of the values below it.
+
+    With impostor distances, a comparison is a false match when its
+    distance is below tau, so this is the threshold at FMR = fmr.
+    """
+    return self.quantile(fmr)
+
+  def tau_at_fnmr(self, fnmr):
+    """Returns the threshold tau with a fraction fnmr of the values at or above it.
+
+    With genuine distances, a comparison is a false non-match when
+    its distance is at or above tau, so this is the threshold at
+    FNMR = fnmr.
+    """
+    return self.quantile(1 - np.asarray(fnmr, dtype=float))
+
+  def save(self, sketch_file: str) -> None:
+    """Saves the sketch to a .npz file."""
+    self.compress()
+    np.savez(sketch_file, means=self.means, weights=self.weights,
+             header=np.array([self.compression, self.min, self.max], dtype=float))
+
+  @classmethod
+  def load(cls, sketch_file: str) -> 'TDigest':
+    """Loads a sketch saved by save()."""
+    with np.load(sketch_file) as npz:
+      compression, min, max = npz['header']
+      digest = cls(compression)
+      digest.means = npz['means']
+      digest.weights = npz['weights']
+      digest.min = float(min)
+      digest.max = float(max)
+    return digest
+
+
+def merge_all(digests: list[TDigest]) -> TDigest:
+  """Merges a list of sketches into a new sketch with the largest compression."""
+  result = TDigest(max([digest.compression for digest in digests], default=DEFAULT_COMPRESSION))
+  for digest in digests:
+    result.merge(digest)
+  return result
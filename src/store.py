@@ -0,0 +1,363 @@
+"""
+Morph Inspector
+Copyright (C) 2022  Cameron M Palmer [https://github.com/palmtrey/morphinspector]
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see [http://www.gnu.org/licenses/].
+
+=================================================================================
+
+store.py keeps morph details (as written by utils.writescores) in an indexed
+SQLite file, so that one morph's details are looked up without reading the
+whole file and morphs can be scanned in order of any metric.
+
+A details store is keyed by morph csv name (ex. '00_0-01_0.png.csv') with
+one indexed column per metric. Details files in the JSON format are still
+accepted everywhere: open_store() converts them once into a store cached under
+STORE_CACHE_DIR (nothing is written next to the details file, which may be
+read-only), rebuilt whenever the details file changes. iter_table() streams
+several details files (ex. cosine and L2) joined by morph name, in batches,
+without writing next to them.
+
+    Typical usage example:
+
+    details = open_store('details_l2.txt').get('00_0-01_0.png.csv')
+
+    with DetailsStore('details_l2.db') as details_store:
+      details_store.append({'00_0-01_0.png.csv': details})
+      for name, details in details_store.scan('1-wasserstein', high=0.1):
+        ...
+"""
+
+
+import cache
+import json
+import math
+import numpy as np
+import os
+import sqlite3
+import tempfile
+import threading
+
+
+# Details keys and their columns
+METRICS = {
+    'avgdist': 'avgdist',
+    'distanceA': 'distance_a',
+    'distanceB': 'distance_b',
+    '1-wasserstein': 'wasserstein'
+    }
+
+STORE_EXTENSIONS = ('.db', '.sqlite', '.sqlite3')
+
+SQLITE_HEADER = b'SQLite format 3\x00'
+
+COLUMNS = ', '.join(METRICS.values())
+
+# Stores converted from JSON details files, named by the details file's
+# path and fingerprint
+STORE_CACHE_DIR = '../resources/cache/details'
+
+
+def is_store(details_file: str) -> bool:
+  """Returns True if details_file is a details store, or would be written as one (by extension)."""
+  if os.path.isfile(details_file):
+    with open(details_file, 'rb') as f:
+      return f.read(len(SQLITE_HEADER)) == SQLITE_HEADER
+  return details_file.endswith(STORE_EXTENSIONS)
+
+
+def to_row(name: str, details: dict) -> tuple:
+  """Returns the store row of a morph's details."""
+  return (name,) + tuple(float(details[metric]) for metric in METRICS.keys())
+
+
+def from_row(row: tuple) -> dict:
+  """Returns the details of a store row (name first). SQLite stores NaN as NULL, so NULL is read back as NaN."""
+  return {metric: math.nan if value is None else value for metric, value in zip(METRICS.keys(), row[1:])}
+
+
+class DetailsStore():
+  """
+  An indexed SQLite file of morph details. Lookups by morph name and
+  scans by metric use indexes. A DetailsStore may be shared between
+  threads.
+  """
+
+  def __init__(self, path: str, readonly: bool = False):
+    """
+    Args:
+      path: the store file, created if it does not exist (unless
+        readonly).
+      readonly: open the store for lookups only.
+    """
+    self.path = path
+    self.lock = threading.Lock()
+
+    if readonly:
+      self.connection = sqlite3.connect('file:' + os.path.abspath(path) + '?mode=ro', uri=True, check_same_thread=False)
+    else:
+      self.connection = sqlite3.connect(path, check_same_thread=False)
+      with self.lock, self.connection:
+        self.connection.execute('CREATE TABLE IF NOT EXISTS details (name TEXT PRIMARY KEY, '
+                                + ', '.join(column + ' REAL' for column in METRICS.values()) + ') WITHOUT ROWID')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+        for column in METRICS.values():
+          self.connection.execute('CREATE INDEX IF NOT EXISTS details_' + column + ' ON details (' + column + ', name)')
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *args) -> None:
+    self.close()
+
+  def close(self) -> None:
+    with self.lock:
+      self.connection.close()
+
+  def __len__(self) -> int:
+    with self.lock:
+      return self.connection.execute('SELECT COUNT(*) FROM details').fetchone()[0]
+
+  def __contains__(self, name: str) -> bool:
+    with self.lock:
+      return self.connection.execute('SELECT 1 FROM details WHERE name = ?', (name,)).fetchone() is not None
+
+  def get(self, name: str, default: dict = None) -> dict:
+    """Returns the details of one morph (by csv name), or default if it is not in the store."""
+    with self.lock:
+      row = self.connection.execute('SELECT name, ' + COLUMNS + ' FROM details WHERE name = ?', (name,)).fetchone()
+    return default if row is None else from_row(row)
+
+  def append(self, details: dict) -> None:
+    """Adds (or replaces) the details of many morphs in one transaction.
+
+    Args:
+      details: a dict mapping morph csv names to details dicts.
+    """
+    rows = [to_row(name, morph_details) for name, morph_details in details.items()]
+    with self.lock, self.connection:
+      self.connection.executemany('INSERT OR REPLACE INTO details VALUES (?' + ', ?' * len(METRICS) + ')', rows)
+
+  def names(self) -> list[str]:
+    """Returns the names of all morphs, sorted."""
+    with self.lock:
+      return [row[0] for row in self.connection.execute('SELECT name FROM details ORDER BY name')]
+
+  def scan(self, metric: str, low: float = None, high: float = None, descending: bool = False, limit: int = None):
+    """Yields morphs in order of a metric, optionally within a range.
+
+    Args:
+      metric: a details key (ex. '1-wasserstein').
+      low, high: the inclusive bounds of the metric, or None for no
+        bound. Morphs with a NaN metric are only yielded without bounds,
+        last.
+      descending: yield the largest values first (NaN still last).
+      limit: the largest number of morphs to yield.
+
+    Yields:
+      Tuples (name, details), ties ordered by name (reversed when
+      descending).
+    """
+    column = METRICS[metric]
+    conditions = [column + ' IS NOT NULL']
+    parameters = []
+    if low is not None:
+      conditions.append(column + ' >= ?')
+      parameters.append(low)
+    if high is not None:
+      conditions.append(column + ' <= ?')
+      parameters.append(high)
+
+    order = ' DESC' if descending else ''
+    query = ('SELECT name, ' + COLUMNS + ' FROM details WHERE ' + ' AND '.join(conditions)
+             + ' ORDER BY ' + column + order + ', name' + order)
+    if limit is not None:
+      query += ' LIMIT ?'
+      parameters.append(limit)
+
+    with self.lock:
+      rows = self.connection.execute(query, parameters).fetchall()
+      if low is None and high is None and (limit is None or len(rows) < limit):
+        query = 'SELECT name, ' + COLUMNS + ' FROM details WHERE ' + column + ' IS NULL ORDER BY name'
+        if limit is not None:
+          query += ' LIMIT ' + str(int(limit - len(rows)))
+        rows += self.connection.execute(query).fetchall()
+
+    for row in rows:
+      yield (row[0], from_row(row))
+
+  def items(self):
+    """Yields (name, details) of all morphs, sorted by name."""
+    with self.lock:
+      rows = self.connection.execute('SELECT name, ' + COLUMNS + ' FROM details ORDER BY name').fetchall()
+    for row in rows:
+      yield (row[0], from_row(row))
+
+  def get_meta(self, key: str) -> str:
+    with self.lock:
+      row = self.connection.execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+    return None if row is None else row[0]
+
+  def set_meta(self, key: str, value: str) -> None:
+    with self.lock, self.connection:
+      self.connection.execute('INSERT OR REPLACE INTO meta VALUES (?, ?)', (key, value))
+
+
+def write_store(details: dict, path: str, meta: dict = None) -> None:
+  """Writes a new details store holding details (a dict of morph csv name to details), replacing path."""
+  if os.path.exists(path + '.tmp'):
+    os.remove(path + '.tmp')
+
+  with DetailsStore(path + '.tmp') as details_store:
+    details_store.append(details)
+    for key, value in (meta or {}).items():
+      details_store.set_meta(key, value)
+
+  os.replace(path + '.tmp', path)
+
+
+def build_store(details_file: str, cache_dir: str = STORE_CACHE_DIR) -> str:
+  """Converts a JSON details file into a store under cache_dir, unless an up to date one exists.
+
+  If cache_dir cannot be written to, the store is built in the
+  system's temporary directory instead.
+
+  Returns:
+    The path of the store.
+  """
+  fingerprint = cache.fingerprint_path(details_file)
+  store_name = cache.cache_key(os.path.abspath(details_file), fingerprint) + '.db'
+
+  try:
+    os.makedirs(cache_dir, exist_ok=True)
+    store_file = cache_dir + '/' + store_name
+    if not os.access(cache_dir, os.W_OK) and not os.path.exists(store_file):
+      raise PermissionError(cache_dir + ' is not writable.')
+  except OSError:
+    store_file = tempfile.gettempdir() + '/morphinspector-details-' + store_name
+
+  if os.path.exists(store_file):
+    with DetailsStore(store_file, readonly=True) as details_store:
+      if details_store.get_meta('fingerprint') == fingerprint:
+        return store_file
+
+  with open(details_file) as f:
+    details = json.load(f)
+  write_store(details, store_file, {'fingerprint': fingerprint})
+
+  return store_file
+
+
+# The open store of each details file (by absolute path), with its fingerprint
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def open_store(details_file: str) -> DetailsStore:
+  """Returns a read-only store of a details file (a store or a JSON file).
+
+  Stores are shared by all callers until the details file changes, so
+  the Morphs of a dataset look their details up through one connection.
+  The connection of an outdated store is closed.
+  """
+  key = os.path.abspath(details_file)
+  fingerprint = cache.fingerprint_path(details_file)
+
+  with _stores_lock:
+    details_store, store_fingerprint = _stores.get(key, (None, None))
+    if details_store is None or store_fingerprint != fingerprint:
+      if details_store is not None:
+        details_store.close()
+      store_file = details_file if is_store(details_file) else build_store(details_file)
+      details_store = DetailsStore(store_file, readonly=True)
+      _stores[key] = (details_store, fingerprint)
+
+  return details_store
+
+
+def save_details(details: dict, details_file: str) -> None:
+  """Writes details (a dict keyed by morph csv name) as a store or as JSON, depending on is_store(details_file)."""
+  if is_store(details_file):
+    write_store(details, details_file)
+  else:
+    with open(details_file, 'w') as f:
+      f.write(json.dumps(details))
+
+
+def load_details(details_file: str) -> dict:
+  """Reads all details of a details file (a store or a JSON file) into a dict keyed by morph csv name."""
+  if is_store(details_file):
+    with DetailsStore(details_file, readonly=True) as details_store:
+      return dict(details_store.items())
+
+  with open(details_file) as f:
+    return json.load(f)
+
+
+def iter_table(details_files: dict[str, str], metrics: list[str] = None, batch_size: int = 65536):
+  """Streams the details of several details files as one table, joined by morph name.
+
+  The files (stores or JSON files) are attached to one SQLite
+  connection and read with a cursor in batches, so memory does not grow
+  with the number of morphs. JSON files are converted into temporary
+  stores for the duration of the read; nothing is written next to
+  them.
+
+  Args:
+    details_files: a dict mapping a column prefix (ex. 'cosine', 'l2')
+      to a details file.
+    metrics: the details keys to read (default all of METRICS).
+    batch_size: the number of morphs per batch.
+
+  Yields:
+    Tuples (names, columns) of up to batch_size morphs, sorted by name,
+    where columns maps '<prefix> <metric>' to a float array (NaN where a
+    file has no details for a morph).
+  """
+  if metrics is None:
+    metrics = list(METRICS.keys())
+
+  temp_dir = tempfile.TemporaryDirectory()
+  connection = sqlite3.connect('file::memory:', uri=True)
+  try:
+    select = []
+    names = []
+    joins = []
+    for i, (prefix, details_file) in enumerate(details_files.items()):
+      store_file = details_file
+      if not is_store(details_file):
+        store_file = temp_dir.name + '/s' + str(i) + '.db'
+        with open(details_file) as f:
+          write_store(json.load(f), store_file)
+      connection.execute('ATTACH DATABASE ? AS s' + str(i), ('file:' + os.path.abspath(store_file) + '?mode=ro',))
+      names.append('SELECT name FROM s' + str(i) + '.details')
+      joins.append(' LEFT JOIN s' + str(i) + '.details AS d' + str(i) + ' ON d' + str(i) + '.name = names.name')
+      select += ['d' + str(i) + '.' + METRICS[metric] for metric in metrics]
+
+    column_names = [prefix + ' ' + metric for prefix in details_files.keys() for metric in metrics]
+    cursor = connection.execute('SELECT names.name' + ''.join(', ' + column for column in select)
+                                + ' FROM ' + ('s0.details' if len(names) == 1 else '(' + ' UNION '.join(names) + ')')
+                                + ' AS names' + ''.join(joins)
+                                + ' ORDER BY names.name')
+
+    while True:
+      rows = cursor.fetchmany(batch_size)
+      if len(rows) == 0:
+        break
+      # NULL (missing or NaN) becomes NaN
+      values = np.array([row[1:] for row in rows], dtype=float).reshape(len(rows), len(column_names))
+      yield ([row[0] for row in rows], {name: values[:, j] for j, name in enumerate(column_names)})
+  finally:
+    connection.close()
+    temp_dir.cleanup()
@@ -0,0 +1,180 @@
+"""
+Morph Inspector
+Copyright (C) 2022  Cameron M Palmer [https://github.com/palmtrey/morphinspector]
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see [http://www.gnu.org/licenses/].
+
+=================================================================================
+
+synthetic.py generates synthetic morph and still datasets in the same layout
+and NearFace dump format as real data, so the analysis functions can be run
+and benchmarked without private image data.
+
+Distances are drawn so that the generated morphs spread across ranks A, B and
+C at the usual VGG-Face L2 threshold of 0.86. Cosine distances are derived
+from L2 distances as l2^2 / 2, as for normalized embeddings.
+
+    Typical usage example:
+
+    paths = generate_dataset('../data/synthetic', n_morphs=1000, n_identities=100, stills_per_identity=4)
+    utils.writescores(paths['morphs_csvs_l2'], 'details_l2.txt', 'VGG-Face_euclidean_l2')
+"""
+
+
+import argparse
+import numpy as np
+import os
+import shutil
+
+
+PLACEHOLDER_IMAGE = '../resources/placeholder.png'
+
+
+def write_nearface_csv(csv_file: str, identities: list[str], distances: np.ndarray, distance_label: str) -> None:
+  """Writes a tab separated NearFace dump csv, sorted by ascending distance like NearFace.find."""
+  order = np.argsort(distances, kind='stable')
+
+  lines = ['\tidentity\t' + distance_label + '\n']
+  for i, j in enumerate(order):
+    lines.append(str(i) + '\t' + identities[j] + '\t' + repr(float(distances[j])) + '\n')
+
+  with open(csv_file, 'w') as f:
+    f.writelines(lines)
+
+
+def write_image(image_file: str) -> None:
+  """Creates an image file by hard linking (or copying) the placeholder image."""
+  if os.path.exists(image_file):
+    return
+
+  try:
+    os.link(PLACEHOLDER_IMAGE, image_file)
+  except OSError:
+    shutil.copy(PLACEHOLDER_IMAGE, image_file)
+
+
+def generate_dataset(output_dir: str,
+                     n_morphs: int = 1000,
+                     n_identities: int = 100,
+                     stills_per_identity: int = 4,
+                     seed: int = 0,
+                     write_images: bool = True
+                     ) -> dict[str, str]:
+  """Generates a synthetic dataset of morphs, stills and NearFace dumps.
+
+  Layout (relative to output_dir):
+    images/morphs/<still1>-<still2>.png
+    images/stills/<id>_<num>.jpg
+    nearface_out/morphs/morphs_l2/<still1>-<still2>.png.csv
+    nearface_out/morphs/morphs_cosine/<still1>-<still2>.png.csv
+    nearface_out/stills/stills_l2/<id>_<num>.jpg.csv
+
+  Morph csvs compare a morph to every still. Still csvs compare a
+  still to every still of its own identity, including itself, like
+  roc_curve.compare_stills.
+
+  Args:
+    output_dir: the directory to create the dataset in.
+    n_morphs: the number of morphs. Must not exceed the number of
+      distinct still pairs of different identities.
+    n_identities: the number of identities.
+    stills_per_identity: the number of stills of each identity.
+    seed: the random seed, for reproducible datasets.
+    write_images: if True, image files are created for every morph
+      and still (hard links to the placeholder image where possible).
+
+  Returns:
+    A dict of the generated directory paths, with keys 'morphs',
+    'stills', 'morphs_csvs_l2', 'morphs_csvs_cosine' and
+    'stills_csvs_l2'.
+  """
+  rng = np.random.default_rng(seed)
+
+  paths = {
+      'morphs': output_dir + '/images/morphs',
+      'stills': output_dir + '/images/stills',
+      'morphs_csvs_l2': output_dir + '/nearface_out/morphs/morphs_l2',
+      'morphs_csvs_cosine': output_dir + '/nearface_out/morphs/morphs_cosine',
+      'stills_csvs_l2': output_dir + '/nearface_out/stills/stills_l2'}
+
+  for path in paths.values():
+    os.makedirs(path, exist_ok=True)
+
+  width = max(2, len(str(n_identities - 1)))
+  ids = [str(i).zfill(width) for i in range(n_identities)]
+  stills = [id + '_' + str(num) for id in ids for num in range(stills_per_identity)]
+  still_paths = [paths['stills'] + '/' + still + '.jpg' for still in stills]
+  still_id = np.repeat(np.arange(n_identities), stills_per_identity)
+
+  if write_images:
+    for still_path in still_paths:
+      write_image(still_path)
+
+  # Still to still comparisons within each identity
+  for i, still in enumerate(stills):
+    same = np.flatnonzero(still_id == still_id[i])
+    distances = np.clip(rng.normal(0.55, 0.12, len(same)), 0.05, 2)
+    distances[same == i] = 0
+    write_nearface_csv(paths['stills_csvs_l2'] + '/' + still + '.jpg.csv',
+                       [still_paths[j] for j in same], distances, 'VGG-Face_euclidean_l2')
+
+  max_morphs = n_identities * (n_identities - 1) // 2 * stills_per_identity ** 2
+  if n_morphs > max_morphs:
+    raise ValueError('n_morphs must not exceed ' + str(max_morphs) + ' for this many identities and stills.')
+
+  pairs = set()
+  while len(pairs) < n_morphs:
+    a, b = rng.choice(n_identities, 2, replace=False)
+    pairs.add((min(a, b) * stills_per_identity + rng.integers(stills_per_identity),
+               max(a, b) * stills_per_identity + rng.integers(stills_per_identity)))
+
+  for still_a, still_b in sorted(pairs):
+    morph = stills[still_a] + '-' + stills[still_b]
+
+    if write_images:
+      write_image(paths['morphs'] + '/' + morph + '.png')
+
+    # Non-mated comparisons, then mated comparisons whose mean depends
+    # on how well the morph resembles each of its two identities.
+    l2 = np.clip(rng.normal(1.25, 0.07, len(stills)), 0, 2)
+    for still in [still_a, still_b]:
+      mated = still_id == still_id[still]
+      l2[mated] = np.clip(rng.normal(rng.uniform(0.6, 1.1), 0.08, np.count_nonzero(mated)), 0, 2)
+
+    write_nearface_csv(paths['morphs_csvs_l2'] + '/' + morph + '.png.csv', still_paths, l2, 'VGG-Face_euclidean_l2')
+    write_nearface_csv(paths['morphs_csvs_cosine'] + '/' + morph + '.png.csv', still_paths, l2 ** 2 / 2,
+                       'VGG-Face_cosine')
+
+  return paths
+
+
+def main():
+  parser = argparse.ArgumentParser(description='Generates a synthetic morph dataset with NearFace dumps.')
+  parser.add_argument('output_dir', help='the directory to create the dataset in')
+  parser.add_argument('--morphs', type=int, default=1000, help='number of morphs')
+  parser.add_argument('--identities', type=int, default=100, help='number of identities')
+  parser.add_argument('--stills', type=int, default=4, help='number of stills per identity')
+  parser.add_argument('--seed', type=int, default=0, help='random seed')
+  parser.add_argument('--no-images', action='store_true', help='do not create image files')
+  args = parser.parse_args()
+
+  paths = generate_dataset(args.output_dir, args.morphs, args.identities, args.stills, args.seed,
+                           write_images=not args.no_images)
+
+  for name, path in paths.items():
+    print(name + ': ' + path)
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,243 @@
+"""
+Morph Inspector
+Copyright (C) 2022  Cameron M Palmer [https://github.com/palmtrey/morphinspector]
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see [http://www.gnu.org/licenses/].
+
+=================================================================================
+
+timing.py records how long each stage of a run takes (csv parsing, directory
+scans, Wasserstein computation, image decoding, ...) with named spans and
+counters. Timing is disabled by default, in which case span() returns a shared
+no-op context manager and counters return immediately.
+
+Timing is enabled by calling enable() or by setting the environment variable
+MORPHINSPECTOR_TIMING to 1 (report written to timing.json) or to the path of
+the JSON report. At exit, the per-stage summary (calls, total/mean/p95 time,
+bytes read and counters) is written as JSON and printed as a table through
+utils.report.
+
+    Typical usage example:
+
+    with timing.span('csv.parse_morph'):
+      timing.count_bytes('csv.parse_morph', csv_file)
+      df = pandas.read_csv(csv_file, sep='\\t')
+
+    @timing.timed('roc.gen_curve')
+    def gen_roc_curve(...):
+      ...
+"""
+
+
+import atexit
+import functools
+import json
+import numpy as np
+import os
+import threading
+import time
+
+
+DEFAULT_REPORT_FILE = 'timing.json'
+
+_enabled = False
+_report_file = None
+_registered = False
+_stats = {}
+_lock = threading.Lock()
+
+
+class StageStats():
+  """The accumulated timings and counters of one named stage."""
+
+  __slots__ = ['durations', 'bytes', 'counters']
+
+  def __init__(self):
+    self.durations = []
+    self.bytes = 0
+    self.counters = {}
+
+
+class Span():
+  """A context manager timing one call of a named stage."""
+
+  __slots__ = ['name', 'start']
+
+  def __init__(self, name: str):
+    self.name = name
+
+  def __enter__(self):
+    self.start = time.perf_counter()
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    get_stats(self.name).durations.append(time.perf_counter() - self.start)
+    return False
+
+
+class NullSpan():
+  """The span returned while timing is disabled. Does nothing."""
+
+  __slots__ = []
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    return False
+
+
+NULL_SPAN = NullSpan()
+
+
+def is_enabled() -> bool:
+  return _enabled
+
+
+def enable(report_file: str = DEFAULT_REPORT_FILE) -> None:
+  """Enables timing and writes the report to report_file at exit (None to only print it)."""
+  global _enabled, _report_file, _registered
+
+  _enabled = True
+  _report_file = report_file
+
+  if not _registered:
+    atexit.register(report)
+    _registered = True
+
+
+def disable() -> None:
+  global _enabled
+  _enabled = False
+
+
+def reset() -> None:
+  """Discards everything recorded so far."""
+  _stats.clear()
+
+
+def get_stats(name: str) -> StageStats:
+  stats = _stats.get(name)
+  if stats is None:
+    stats = _stats.setdefault(name, StageStats())
+  return stats
+
+
+def span(name: str):
+  """Returns a context manager timing one call of the stage name."""
+  if not _enabled:
+    return NULL_SPAN
+  return Span(name)
+
+
+def timed(name: str):
+  """Decorates a function so that every call is timed as the stage name."""
+  def decorator(function):
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+      if not _enabled:
+        return function(*args, **kwargs)
+      with Span(name):
+        return function(*args, **kwargs)
+    return wrapper
+  return decorator
+
+
+def count(name: str, counter: str, n: int = 1) -> None:
+  """Adds n to a counter of the stage name (ex. count('roc.load_scores', 'morphs', 500))."""
+  if not _enabled:
+    return
+  counters = get_stats(name).counters
+  with _lock:
+    counters[counter] = counters.get(counter, 0) + n
+
+
+def count_bytes(name: str, file: str) -> None:
+  """Adds the size of a file (or archive member, see dumps.getsize) to the bytes read by the stage name."""
+  if not _enabled:
+    return
+  # Imported here since dumps itself records timings.
+  import dumps
+  try:
+    size = dumps.getsize(file)
+  except (OSError, KeyError):
+    return
+  stats = get_stats(name)
+  with _lock:
+    stats.bytes += size
+
+
+def summary() -> dict[str, dict]:
+  """Summarizes every stage recorded so far.
+
+  Returns:
+    A dict mapping stage names to dicts with 'calls', 'total', 'mean'
+    and 'p95' (seconds), 'bytes' and any counters.
+  """
+  result = {}
+  for name in sorted(_stats.keys()):
+    stats = _stats[name]
+    durations = np.asarray(stats.durations, dtype=float)
+
+    result[name] = {
+        'calls': len(durations),
+        'total': float(durations.sum()),
+        'mean': float(durations.mean()) if len(durations) > 0 else 0.0,
+        'p95': float(np.percentile(durations, 95)) if len(durations) > 0 else 0.0,
+        'bytes': stats.bytes}
+    result[name].update(stats.counters)
+
+  return result
+
+
+def format_table(stages: dict[str, dict]) -> str:
+  """Formats the output of summary() as a table, slowest stage first."""
+  header = ['stage', 'calls', 'total (s)', 'mean (ms)', 'p95 (ms)', 'MiB read', 'counters']
+  rows = []
+  for name, stage in sorted(stages.items(), key=lambda item: -item[1]['total']):
+    counters = ', '.join(key + '=' + str(value) for key, value in stage.items()
+                         if key not in ['calls', 'total', 'mean', 'p95', 'bytes'])
+    rows.append([name,
+                 str(stage['calls']),
+                 format(stage['total'], '.3f'),
+                 format(stage['mean'] * 1000, '.3f'),
+                 format(stage['p95'] * 1000, '.3f'),
+                 format(stage['bytes'] / 2**20, '.2f') if stage['bytes'] > 0 else '',
+                 counters])
+
+  widths = [max(len(row[i]) for row in [header] + rows) for i in range(len(header))]
+  return '\n'.join('  '.join(value.ljust(width) for value, width in zip(row, widths)).rstrip()
+                   for row in [header] + rows)
+
+
+def report() -> None:
+  """Writes the JSON report (if a report file is set) and prints the table."""
+  if len(_stats) == 0:
+    return
+
+  # Imported here since utils itself records timings.
+  import utils
+
+  stages = summary()
+
+  if _report_file is not None:
+    with open(_report_file, 'w') as f:
+      json.dump(stages, f, indent=2)
+    utils.report('Timing report written to ' + _report_file, utils.ReportType.INFO)
+
+  utils.report(format_table(stages), utils.ReportType.INFO)
+
+
+if os.environ.get('MORPHINSPECTOR_TIMING', '') not in ['', '0']:
+  enable(DEFAULT_REPORT_FILE if os.environ['MORPHINSPECTOR_TIMING'] == '1' else os.environ['MORPHINSPECTOR_TIMING'])
@@ -1,15 +1,26 @@
+import aggregates
+import dumps
 import enum
-import json
+import export
+import identities
+import ingest
+import metrics
 import matplotlib.pyplot as plt
 import numpy as np
 import os
-import pandas
-from scipy.stats import wasserstein_distance
+import plotting
 from tqdm import tqdm
 from enum import Enum
 import yaml
 import pickle
 import statistics
+import store
+import timing
+
+
+# Bump whenever the pickled Morph attributes change, so that morph caches
+# of earlier versions are rebuilt instead of loaded.
+MORPH_CACHE_VERSION = 2
 
 
 class GUISettings():
@@ -28,6 +39,9 @@ class GUISettings():
       csvs_cosine_path:str='', 
       csvs_l2_path:str='', 
 
+      still_csvs_cosine_path:str='',
+      still_csvs_l2_path:str='',
+
       precision:int=3
       ):
     
@@ -39,6 +53,8 @@ class GUISettings():
     self.details_l2_path = details_l2_path
     self.csvs_cosine_path = csvs_cosine_path
     self.csvs_l2_path = csvs_l2_path
+    self.still_csvs_cosine_path = still_csvs_cosine_path
+    self.still_csvs_l2_path = still_csvs_l2_path
     self.precision = precision
 
   def __str__(self) -> str:
@@ -50,6 +66,8 @@ class GUISettings():
     result += 'details_l2_path: ' + self.details_l2_path + '\n'
     result += 'csvs_cosine_path: ' + self.csvs_cosine_path + '\n'
     result += 'csvs_l2_path: ' + self.csvs_l2_path + '\n'
+    result += 'still_csvs_cosine_path: ' + self.still_csvs_cosine_path + '\n'
+    result += 'still_csvs_l2_path: ' + self.still_csvs_l2_path + '\n'
     result += 'precision: ' + str(self.precision)
 
     return result
@@ -63,6 +81,8 @@ class GUISettings():
     outputdict['details_l2_path'] = self.details_l2_path
     outputdict['csvs_cosine_path'] = self.csvs_cosine_path
     outputdict['csvs_l2_path'] = self.csvs_l2_path
+    outputdict['still_csvs_cosine_path'] = self.still_csvs_cosine_path
+    outputdict['still_csvs_l2_path'] = self.still_csvs_l2_path
     outputdict['precision'] = self.precision
 
     with open('../resources/config.yml', 'w') as f:
@@ -80,6 +100,9 @@ class GUISettings():
         self.details_l2_path = inputdict['details_l2_path']
         self.csvs_cosine_path = inputdict['csvs_cosine_path']
         self.csvs_l2_path = inputdict['csvs_l2_path']
+        # Configs saved before still csvs could be set do not have them
+        self.still_csvs_cosine_path = inputdict.get('still_csvs_cosine_path', '')
+        self.still_csvs_l2_path = inputdict.get('still_csvs_l2_path', '')
         self.precision = inputdict['precision']
     else:
       report('Config file does not exist. Will retrieve settings from', ReportType.INFO)
@@ -96,44 +119,57 @@ class Morph():
     self.stills_dir = stills_dir
 
 
-    self.still1 = get_stills_from_morph(morph_path)[0]
-    self.still2 = get_stills_from_morph(morph_path)[1]
-    self.still1_id = self.still1.split('_')[0]
-    self.still2_id = self.still2.split('_')[0]
+    self.still1, self.still2 = identities.parse_morph(morph_path)
+    self.still1_id = identities.still_identity(self.still1)
+    self.still2_id = identities.still_identity(self.still2)
     self.still_ext = still_ext
     self.still1_path = stills_dir + '/' + self.still1 + self.still_ext
     self.still2_path = stills_dir + '/' + self.still2 + self.still_ext
 
 
-    # Append all stills of each id into a list
-    self.all_still1 = []
-    self.all_still2 = []
-
-    for still in os.listdir(stills_dir):
-      if still.split('/')[-1].split('_')[0] == self.still1_id:
-        self.all_still1.append(still)
-      
-      if still.split('/')[-1].split('_')[0] == self.still2_id:
-        self.all_still2.append(still)
+    # All stills of each id, from one shared scan of stills_dir
+    with timing.span('morph.scan_stills'):
+      stills = identities.stills_by_identity(stills_dir)
+    self.all_still1 = list(stills.get(self.still1_id, []))
+    self.all_still2 = list(stills.get(self.still2_id, []))
 
     self.csv_cosine_path = csv_cosine_path
     self.csv_l2_path = csv_l2_path
+    self.details_cosine_path = details_cosine_path
+    self.details_l2_path = details_l2_path
+
+    # Details computed from csvs are kept. Details from a details file
+    # are looked up in its store when they are read (see load_details).
+    self.details_cosine = None
+    self.details_l2 = None
 
     if csv_cosine_path != '':
       self.details_cosine = calc_morphdetails(self.csv_cosine_path, 'VGG-Face_cosine', self.morph_ext)
     elif details_cosine_path != '':
-      with open(details_cosine_path) as file:
-        self.details_cosine = json.load(file)[self.get_morph() + '.csv']
-    else:
-      self.details_cosine = ''
+      with timing.span('morph.load_details'):
+        if self.get_morph() + '.csv' not in store.open_store(details_cosine_path):
+          raise KeyError(self.get_morph() + '.csv')
 
     if csv_l2_path != '':
       self.details_l2 = calc_morphdetails(self.csv_l2_path, 'VGG-Face_euclidean_l2', self.morph_ext)
     elif details_l2_path != '':
-      with open(details_l2_path) as file:
-        self.details_l2 = json.load(file)[self.get_morph() + '.csv']
+      with timing.span('morph.load_details'):
+        if self.get_morph() + '.csv' not in store.open_store(details_l2_path):
+          raise KeyError(self.get_morph() + '.csv')
+
+  def load_details(self, type:str) -> dict:
+    """Returns the details of one distance metric, looked up in its details store if needed."""
+    if type == 'cosine':
+      details, details_path = self.details_cosine, self.details_cosine_path
+    elif type == 'l2':
+      details, details_path = self.details_l2, self.details_l2_path
     else:
-      self.details_l2 = ''
+      raise IndexError(type + ' is not a valid distance metric.')
+
+    if details is None and details_path != '':
+      with timing.span('morph.load_details'):
+        details = store.open_store(details_path).get(self.get_morph() + '.csv')
+    return details
 
   def get_details(self, type:str) -> dict:
     result = {}
@@ -144,61 +180,28 @@ class Morph():
     return result
 
   def get_avgdist(self, type:str) -> float:
-    if type == 'cosine':
-      if self.details_cosine == None:
-        raise TypeError('morph does not contain a cosine morphscore')
-      else:
-        return self.details_cosine['avgdist']
+    details = self.load_details(type)
+    if details is None:
+      raise TypeError('morph does not contain ' + type + ' morphscore')
+    return details['avgdist']
 
-    elif type == 'l2':
-      if self.details_l2 == None:
-        raise TypeError('morph does not contain an l2 morphscore')
-      else:
-        return self.details_l2['avgdist']
-    else:
-      raise IndexError(type + ' is not a valid distance metric.')
-  
   def get_distanceA(self, type:str) -> float:
-    if type == 'cosine':
-      if self.details_cosine == None:
-        raise TypeError('morph does not contain a cosine distance A')
-      else:
-        return self.details_cosine['distanceA']
-    elif type == 'l2':
-      if self.details_l2 == None:
-        raise TypeError('morph does not contain an l2 distance A')
-      else:
-        return self.details_l2['distanceA']
-    else:
-      raise IndexError(type + ' is not a valid distance metric.')
+    details = self.load_details(type)
+    if details is None:
+      raise TypeError('morph does not contain ' + type + ' distance A')
+    return details['distanceA']
 
   def get_distanceB(self, type:str) -> float:
-    if type == 'cosine':
-      if self.details_cosine == None:
-        raise TypeError('morph does not contain a cosine distance B')
-      else:
-        return self.details_cosine['distanceB']
-    elif type == 'l2':
-      if self.details_l2 == None:
-        raise TypeError('morph does not contain an l2 distance B')
-      else:
-        return self.details_l2['distanceB']
-    else:
-      raise IndexError(type + ' is not a valid distance metric.')
+    details = self.load_details(type)
+    if details is None:
+      raise TypeError('morph does not contain ' + type + ' distance B')
+    return details['distanceB']
 
   def get_emd(self, type:str) -> float:
-    if type == 'cosine':
-      if self.details_cosine == None:
-        raise TypeError("morph does not contain a cosine earth mover's / 1-wasserstein distance")
-      else:
-        return self.details_cosine['1-wasserstein']
-    elif type == 'l2':
-      if self.details_l2 == None:
-        raise TypeError("morph does not contain an l2 earth mover's / 1-wasserstein distance")
-      else:
-        return self.details_l2['1-wasserstein']
-    else:
-      raise IndexError(type + ' is not a valid distance metric.')
+    details = self.load_details(type)
+    if details is None:
+      raise TypeError('morph does not contain ' + type + " earth mover's / 1-wasserstein distance")
+    return details['1-wasserstein']
 
   def get_morph_path(self) -> str:
     return self.morph_path
@@ -248,6 +251,11 @@ class Rank(enum.Enum):
   C = 3  # Rank C indiciates that the morph cannot be identified as either one of its composite identities.
 
 
+def get_morph_cache_file(settings:GUISettings) -> str:
+  """Returns the path of the pickled Morphs of settings.morphs_dir, versioned by MORPH_CACHE_VERSION."""
+  return '../resources/cache/' + settings.morphs_dir.replace('/', '_') + '.v' + str(MORPH_CACHE_VERSION) + '.morphcache'
+
+
 def encapsulate_morphs(settings:GUISettings) -> list:
     '''
     Takes in the directory where morphs are stored and encapsulates these
@@ -258,7 +266,8 @@ def encapsulate_morphs(settings:GUISettings) -> list:
     instead of re-encapsulating existing morphs to improve startup time.
     If it does not find this pickled version, it will instead encapsulate
     the morphs and store a pickled encapsulation under ../resources/cache
-    in the format 'morphs_dir.morphcache'.
+    in the format 'morphs_dir.v<MORPH_CACHE_VERSION>.morphcache' (see
+    get_morph_cache_file).
     '''
 
     # If the settings object does not contain morphs or stills directories,
@@ -266,11 +275,12 @@ def encapsulate_morphs(settings:GUISettings) -> list:
     if settings.morphs_dir == '' or settings.stills_dir == '':
       return None
 
-    morph_cache_file = settings.morphs_dir.replace('/', '_') + '.morphcache'
+    morph_cache_file = get_morph_cache_file(settings)
 
     # If a pickled cache exists, load the cache and use it.
-    if os.path.exists('../resources/cache/' + morph_cache_file):
-      with open('../resources/cache/' + morph_cache_file, 'rb') as f:
+    if os.path.exists(morph_cache_file):
+      with timing.span('encapsulate.load_cache'), open(morph_cache_file, 'rb') as f:
+        timing.count_bytes('encapsulate.load_cache', morph_cache_file)
         return pickle.load(f)
 
 
@@ -282,30 +292,34 @@ def encapsulate_morphs(settings:GUISettings) -> list:
     Morphs = []
 
     print('Preparing morphs for display...')
-    for morph in tqdm(os.listdir(settings.morphs_dir)):
+    with timing.span('encapsulate.scan_morphs'):
+      morphs = os.listdir(settings.morphs_dir)
+
+    for morph in tqdm(morphs):
       try:
-        Morphs.append(Morph(
-          settings.morphs_dir + '/' + morph, 
-          settings.stills_dir, 
-          settings.still_ext, 
-          csv_cosine_path=settings.csvs_cosine_path, 
-          csv_l2_path=settings.csvs_l2_path,
-          details_cosine_path=settings.details_cosine_path,
-          details_l2_path=settings.details_l2_path
-          ))
+        with timing.span('encapsulate.morph'):
+          Morphs.append(Morph(
+            settings.morphs_dir + '/' + morph,
+            settings.stills_dir,
+            settings.still_ext,
+            csv_cosine_path=settings.csvs_cosine_path,
+            csv_l2_path=settings.csvs_l2_path,
+            details_cosine_path=settings.details_cosine_path,
+            details_l2_path=settings.details_l2_path
+            ))
       except KeyError:
         pass
         #print('KeyError, morph probably not found in existing file. Skipping...')
 
     # Store the encapsulated morphs as a cache
-    with open('../resources/cache/' + morph_cache_file, 'wb') as f:
+    with timing.span('encapsulate.store_cache'), open(morph_cache_file, 'wb') as f:
       pickle.dump(Morphs, f)
 
     return Morphs
 
 
 def get_stills_from_morph(morph:str) -> list:
-  return [morph.split('/')[-1].split('-')[0].split('.')[0], morph.split('/')[-1].split('-')[1].split('.')[0]]
+  return list(identities.parse_morph(morph))
 
 
 def calc_avgdist(morph_csv:str, distance_label:str, morph_ext:str = '.png') -> float:
@@ -333,29 +347,28 @@ def calc_avgdist(morph_csv:str, distance_label:str, morph_ext:str = '.png') -> f
   if morph_csv == '':
     return float(-1)
 
-  # Prepare incoming csv file
-  df = pandas.read_csv(morph_csv, sep='\t')
-  df.drop(columns=['Unnamed: 0'], inplace=True)
-  for i in range(len(df)):
-    df.at[i, 'identity'] = df['identity'][i].split('/')[-1]
-    
-  identity_1 = morph_csv.split('/')[-1].split('-')[0].split('_')[0]
-  identity_2 = morph_csv.split('/')[-1].split('-')[1].split('.')[0].split('_')[0]
+  identity_1, identity_2 = get_identities_from_morph_csv(morph_csv)
+  distances = get_mated_distances(morph_csv, distance_label, identity_1, identity_2)
 
-  identity_1_distances = []
-  identity_2_distances = []
+  return morph_details(*distances)['avgdist']
 
-  for i in range(len(df)):
-    if df['identity'][i].split('_')[0] == identity_1:
-      identity_1_distances.append(df[distance_label][i])
-    elif df['identity'][i].split('_')[0] == identity_2:
-      identity_2_distances.append(df[distance_label][i])
-    else:
-      pass
 
-  avgdist = statistics.mean([statistics.mean(identity_1_distances), statistics.mean(identity_2_distances)])
+def get_identities_from_morph_csv(morph_csv: str) -> tuple[str, str]:
+  """Returns the identities of the two stills of a morph csv (ex. ('00', '01') for '00_0-01_0.png.csv')."""
+  return identities.morph_identities(morph_csv)
+
 
-  return avgdist
+def get_mated_distances(morph_csv: str, distance_label: str, identity_1: str, identity_2: str) -> tuple[np.ndarray]:
+  """Streams a morph csv and returns the distances of the morph to the stills of its two identities.
+
+  Only these distances are kept in memory, so the other rows of a
+  gallery-scale csv cost no more than one chunk (see dumps.py). If
+  both identities are the same, all its distances go to identity_1.
+  """
+  stats = dumps.reduce_identities(morph_csv, distance_label, [identity_1, identity_2], [identity_1, identity_2])
+  if identity_1 == identity_2:
+    return (stats[identity_1]['samples'], np.array([], dtype=float))
+  return (stats[identity_1]['samples'], stats[identity_2]['samples'])
 
 
 def calc_morphdetails(morph_csv: str, distance_label: str, morph_ext: str = '.png') -> dict:
@@ -377,36 +390,30 @@ def calc_morphdetails(morph_csv: str, distance_label: str, morph_ext: str = '.pn
     - distance_label: the csv file label for distances (ex. 'VGG-Face_cosine', 'VGG-Face_euclidean_l2', etc.)
   '''
 
-  # Prepare incoming csv file
-  df = pandas.read_csv(morph_csv, sep='\t')
-  df.drop(columns=['Unnamed: 0'], inplace=True)
-  for i in range(len(df)):
-    df.at[i, 'identity'] = df['identity'][i].split('/')[-1]
+  # Read once, keeping only the distances to the morph's two identities
+  identity_1, identity_2 = get_identities_from_morph_csv(morph_csv)
+  identity_1_distances, identity_2_distances = get_mated_distances(morph_csv, distance_label, identity_1, identity_2)
 
-  identity_1 = morph_csv.split('/')[-1].split('-')[0].split('_')[0]
-  identity_2 = morph_csv.split('/')[-1].split('-')[1].split('.')[0].split('_')[0]
+  return morph_details(identity_1_distances, identity_2_distances)
 
-  identity_1_distances = []
-  identity_2_distances = []
 
-  for i in range(len(df)):
-    if df['identity'][i].split('_')[0] == identity_1:
-      identity_1_distances.append(df[distance_label][i])
-    elif df['identity'][i].split('_')[0] == identity_2:
-      identity_2_distances.append(df[distance_label][i])
-    else:
-      pass
+def morph_details(identity_1_distances: np.ndarray, identity_2_distances: np.ndarray) -> dict:
+  """Calculates the details of calc_morphdetails from a morph's distances to its two identities.
 
-  result = {}
-  result['avgdist'] = calc_avgdist(morph_csv, distance_label, morph_ext)
-  result['distanceA'] = np.mean(identity_1_distances)
-  result['distanceB'] = np.mean(identity_2_distances)
-  result['1-wasserstein'] = wasserstein_distance(identity_1_distances, identity_2_distances)
+  Details are those of aggregates.AggregateTable.details: NaN distances
+  are not counted.
 
-  return result
+  Raises:
+    statistics.StatisticsError: if either identity has no (non-NaN)
+      distances.
+  """
+  with timing.span('details.aggregates'):
+    table = aggregates.AggregateTable.from_scores({'': (identity_1_distances, identity_2_distances)})
+    return table.details('')
 
 
-def writescores(morph_csvs_dir:str, output_file:str, distance_label:str) -> None:
+def writescores(morph_csvs_dir:str, output_file:str, distance_label:str, metrics_dir:str = None, workers:int = None,
+                shard:int = None, shards:int = 1) -> None:
   '''
   Writes morph details for all morphs csvs stored in morph_csvs_dir to an output file, output_file (a txt file)
 
@@ -417,30 +424,103 @@ def writescores(morph_csvs_dir:str, output_file:str, distance_label:str) -> None
     - output_file is a .txt file containing a dictionary of morphs (keys) and scores (values)
 
   Parameters:
-    - morphs_csvs_dir: a valid path to a directory containing morph csvs
-    - output_file: a file to create to output a dictionary of morphscores
+    - morphs_csvs_dir: a valid path to a directory or archive containing morph csvs
+      (see dumps.py)
+    - output_file: a file to create to output a dictionary of morphscores. Files
+      named *.db, *.sqlite or *.sqlite3 are written as an indexed details store
+      (see store.py), others as JSON.
     - distance_label: this will change based on what kind of distance 
       metric was used when creating the morph csv files. Some common settings
       are listed below:
         cosine: 'VGG-Face_cosine'
         L2 euclidian: 'VGG-Face_euclidean_l2'
+    - metrics_dir: a directory to export progress metrics to (see metrics.JobMetrics)
+    - workers: the number of threads reading csvs (see ingest.get_workers). The
+      output does not depend on it.
+    - shard, shards: if shard is given, only the csvs of that shard (see dumps.shard_of)
+      are scored, so that several nodes can split a directory. Combine their outputs
+      with merge_scores.
   '''
 
   details = {}
-  for csv in tqdm(os.listdir(morph_csvs_dir)):
-    try:
-      details[csv] = calc_morphdetails(morph_csvs_dir + '/' + csv, distance_label)
-    except statistics.StatisticsError:
-      print('StatisticsError. Skipping morph.')
+  with timing.span('writescores.scan_dir'):
+    csvs = sorted(dumps.listdir(morph_csvs_dir))
+
+  if shard is not None:
+    csvs = [csv for csv in csvs if dumps.shard_of(csv, shards) == shard]
+
+  with metrics.JobMetrics('writescores', len(csvs), metrics_dir) as job_metrics:
+    def calc_details(csv):
+      with timing.span('writescores.morph'):
+        return calc_morphdetails(morph_csvs_dir + '/' + csv, distance_label)
+
+    for csv, result in tqdm(ingest.read_files(calc_details, csvs, workers, return_exceptions=True), total=len(csvs)):
+      if isinstance(result, statistics.StatisticsError):
+        print('StatisticsError. Skipping morph.')
+        job_metrics.error()
+      elif isinstance(result, Exception):
+        raise result
+      else:
+        # Keyed by the uncompressed csv name, which Morph looks up
+        details[dumps.strip_compression(csv)] = result
+        job_metrics.advance(file=morph_csvs_dir + '/' + csv)
 
-  with open(output_file, 'w') as file:
-    file.write(json.dumps(details))
+  with timing.span('writescores.write'):
+    store.save_details(dict(sorted(details.items())), output_file)
 
 
-def plot_wasserstein(morph_details_file:str) -> None:
+def merge_scores(details_files:list[str], output_file:str) -> None:
+  '''
+  Merges the outputs of writescores runs over different shards of a directory
+  into the output of a single run over the whole directory.
+
+  Parameters:
+    - details_files: the writescores output files of every shard
+    - output_file: the merged details file to write
+  '''
   details = {}
-  with open(morph_details_file) as file:
-    details = json.load(file)
+  for details_file in details_files:
+    details.update(store.load_details(details_file))
+
+  store.save_details(dict(sorted(details.items())), output_file)
+
+
+def plot_wasserstein(morph_details_file:str, output_prefix:str = None, ext:str = 'png', aggregate:bool = False) -> None:
+  '''
+  Plots distance A, distance B and their average against the 1-wasserstein
+  distance of every morph in a details file, plus a histogram of the
+  1-wasserstein distances.
+
+  If output_prefix is given, the figures are written to files named
+  output_prefix + '_<figure>.' + ext through the Agg backend instead of
+  being shown (see plotting.render_wasserstein).
+
+  If aggregate is True, binned counts and per-bin quantiles are drawn
+  instead of one marker per morph. They are cached next to the details
+  file (see plotting.load_wasserstein_aggregates).
+  '''
+  if output_prefix is not None:
+    plotting.render_wasserstein(morph_details_file, output_prefix, ext, aggregate=aggregate)
+    return
+
+  if aggregate:
+    aggregates = plotting.load_wasserstein_aggregates(morph_details_file)
+
+    plt.figure(0)
+    plotting.draw_wasserstein_aggregate(plt.gca(), aggregates, 'distance_a', 'distance A')
+
+    plt.figure(1)
+    plotting.draw_wasserstein_aggregate(plt.gca(), aggregates, 'distance_b', 'distance B')
+
+    plt.figure(2)
+    plotting.draw_wasserstein_aggregate(plt.gca(), aggregates, 'distance_mean', 'Average of distance A and B')
+
+    plt.figure(3)
+    plt.stairs(aggregates['wasserstein_hist'], aggregates['wasserstein_edges'], fill=True)
+    plt.show()
+    return
+
+  details = store.load_details(morph_details_file)
 
   xA = []
   yA = []
@@ -482,17 +562,13 @@ def plot_wasserstein(morph_details_file:str) -> None:
 
 
 def write_details_to_csv(morph_details_file:str, csv_out_file:str) -> None:
-  csv_out = 'File Name, average distance, distance A, distance B, 1-wasserstein\n'
-
-  details = {}
-  with open(morph_details_file) as f:
-    details = json.load(f)
-  
-  for key in details.keys():
-    csv_out += key + ',' + str(details[key]['avgdist']) + ',' + str(details[key]['distanceA']) + ',' + str(details[key]['distanceB']) + ',' + str(details[key]['1-wasserstein']) + '\n'
-
-  with open(csv_out_file, 'w') as f:
-    f.write(csv_out)
+  '''
+  Writes the details of a details file to a csv file, one row per morph,
+  streaming rows through the csv module (see export.py for other metrics,
+  both distance types and columnar formats).
+  '''
+  batches = store.iter_table({'': morph_details_file}, ['avgdist', 'distanceA', 'distanceB', '1-wasserstein'])
+  export.write_csv(batches, csv_out_file, ['File Name', ' average distance', ' distance A', ' distance B', ' 1-wasserstein'])
 
 
 def report(message, type:ReportType) -> None:
@@ -509,7 +585,8 @@ def report(message, type:ReportType) -> None:
     print(prefix + line)
 
 
-def import_morph_nearface_csv(csv_file: str) -> tuple[dict]:
+@timing.timed('csv.import_morph')
+def import_morph_nearface_csv(csv_file: str, distance_label: str = 'VGG-Face_euclidean_l2') -> tuple[dict]:
   """Imports a csv containing morph distances.
 
   Imports a morph csv created by NearFace and returns a tuple of
@@ -519,6 +596,8 @@ def import_morph_nearface_csv(csv_file: str) -> tuple[dict]:
   Args:
     csv_file: A path to a morph's csv file generated
       by NearFace.
+    distance_label: the csv file label for distances
+      (ex. 'VGG-Face_cosine', 'VGG-Face_euclidean_l2', etc.)
 
   Returns:
     A tuple containing two dicts in the format
@@ -531,30 +610,25 @@ def import_morph_nearface_csv(csv_file: str) -> tuple[dict]:
 
   """
 
-  distance_label = 'VGG-Face_euclidean_l2'
-
-  df = pandas.read_csv(csv_file, sep='\t')
-  df.drop(columns=['Unnamed: 0'], inplace=True)
-  for i in range(len(df)):
-    df.at[i, 'identity'] = df['identity'][i].split('/')[-1]
-
-  identity_1 = csv_file.split('/')[-1].split('-')[0].split('_')[0]
-  identity_2 = csv_file.split('/')[-1].split('-')[1].split('.')[0].split('_')[0]
+  identity_1, identity_2 = get_identities_from_morph_csv(csv_file)
 
   identity_1_distances = {}
   identity_2_distances = {}
 
-  for i in range(len(df)):
-    if df['identity'][i].split('_')[0] == identity_1:
-      identity_1_distances[df['identity'][i]] = df[distance_label][i]
-    elif df['identity'][i].split('_')[0] == identity_2:
-      identity_2_distances[df['identity'][i]] = df[distance_label][i]
-      
-  # print(identity_1_distances, identity_2_distances)
+  # Streamed in chunks, keeping only the rows of the two identities
+  with timing.span('csv.read'):
+    for stills, distances in dumps.read_chunks(csv_file, distance_label):
+      still_identities = identities.identity_series(stills).to_numpy()
+      is_1 = still_identities == identity_1
+      is_2 = (still_identities == identity_2) & ~is_1
+      identity_1_distances.update(zip(stills[is_1].tolist(), distances[is_1]))
+      identity_2_distances.update(zip(stills[is_2].tolist(), distances[is_2]))
+
   return (identity_1_distances, identity_2_distances)
 
 
-def import_still_nearface_csv(csv_file: str) -> dict:
+@timing.timed('csv.import_still')
+def import_still_nearface_csv(csv_file: str, distance_label: str = 'VGG-Face_euclidean_l2') -> dict:
   """Imports a csv containing still distances.
 
   Imports a still csv created by NearFace and returns a dict
@@ -563,6 +637,8 @@ def import_still_nearface_csv(csv_file: str) -> dict:
   Args:
     csv_file: A path to a still's csv file generated
       by NearFace.
+    distance_label: the csv file label for distances
+      (ex. 'VGG-Face_cosine', 'VGG-Face_euclidean_l2', etc.)
 
   Returns:
     A dict in the format
@@ -570,18 +646,7 @@ def import_still_nearface_csv(csv_file: str) -> dict:
     {still_1: dist_to_given_still, still_2: ...}
 
   """
-  distance_label = 'VGG-Face_euclidean_l2'
-
-  df = pandas.read_csv(csv_file, sep='\t')
-  df.drop(columns=['Unnamed: 0'], inplace=True)
-  for i in range(len(df)):
-    df.at[i, 'identity'] = df['identity'][i].split('/')[-1]
-
-  result_dict = {}
-  for i in range(len(df)):
-    result_dict[df['identity'][i]] = df[distance_label][i]
-  # print(result_dict)
-  return result_dict
+  return dumps.read_still_distances(csv_file, distance_label)
 
 
 def classify(dist: float, gamma: float) -> bool:
@@ -602,15 +667,7 @@ def classify(dist: float, gamma: float) -> bool:
 
 
 def sort_stills(stills: list[str]) -> list[str]:
-  """Sorts a list of stills by numeric value."""
-
-  sort_dict = {}
-
-  for still in stills:
-    id = int(still.split('/')[-1].split('_')[0])
-    num = int(still.split('/')[-1].split('.')[0].split('_')[1])
-    sort_val = int(str(id) + str(num))
-    sort_dict[still] = sort_val
-  
-  return list(dict(sorted(sort_dict.items(), key=lambda x:x[1])).keys())
+  """Sorts a list of stills by (id, image number), numerically."""
+  stills = list(dict.fromkeys(stills))
+  return [stills[i] for i in identities.REGISTRY.sort_order(identities.REGISTRY.stills(stills))]
 
@@ -1,3 +1,4 @@
+import timing
 import utils
 from PIL import Image
 import PyQt6.QtCore as QtCore
@@ -21,14 +22,18 @@ class DataLabel(QtWidgets.QLabel):
 class MImage(QtWidgets.QWidget):
   def __init__(self, image: str, parent=None):
     super().__init__()
-    self.p = QtGui.QPixmap(image)
+    with timing.span('gui.decode_image'):
+      timing.count_bytes('gui.decode_image', image)
+      self.p = QtGui.QPixmap(image)
     self.native_height = 1  # default values for aspect ratio 1:1 (square image)
     self.native_width = 1
     self.sizePolicy = QtWidgets.QSizePolicy(QtWidgets.QSizePolicy.Policy.Fixed, QtWidgets.QSizePolicy.Policy.Fixed)
 
   def setPixmap(self, p):
-    self.p = QtGui.QPixmap(p)
-    pil_img = Image.open(p)
+    with timing.span('gui.decode_image'):
+      timing.count_bytes('gui.decode_image', p)
+      self.p = QtGui.QPixmap(p)
+      pil_img = Image.open(p)
     self.native_height = pil_img.size[0]
     self.native_width = pil_img.size[1]
     self.update()
@@ -83,8 +88,10 @@ class MImageContainer(QtWidgets.QWidget):
 class MImage2(QtWidgets.QLabel):
   def __init__(self, image: str, parent=None):
     super().__init__()
-    self.p = QtGui.QPixmap(image)
-    pil_img = Image.open(image)
+    with timing.span('gui.decode_image'):
+      timing.count_bytes('gui.decode_image', image)
+      self.p = QtGui.QPixmap(image)
+      pil_img = Image.open(image)
     self.native_height = pil_img.size[0]
     self.native_width = pil_img.size[1]
     self.setPixmap(self.p)
@@ -120,6 +127,124 @@ class WindowWidget(QtWidgets.QWidget):
     self.resize(new_size)
 
 
+class NavigationBar(QtWidgets.QWidget):
+  """Sort, filter and go-to controls for the morphs shown by MainWindow (see navigation.MorphIndex)."""
+  # Signals
+  view_changed = QtCore.pyqtSignal()
+  jump_requested = QtCore.pyqtSignal(str)
+
+  def __init__(self, keys:list[str]):
+    super().__init__()
+
+    self.sort_box = QtWidgets.QComboBox(self)
+    self.sort_box.addItem('File order', None)
+    for key in keys:
+      self.sort_box.addItem(key, key)
+    self.sort_box.currentIndexChanged.connect(self.view_changed.emit)
+
+    self.descending_box = QtWidgets.QCheckBox('Descending', self)
+    self.descending_box.stateChanged.connect(self.view_changed.emit)
+
+    validator = QtGui.QDoubleValidator(self)
+    self.low_line = QtWidgets.QLineEdit(self)
+    self.low_line.setPlaceholderText('min')
+    self.low_line.setValidator(validator)
+    self.low_line.editingFinished.connect(self.view_changed.emit)
+    self.high_line = QtWidgets.QLineEdit(self)
+    self.high_line.setPlaceholderText('max')
+    self.high_line.setValidator(validator)
+    self.high_line.editingFinished.connect(self.view_changed.emit)
+
+    self.rank_box = QtWidgets.QComboBox(self)
+    self.rank_box.addItem('All ranks', None)
+    for rank in utils.Rank:
+      self.rank_box.addItem('L2 rank ' + rank.name, rank)
+    self.rank_box.currentIndexChanged.connect(self.view_changed.emit)
+
+    self.goto_line = QtWidgets.QLineEdit(self)
+    self.goto_line.setPlaceholderText('Go to name prefix')
+    self.goto_line.returnPressed.connect(lambda: self.jump_requested.emit(self.goto_line.text()))
+
+    self.layout = QtWidgets.QHBoxLayout()
+    self.layout.addWidget(QtWidgets.QLabel('Sort by:', self))
+    self.layout.addWidget(self.sort_box)
+    self.layout.addWidget(self.descending_box)
+    self.layout.addWidget(self.low_line)
+    self.layout.addWidget(self.high_line)
+    self.layout.addWidget(self.rank_box)
+    self.layout.addWidget(self.goto_line)
+
+    self.setLayout(self.layout)
+
+  def get_key(self) -> str:
+    return self.sort_box.currentData()
+
+  def get_descending(self) -> bool:
+    return self.descending_box.isChecked()
+
+  def get_bounds(self) -> tuple[float]:
+    """Returns the (low, high) filter bounds, None where a bound is empty."""
+    bounds = []
+    for line in [self.low_line, self.high_line]:
+      try:
+        bounds.append(float(line.text()))
+      except ValueError:
+        bounds.append(None)
+    return tuple(bounds)
+
+  def get_ranks(self) -> list:
+    rank = self.rank_box.currentData()
+    return None if rank is None else [rank]
+
+
+class ThresholdBar(QtWidgets.QWidget):
+  """A slider and spin box setting the recognition threshold of one distance type, in steps of 0.001 from 0 to 2."""
+  # Signals
+  threshold_changed = QtCore.pyqtSignal(float)
+
+  def __init__(self, labeltext:str, threshold:float):
+    super().__init__()
+
+    self.label = QtWidgets.QLabel(labeltext, self)
+
+    self.slider = QtWidgets.QSlider(QtCore.Qt.Orientation.Horizontal, self)
+    self.slider.setRange(0, 2000)
+    self.slider.setValue(round(threshold * 1000))
+
+    self.spin_box = QtWidgets.QDoubleSpinBox(self)
+    self.spin_box.setDecimals(3)
+    self.spin_box.setRange(0, 2)
+    self.spin_box.setSingleStep(0.001)
+    self.spin_box.setValue(threshold)
+
+    # Each control follows the other; signals are blocked while doing so,
+    # so that every change is emitted once.
+    self.slider.valueChanged.connect(self.slider_changed)
+    self.spin_box.valueChanged.connect(self.spin_box_changed)
+
+    self.layout = QtWidgets.QHBoxLayout()
+    self.layout.addWidget(self.label)
+    self.layout.addWidget(self.slider)
+    self.layout.addWidget(self.spin_box)
+
+    self.setLayout(self.layout)
+
+  def slider_changed(self, value:int) -> None:
+    self.spin_box.blockSignals(True)
+    self.spin_box.setValue(value / 1000)
+    self.spin_box.blockSignals(False)
+    self.threshold_changed.emit(value / 1000)
+
+  def spin_box_changed(self, value:float) -> None:
+    self.slider.blockSignals(True)
+    self.slider.setValue(round(value * 1000))
+    self.slider.blockSignals(False)
+    self.threshold_changed.emit(value)
+
+  def get_threshold(self) -> float:
+    return self.spin_box.value()
+
+
 class DetailLine(QtWidgets.QWidget):
   def __init__(self, labeltext:str):
     super().__init__()
@@ -191,6 +316,22 @@ class DetailsDialog(QtWidgets.QDialog):
     self.csvs_l2_bt.setText('Search')
     self.csvs_l2_bt.clicked.connect(lambda: self.get_dir('csvs_l2'))
 
+    self.still_csvs_cosine_label = QtWidgets.QLabel(self)
+    self.still_csvs_cosine_label.setText('VGG-Face Cosine still CSVs directory (optional): ')
+    self.still_csvs_cosine_line = QtWidgets.QLineEdit(self)
+    self.still_csvs_cosine_line.setText(self.settings.still_csvs_cosine_path)
+    self.still_csvs_cosine_bt = QtWidgets.QPushButton(self)
+    self.still_csvs_cosine_bt.setText('Search')
+    self.still_csvs_cosine_bt.clicked.connect(lambda: self.get_dir('still_csvs_cosine'))
+
+    self.still_csvs_l2_label = QtWidgets.QLabel(self)
+    self.still_csvs_l2_label.setText('VGG-Face L2 still CSVs directory (optional): ')
+    self.still_csvs_l2_line = QtWidgets.QLineEdit(self)
+    self.still_csvs_l2_line.setText(self.settings.still_csvs_l2_path)
+    self.still_csvs_l2_bt = QtWidgets.QPushButton(self)
+    self.still_csvs_l2_bt.setText('Search')
+    self.still_csvs_l2_bt.clicked.connect(lambda: self.get_dir('still_csvs_l2'))
+
     self.precision_label = QtWidgets.QLabel(self)
     self.precision_label.setText('Precision (integer): ')
     self.precision_line = QtWidgets.QLineEdit(self)
@@ -225,10 +366,18 @@ class DetailsDialog(QtWidgets.QDialog):
     self.layout.addWidget(self.csvs_l2_line, 5, 1, 1, 2)
     self.layout.addWidget(self.csvs_l2_bt, 5, 3)
 
-    self.layout.addWidget(self.precision_label, 6, 0)
-    self.layout.addWidget(self.precision_line, 6, 1, 1, 2)
+    self.layout.addWidget(self.still_csvs_cosine_label, 6, 0)
+    self.layout.addWidget(self.still_csvs_cosine_line, 6, 1, 1, 2)
+    self.layout.addWidget(self.still_csvs_cosine_bt, 6, 3)
+
+    self.layout.addWidget(self.still_csvs_l2_label, 7, 0)
+    self.layout.addWidget(self.still_csvs_l2_line, 7, 1, 1, 2)
+    self.layout.addWidget(self.still_csvs_l2_bt, 7, 3)
+
+    self.layout.addWidget(self.precision_label, 8, 0)
+    self.layout.addWidget(self.precision_line, 8, 1, 1, 2)
 
-    self.layout.addWidget(self.confirm_button, 7, 2)
+    self.layout.addWidget(self.confirm_button, 9, 2)
 
     self.setLayout(self.layout)
 
@@ -239,6 +388,8 @@ class DetailsDialog(QtWidgets.QDialog):
     self.settings.details_l2_path = self.details_l2_line.text()
     self.settings.csvs_cosine_path = self.csvs_cosine_line.text()
     self.settings.csvs_l2_path = self.csvs_l2_line.text()
+    self.settings.still_csvs_cosine_path = self.still_csvs_cosine_line.text()
+    self.settings.still_csvs_l2_path = self.still_csvs_l2_line.text()
     
     # TO DO: Input validation on self.precision_line
     self.settings.precision = int(self.precision_line.text())
@@ -255,6 +406,10 @@ class DetailsDialog(QtWidgets.QDialog):
       self.settings.csvs_cosine_path = path
     elif data == 'csvs_l2':
       self.settings.csvs_l2_path = path
+    elif data == 'still_csvs_cosine':
+      self.settings.still_csvs_cosine_path = path
+    elif data == 'still_csvs_l2':
+      self.settings.still_csvs_l2_path = path
     else:
       pass
       
@@ -278,6 +433,8 @@ class DetailsDialog(QtWidgets.QDialog):
     self.details_l2_line.setText(self.settings.details_l2_path)
     self.csvs_cosine_line.setText(self.settings.csvs_cosine_path)
     self.csvs_l2_line.setText(self.settings.csvs_l2_path)
+    self.still_csvs_cosine_line.setText(self.settings.still_csvs_cosine_path)
+    self.still_csvs_l2_line.setText(self.settings.still_csvs_l2_path)
 
   def execr(self) -> utils.GUISettings:
     self.exec()
@@ -1,3 +1,6 @@
+import navigation
+import numpy as np
+import scores
 import utils
 import widgets
 import PyQt6.QtCore as QtCore
@@ -15,7 +18,9 @@ class MainWindow(QtWidgets.QMainWindow):
     # Logic setup
     self.precision = precision
     self.Morphs = Morphs
+    # morph_index is a position in view, the indices of the Morphs shown
     self.morph_index = 0
+    self.view = None
 
     # Window GUI setup
 
@@ -47,6 +52,14 @@ class MainWindow(QtWidgets.QMainWindow):
     self.morph_label = QtWidgets.QLabel()
     self.morph_label.setAlignment(QtCore.Qt.AlignmentFlag.AlignCenter)
 
+    self.navigation_bar = widgets.NavigationBar(navigation.KEYS)
+    self.navigation_bar.view_changed.connect(self.update_view)
+    self.navigation_bar.jump_requested.connect(self.jump_to_prefix)
+
+    self.threshold_bars = {}
+    for type, labeltext in [('cosine', 'Cosine threshold:'), ('l2', 'L2 threshold:')]:
+      self.threshold_bars[type] = widgets.ThresholdBar(labeltext, navigation.DEFAULT_THRESHOLDS[type])
+      self.threshold_bars[type].threshold_changed.connect(lambda threshold, type=type: self.threshold_changed(type, threshold))
 
 
     self.layout = QtWidgets.QGridLayout()
@@ -57,6 +70,9 @@ class MainWindow(QtWidgets.QMainWindow):
     self.layout.addWidget(self.next_button, 3, 2)
     self.layout.addWidget(self.previous_button, 3, 0)
     self.layout.addWidget(self.morph_label, 3, 1)
+    self.layout.addWidget(self.navigation_bar, 4, 0, 1, 3)
+    self.layout.addWidget(self.threshold_bars['cosine'], 5, 0, 1, 3)
+    self.layout.addWidget(self.threshold_bars['l2'], 6, 0, 1, 3)
 
     self.widget = widgets.WindowWidget()
     self.widget.setLayout(self.layout)
@@ -84,8 +100,13 @@ class MainWindow(QtWidgets.QMainWindow):
       self.Morphs = utils.encapsulate_morphs(self.settings)
 
     try:
+      # Index the morphs once for sorting, filtering and prefix search
+      self.morph_table = navigation.MorphIndex(self.Morphs)
+      self.view = self.morph_table.order()
+      self.load_still_distances()
+
       # Set the first morph
-      self.set_morph(self.Morphs[self.morph_index])
+      self.set_morph(self.Morphs[self.view[self.morph_index]])
     except TypeError:
       self.exit_error('User did not properly set image paths. Exiting.')
 
@@ -97,35 +118,83 @@ class MainWindow(QtWidgets.QMainWindow):
 
 
 
+  def load_still_distances(self) -> None:
+    """Reads the still csvs of each type once, if set, for BPCER."""
+    for type, stills_csvs_dir in [('cosine', self.settings.still_csvs_cosine_path), ('l2', self.settings.still_csvs_l2_path)]:
+      if stills_csvs_dir != '':
+        utils.report('Loading ' + type + ' still distances for BPCER...', utils.ReportType.INFO)
+        self.morph_table.set_still_distances(type, scores.load_still_scores(stills_csvs_dir, navigation.DISTANCE_LABELS[type]))
+
   def set_morph(self, morph:utils.Morph) -> None:
     self.morph = morph
+    # Read once per morph, so that dragging a threshold reads no files
+    self.morph_details = {type: morph.get_details(type) for type in navigation.TYPES}
     self.morph_image.set_image(self.morph.get_morph_path())
     self.still1_image.set_image(self.morph.get_still1_path())
     self.still2_image.set_image(self.morph.get_still2_path())
-    self.morph_label.setText(str(self.morph_index + 1) + ' / ' + str(len(self.Morphs)))
+    self.set_morph_label()
     self.set_data()
 
-  def set_data(self) -> None:
-    cosine_data = self.morph.get_details('cosine')
-    l2_data = self.morph.get_details('l2')
-    data_string = ''
+  def set_morph_label(self) -> None:
+    text = str(self.morph_index + 1) + ' / ' + str(len(self.view))
+    if len(self.view) != len(self.Morphs):
+      text += ' (of ' + str(len(self.Morphs)) + ')'
+    self.morph_label.setText(text)
+
+  def update_view(self) -> None:
+    """Re-sorts and filters the morphs from the navigation bar, keeping the current morph if it is still shown."""
+    current = self.view[self.morph_index] if len(self.view) > 0 else None
+
+    low, high = self.navigation_bar.get_bounds()
+    self.view = self.morph_table.view(self.navigation_bar.get_key(), self.navigation_bar.get_descending(),
+                                      low, high, self.navigation_bar.get_ranks())
+
+    positions = np.flatnonzero(self.view == current)
+    self.morph_index = int(positions[0]) if len(positions) > 0 else 0
+    if len(self.view) == 0:
+      self.morph_label.setText('0 / 0 (of ' + str(len(self.Morphs)) + ')')
+    elif self.view[self.morph_index] != current:
+      self.set_morph(self.Morphs[self.view[self.morph_index]])
+    else:
+      self.set_morph_label()
 
-    # Formatting cosine data
-    data_string += 'VGG-Face Statistics\n\n'
-    data_string += 'Cosine Distance Metric (VGG-Face threshold 0.4):\n'
-    data_string += '  Average Distance: ' + str(round(cosine_data['avgdist'], self.precision)) + '\n'
-    data_string += '  Avg distance to ' + self.morph.get_still1() + ': ' + str(round(cosine_data['distanceA'], self.precision)) + '\n'
-    data_string += '  Avg distance to ' + self.morph.get_still2() + ': ' + str(round(cosine_data['distanceB'], self.precision)) + '\n'
-    data_string += '  1-Wasserstein (earth mover) distance between above: ' + str(round(cosine_data['1-wasserstein'], self.precision)) + '\n'
+  def threshold_changed(self, type:str, threshold:float) -> None:
+    """Updates ranks, the rank views and the readout for a new threshold, from arrays in memory."""
+    self.morph_table.set_threshold(type, threshold)
+    self.update_view()
+    self.set_data()
 
-    data_string += '\n'
+  def jump_to_prefix(self, prefix:str) -> None:
+    position = self.morph_table.find_prefix(prefix, self.view)
+    if position is None:
+      utils.report('No morph shown starts with ' + prefix, utils.ReportType.INFO)
+      return
+    self.morph_index = position
+    self.set_morph(self.Morphs[self.view[self.morph_index]])
 
-    data_string += 'L2 Euclidean Distance Metric (VGG-Face threshold 0.86):\n'
-    data_string += '  Average Distance: ' + str(round(l2_data['avgdist'], self.precision)) + '\n'
-    data_string += '  Avg distance to ' + self.morph.get_still1() + ': ' + str(round(l2_data['distanceA'], self.precision)) + '\n'
-    data_string += '  Avg distance to ' + self.morph.get_still2() + ': ' + str(round(l2_data['distanceB'], self.precision)) + '\n'
-    data_string += '  1-Wasserstein (earth mover) distance between above: ' + str(round(l2_data['1-wasserstein'], self.precision)) + '\n'
+  def set_data(self) -> None:
+    """Shows the current morph's details, and its rank and the dataset's rank counts, APCER and BPCER at the thresholds."""
+    data_string = ''
+    data_string += 'VGG-Face Statistics\n\n'
 
+    for type, title in [('cosine', 'Cosine Distance Metric'), ('l2', 'L2 Euclidean Distance Metric')]:
+      data = self.morph_details[type]
+      threshold = self.threshold_bars[type].get_threshold()
+      rank = navigation.rank_of(data['distanceA'], data['distanceB'], threshold)
+      counts = self.morph_table.rank_counts(type, threshold)
+      apcer, bpcer = self.morph_table.error_rates(type, threshold)
+
+      data_string += title + ' (threshold ' + format(threshold, '.3f') + '):\n'
+      data_string += '  Average Distance: ' + str(round(data['avgdist'], self.precision)) + '\n'
+      data_string += '  Avg distance to ' + self.morph.get_still1() + ': ' + str(round(data['distanceA'], self.precision)) + '\n'
+      data_string += '  Avg distance to ' + self.morph.get_still2() + ': ' + str(round(data['distanceB'], self.precision)) + '\n'
+      data_string += '  1-Wasserstein (earth mover) distance between above: ' + str(round(data['1-wasserstein'], self.precision)) + '\n'
+      data_string += '  Rank: ' + rank.name + '\n'
+      data_string += ('  All morphs: Rank A ' + str(counts[utils.Rank.A]) + ', Rank B ' + str(counts[utils.Rank.B])
+                      + ', Rank C ' + str(counts[utils.Rank.C]) + '\n')
+      data_string += ('  APCER: ' + str(round(apcer, self.precision))
+                      + ', BPCER: ' + ('n/a (no still csvs)' if np.isnan(bpcer) else str(round(bpcer, self.precision))) + '\n')
+      data_string += '\n'
 
     self.data_label.setText(data_string)
 
@@ -134,19 +203,23 @@ class MainWindow(QtWidgets.QMainWindow):
 
 
   def next_button_clicked(self) -> None:
-    if self.morph_index < len(self.Morphs) - 1:
+    if len(self.view) == 0:
+      return
+    if self.morph_index < len(self.view) - 1:
       self.morph_index += 1
     else:
       self.morph_index = 0
-    self.set_morph(self.Morphs[self.morph_index])
+    self.set_morph(self.Morphs[self.view[self.morph_index]])
     
 
   def previous_button_clicked(self) -> None:
+    if len(self.view) == 0:
+      return
     if self.morph_index != 0:
       self.morph_index -= 1
     else:
-      self.morph_index = len(self.Morphs) - 1
-    self.set_morph(self.Morphs[self.morph_index])
+      self.morph_index = len(self.view) - 1
+    self.set_morph(self.Morphs[self.view[self.morph_index]])
 
   def all_stills1_pressed(self) -> None:
     self.still_window = AllStillsWindow(self.size, self.morph, 1)